@@ -92,6 +92,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Several cashier terminals write at once. IMMEDIATE takes the write
+            # lock when a transaction starts, so a transaction that read first
+            # cannot fail with "database is locked" when it goes on to write;
+            # writers queue for up to `timeout` seconds instead. WAL lets
+            # readers carry on while a write is in progress.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
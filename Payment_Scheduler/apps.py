@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PaymentSchedulerConfig(AppConfig):
     name = 'Payment_Scheduler'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,199 @@
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import (
+    Case, Count, DecimalField, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Customer, CustomerBillingState, DataVersion, Payment
+
+# Keep "pk IN (...)" lists well under SQLite's bound-parameter limit
+REFRESH_CHUNK_SIZE = 500
+
+# Status priorities, lowest first when sorting by status
+OVERDUE = 1
+DUE_TODAY = 2
+DUE_SOON = 3
+UPCOMING = 4
+PAID = 5
+NO_SCHEDULE = 6
+
+STATUS_LABELS = {
+    OVERDUE: "Overdue",
+    DUE_TODAY: "Due Today",
+    DUE_SOON: "Due Soon",
+    UPCOMING: "Upcoming",
+    PAID: "Paid",
+    NO_SCHEDULE: "No Schedule",
+}
+
+STATUS_COLORS = {
+    OVERDUE: 'black',
+    DUE_TODAY: 'red',
+    DUE_SOON: 'yellow',
+    UPCOMING: 'white',
+    PAID: 'green',
+    NO_SCHEDULE: 'white',
+}
+
+
+# Short keys used by the dashboard's status filter and facet counts
+STATUS_KEYS = {
+    OVERDUE: 'overdue',
+    DUE_TODAY: 'due_today',
+    DUE_SOON: 'due_soon',
+    UPCOMING: 'upcoming',
+    PAID: 'paid',
+    NO_SCHEDULE: 'no_schedule',
+}
+STATUS_BY_KEY = {key: priority for priority, key in STATUS_KEYS.items()}
+
+
+def _last_due_date_within(limit):
+    """
+    The latest due date whose following cycle (due + 1 month) falls on or
+    before `limit`. relativedelta clamps month ends (Jan 31 -> Feb 28), so a
+    limit on a month's last day also takes the longer month's last days.
+    """
+    threshold = limit - relativedelta(months=1)
+    if (limit + timedelta(days=1)).day == 1:
+        threshold = threshold + relativedelta(day=31)
+    return threshold
+
+
+def billing_status_case(today, last_paid, cycle_paid, price, due_date='due_date'):
+    """
+    The billing status rules as a single SQL CASE evaluating to a status
+    priority. Arguments name the fields or annotations holding each input,
+    so the same rules serve fresh payment aggregates and the stored
+    CustomerBillingState snapshot.
+    """
+    due_soon_limit = today + timedelta(days=3)
+    fully_paid = Q(**{f'{price}__gt': 0}) & Q(**{f'{cycle_paid}__gte': F(price)})
+    return Case(
+        When(Q(**{last_paid: today}), then=Value(PAID)),
+        # Fully paid but not today -> next month's due date decides
+        When(fully_paid & Q(**{f'{due_date}__lte': _last_due_date_within(due_soon_limit)}), then=Value(DUE_SOON)),
+        When(fully_paid, then=Value(UPCOMING)),
+        When(Q(**{f'{due_date}__isnull': True}), then=Value(NO_SCHEDULE)),
+        When(Q(**{f'{due_date}__lt': today}), then=Value(OVERDUE)),
+        When(Q(**{due_date: today}), then=Value(DUE_TODAY)),
+        When(Q(**{f'{due_date}__lte': due_soon_limit}), then=Value(DUE_SOON)),
+        default=Value(UPCOMING),
+        output_field=IntegerField(),
+    )
+
+
+def with_billing_status(queryset, today=None):
+    """
+    Annotates a Customer queryset with `billing_status` (a status priority)
+    from the billing state snapshot and the current room price.
+    """
+    today = today or timezone.localdate()
+    return queryset.annotate(billing_status=billing_status_case(
+        today,
+        last_paid='billing_state__last_paid',
+        cycle_paid='billing_state__cycle_paid',
+        price='room__price',
+    ))
+
+
+def status_counts(queryset):
+    """
+    Per-status customer counts for a queryset annotated by with_billing_status,
+    in one GROUP BY.
+    """
+    counts = dict.fromkeys(STATUS_KEYS.values(), 0)
+    for row in queryset.order_by().values('billing_status').annotate(count=Count('pk')):
+        counts[STATUS_KEYS[row['billing_status']]] = row['count']
+    return counts
+
+
+def status_text(priority, cycle_paid, price):
+    if price > 0 and 0 < cycle_paid < price:
+        return f"Partially Paid • Balance: ₱{price - cycle_paid:.2f}"
+    return STATUS_LABELS[priority]
+
+
+def refresh_billing_states(customer_ids=None, today=None):
+    """
+    Recomputes the billing state rows for the given customers (all customers
+    when customer_ids is None) in one read and one upsert, with the status
+    taken from billing_status_case.
+    Call it inside the same transaction as the write that changed them.
+    """
+    today = today or timezone.localdate()
+
+    latest_paid = Payment.objects.filter(
+        customer=OuterRef('pk'),
+        is_paid=True,
+        date_paid__isnull=False,
+    ).order_by('-date_paid', '-pk')
+
+    cycle_sum = Payment.objects.filter(
+        customer=OuterRef('pk'),
+        due_date=OuterRef('due_date'),
+        is_paid=True
+    ).values('customer').annotate(total=Sum('amount_received')).values('total')
+
+    customers = Customer.objects.select_related('room').annotate(
+        last_paid=Max('payments__date_paid', filter=Q(payments__is_paid=True)),
+        last_paid_amount=Subquery(latest_paid.values('amount_received')[:1]),
+        cycle_paid=Coalesce(Subquery(cycle_sum), Value(0, output_field=DecimalField())),
+        price=Coalesce(F('room__price'), Value(0, output_field=DecimalField())),
+    ).annotate(
+        billing_status=billing_status_case(today, last_paid='last_paid', cycle_paid='cycle_paid', price='price'),
+    )
+    if customer_ids is None:
+        return _upsert_states(customers, today)
+
+    customer_ids = list(customer_ids)
+    count = 0
+    for start in range(0, len(customer_ids), REFRESH_CHUNK_SIZE):
+        chunk = customer_ids[start:start + REFRESH_CHUNK_SIZE]
+        count += _upsert_states(customers.filter(pk__in=chunk), today)
+    return count
+
+
+def _upsert_states(customers, today):
+    version = DataVersion.current()
+    states = []
+    for customer in customers:
+        price, cycle_paid = customer.price, customer.cycle_paid
+        states.append(CustomerBillingState(
+            customer_id=customer.pk,
+            last_paid=customer.last_paid,
+            last_paid_amount=customer.last_paid_amount or 0,
+            cycle_paid=cycle_paid,
+            balance=max(price - cycle_paid, 0),
+            status_priority=customer.billing_status,
+            status=status_text(customer.billing_status, cycle_paid, price),
+            as_of=today,
+            version=version,
+        ))
+
+    CustomerBillingState.objects.bulk_create(
+        states,
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=['last_paid', 'last_paid_amount', 'cycle_paid', 'balance', 'status_priority', 'status', 'as_of', 'version'],
+    )
+    return len(states)
+
+
+def ensure_billing_states(today=None):
+    """
+    Fills in missing rows and refreshes rows computed on an earlier day.
+    After the first call of the day this is a single cheap query.
+    """
+    today = today or timezone.localdate()
+    stale = list(Customer.objects.filter(
+        Q(billing_state__isnull=True) | Q(billing_state__as_of__lt=today)
+    ).values_list('pk', 'billing_state__as_of'))
+    if stale:
+        if any(as_of is not None for _, as_of in stale):
+            # Day rollover: the new statuses are a change clients need to see, same as a write
+            DataVersion.bump()
+        refresh_billing_states([pk for pk, _ in stale], today)
@@ -0,0 +1,100 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from .models import DataVersion
+
+# Seconds between version checks, to pick up writes made by other processes
+POLL_INTERVAL = 1.0
+
+
+class VersionBroadcaster:
+    """
+    Fans DataVersion changes out to every dashboard event stream in this
+    process. A single coroutine polls the version row, however many clients
+    are connected, and writes committed in this process wake it immediately
+    through notify(). The change payload for the latest version is built
+    once and shared by every stream that was current before it.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._previous = None
+        self._shared = None
+        self._loop = None
+        self._task = None
+        self._changed = None
+        self._wake = None
+        self._listeners = 0
+
+    def notify(self):
+        """Called after a local write commits. Safe to call from any thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_up)
+
+    def _wake_up(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self.version = None
+            self._previous = None
+            self._shared = None
+            self._changed = asyncio.Event()
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            version = await sync_to_async(DataVersion.current)()
+            if version != self.version:
+                self._previous, self.version = self.version, version
+                self._shared = None
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+            if self._listeners == 0:
+                return
+
+    async def wait_for_change(self, version, timeout):
+        """
+        Returns the new version once it is past `version`,
+        or None if nothing changed within `timeout` seconds.
+        """
+        self._ensure_running()
+        self._listeners += 1
+        try:
+            while self.version is None or self.version <= version:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    return None
+            return self.version
+        finally:
+            self._listeners -= 1
+
+    async def changes_since(self, since, build):
+        """
+        What changed after `since`, as returned by build(since) in a worker
+        thread. Streams at the version before the latest one share a single
+        build; a stream further behind builds its own.
+        """
+        if since != self._previous:
+            return await sync_to_async(build)(since)
+        if self._shared is None:
+            self._shared = asyncio.ensure_future(sync_to_async(build)(since))
+        # A stream that disconnects must not cancel the build the others wait on
+        return await asyncio.shield(self._shared)
+
+
+broadcaster = VersionBroadcaster()
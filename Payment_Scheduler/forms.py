@@ -58,30 +58,6 @@ class CustomerForm(forms.ModelForm):
             }),
         }
 
-    def save(self, commit=True):
-        """
-        Custom save logic to automatically mark a room as 'Occupied' 
-        if the number of active customers reaches the room's capacity.
-        """
-        customer = super().save(commit=False)
-        if commit:
-            customer.save()
-            
-            # Check if customer has a room assigned
-            room = customer.room
-            if room:
-                # Count current active occupants in this specific room
-                # (Assumes your Customer model has a 'status' field where 'Active' means staying)
-                active_occupants = Customer.objects.filter(room=room, status='Active').count()
-                
-                # Compare occupants to room capacity
-                if active_occupants >= room.capacity:
-                    room.status = 'Occupied'
-                    room.save()
-        
-        return customer        
-
-        
 
 class BoardingHouseUserForm(forms.ModelForm):
     password = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control'}))
@@ -0,0 +1,187 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Sum, When
+
+from .models import Customer, LedgerAccount, LedgerEntry, Payment
+
+CHARGE = LedgerEntry.CHARGE
+PAYMENT = LedgerEntry.PAYMENT
+ADJUSTMENT = LedgerEntry.ADJUSTMENT
+CREDIT = LedgerEntry.CREDIT
+
+
+def post_entries(entries):
+    """
+    Appends unsaved LedgerEntry objects (customer_id, kind, amount,
+    due_date, memo, payment) to their customers' ledgers in list order,
+    numbering them and carrying each account's running balance forward.
+
+    A charge states what a cycle costs, so posting one is idempotent:
+    - a charge for a cycle older than charged_through is dropped;
+    - a charge for the charged_through cycle posts only the difference, as
+      an adjustment (e.g. after a transfer);
+    - a charge for a later cycle becomes the new current charge.
+    Zero amounts are not posted.
+
+    Accounts are locked and read in one query, and entries and accounts are
+    written in bulk. Call it inside the same transaction as the write the
+    entries describe. Returns the entries posted.
+    """
+    accounts = _lock_accounts(entry.customer_id for entry in entries)
+    posted = _apply(accounts, entries)
+    _save(accounts, posted)
+    return posted
+
+
+def sync_ledgers(customer_ids, memo):
+    """
+    Brings the given customers' ledgers in line with what rebuild_ledgers
+    would derive from their payment rows, room and due date, by posting one
+    adjustment per customer for the difference. For edits that change what
+    is owed without a payment, such as a due date or room changed by hand.
+    Call it inside the edit's transaction. Returns the entries posted.
+    """
+    accounts = _lock_accounts(customer_ids)
+    derived = {pk: LedgerAccount(customer_id=pk) for pk in accounts}
+    _apply(derived, _derived_entries(list(accounts)))
+
+    posted = _apply(accounts, [
+        LedgerEntry(
+            customer_id=pk, kind=ADJUSTMENT, amount=derived[pk].balance - account.balance,
+            due_date=derived[pk].charged_through, memo=memo,
+        )
+        for pk, account in accounts.items()
+    ])
+    for pk, account in accounts.items():
+        account.charged_through = derived[pk].charged_through
+        account.current_charge = derived[pk].current_charge
+    _save(accounts, posted)
+    return posted
+
+
+def _lock_accounts(customer_ids):
+    """The customers' accounts keyed by customer id, locked, with missing ones created."""
+    customer_ids = list(dict.fromkeys(customer_ids))
+    if not customer_ids:
+        return {}
+    accounts = LedgerAccount.objects.select_for_update().in_bulk(customer_ids)
+    missing = [LedgerAccount(customer_id=pk) for pk in customer_ids if pk not in accounts]
+    if missing:
+        LedgerAccount.objects.bulk_create(missing)
+        accounts.update({account.customer_id: account for account in missing})
+    return accounts
+
+
+def _apply(accounts, entries):
+    """Applies entries to in-memory accounts by the rules of post_entries; returns those to save."""
+    posted = []
+    for entry in entries:
+        account = accounts[entry.customer_id]
+        if entry.kind == CHARGE:
+            if account.charged_through and entry.due_date < account.charged_through:
+                continue
+            if account.charged_through == entry.due_date:
+                entry.kind = ADJUSTMENT
+                entry.amount, account.current_charge = entry.amount - account.current_charge, entry.amount
+            else:
+                account.charged_through = entry.due_date
+                account.current_charge = entry.amount
+        elif entry.kind == ADJUSTMENT and entry.due_date == account.charged_through:
+            account.current_charge += entry.amount
+        if not entry.amount:
+            continue
+        account.last_seq += 1
+        account.balance += entry.amount
+        entry.seq = account.last_seq
+        entry.balance = account.balance
+        posted.append(entry)
+    return posted
+
+
+def _save(accounts, posted):
+    """Writes the posted entries and the accounts they moved."""
+    if not accounts:
+        return
+    LedgerEntry.objects.bulk_create(posted)
+    LedgerAccount.objects.bulk_update(
+        list(accounts.values()), ['balance', 'last_seq', 'charged_through', 'current_charge']
+    )
+
+
+def charge_entry(customer_id, due_date, price, memo=None):
+    return LedgerEntry(
+        customer_id=customer_id, kind=CHARGE, amount=price, due_date=due_date,
+        memo=memo or f"Rent for the cycle due {due_date:%b %d, %Y}",
+    )
+
+
+def payment_entry(payment, kind=PAYMENT):
+    """The money received on a Payment row, as a payment or (toward a later cycle) a credit."""
+    return LedgerEntry(
+        customer_id=payment.customer_id, kind=kind, amount=-(payment.amount_received or 0),
+        due_date=payment.due_date, payment=payment, memo=payment.remarks or '',
+    )
+
+
+def rebuild_ledgers(customer_ids):
+    """
+    Replaces the given customers' ledgers with one derived from their
+    payment rows (see _derived_entries). Returns the number of entries posted.
+    """
+    LedgerEntry.objects.filter(customer__in=customer_ids).delete()
+    LedgerAccount.objects.filter(customer__in=customer_ids).delete()
+    return len(post_entries(_derived_entries(customer_ids)))
+
+
+def total_arrears(today):
+    """The sum of LedgerAccount.arrears(today) over every account, as one aggregate."""
+    arrears = Case(
+        When(charged_through__gt=today, then=F('balance') - F('current_charge')),
+        default=F('balance'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    total = LedgerAccount.objects.annotate(due=arrears).filter(due__gt=0).aggregate(total=Sum('due'))['total']
+    return total or Decimal('0')
+
+
+def _derived_entries(customer_ids):
+    """
+    The ledger entries the customers' payment rows imply:
+    - every cycle before the current due date was settled, so it is
+      charged what was paid toward it (at least its recorded price);
+    - the current cycle is charged the room's price;
+    - rows for later cycles are skipped: the only money on them is transfer
+      credit, which is surplus already counted in the current cycle.
+    Only the columns read here are selected, so migration 0024 can run it
+    before later migrations add columns to these tables.
+    """
+    payments = defaultdict(lambda: defaultdict(list))
+    for payment in (
+        Payment.objects.filter(customer__in=customer_ids)
+        .only('customer', 'due_date', 'date_paid', 'is_paid', 'amount', 'amount_received', 'remarks')
+        .order_by('due_date', 'date_paid', 'pk')
+    ):
+        payments[payment.customer_id][payment.due_date].append(payment)
+
+    entries = []
+    customers = (
+        Customer.objects.filter(pk__in=customer_ids).select_related('room')
+        .only('due_date', 'room__price').order_by('pk')
+    )
+    for customer in customers:
+        cycles = payments[customer.pk]
+        if customer.due_date and customer.room and customer.due_date not in cycles:
+            cycles[customer.due_date] = []
+        for due_date in sorted(cycles):
+            if customer.due_date and due_date > customer.due_date:
+                break
+            paid = [payment for payment in cycles[due_date] if payment.is_paid]
+            if due_date == customer.due_date:
+                price = customer.room.price if customer.room else Decimal('0')
+            else:
+                received = sum((payment.amount_received or 0 for payment in paid), Decimal('0'))
+                price = max([received] + [payment.amount for payment in cycles[due_date]])
+            entries.append(charge_entry(customer.pk, due_date, price))
+            entries.extend(payment_entry(payment) for payment in paid)
+    return entries
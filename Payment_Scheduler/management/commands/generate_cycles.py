@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from Payment_Scheduler.ledger import charge_entry, post_entries
+from Payment_Scheduler.models import Customer, Payment
+from Payment_Scheduler.signals import notify_bulk_write
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates an open (unpaid) payment row for the cycle each active "
+        "customer owes next, i.e. their current due date, at their room's "
+        "current price, and charges it to their ledger. Cycles that already "
+        "have a payment row are skipped, so the command can be run again "
+        "safely, e.g. daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows written per transaction (default 1000).")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        # Served by payment_cycle_idx (customer, due_date, ...)
+        has_cycle_row = Payment.objects.filter(customer=OuterRef('pk'), due_date=OuterRef('due_date'))
+        due = (
+            Customer.objects.filter(status='Active', due_date__isnull=False, room__isnull=False)
+            .exclude(Exists(has_cycle_row))
+            .order_by('pk')
+            .values_list('pk', 'due_date', 'room__price')
+        )
+
+        # Read in primary-key chunks rather than through one open cursor, so
+        # each batch is written with no read in progress
+        created = 0
+        last_pk = 0
+        while True:
+            rows = list(due.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            created += self.flush([
+                Payment(customer_id=customer_id, due_date=due_date, amount=price)
+                for customer_id, due_date, price in rows
+            ])
+
+        if created:
+            # bulk_create() sends no model signals
+            notify_bulk_write()
+        self.stdout.write(self.style.SUCCESS(f"Opened {created} billing cycles."))
+
+    def flush(self, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            # Re-checked inside the transaction: a cashier may have paid since the read
+            taken = set(
+                Payment.objects.filter(
+                    customer__in=[payment.customer_id for payment in batch],
+                    due_date__in={payment.due_date for payment in batch},
+                ).values_list('customer', 'due_date')
+            )
+            rows = [payment for payment in batch if (payment.customer_id, payment.due_date) not in taken]
+            Payment.objects.bulk_create(rows)
+            post_entries([charge_entry(payment.customer_id, payment.due_date, payment.amount) for payment in rows])
+        return len(rows)
@@ -0,0 +1,232 @@
+import csv
+import json
+from decimal import Decimal
+
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Payment_Scheduler.billing import refresh_billing_states
+from Payment_Scheduler.forms import CustomerForm, RoomForm
+from Payment_Scheduler.ledger import charge_entry, payment_entry, post_entries, sync_ledgers
+from Payment_Scheduler.models import Customer, Payment, Room
+from Payment_Scheduler.occupancy import reconcile_room_statuses
+from Payment_Scheduler.signals import notify_bulk_write
+
+
+class RoomImportForm(RoomForm):
+    def validate_unique(self):
+        # Room numbers are checked against the in-memory set instead of one query per row
+        pass
+
+
+class CustomerImportForm(CustomerForm):
+    class Meta(CustomerForm.Meta):
+        # The room is resolved from room_number through the in-memory map
+        fields = [f for f in CustomerForm.Meta.fields if f != 'room']
+
+
+class PaymentImportForm(forms.ModelForm):
+    class Meta:
+        model = Payment
+        fields = ['due_date', 'previous_date', 'amount', 'remarks', 'is_paid', 'date_paid', 'amount_received', 'change_amount']
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports rooms, customers or payments from a CSV or JSON Lines file. "
+        "Rows are validated with the app's forms, written with bulk_create in "
+        "batches, and rows already in the database are skipped, so an "
+        "interrupted import can simply be run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['rooms', 'customers', 'payments'])
+        parser.add_argument('path', help="A .csv file with a header row, or a .jsonl file with one object per line.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows written per transaction (default 1000).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        importer = getattr(self, f"import_{options['kind']}")
+        self.batch_size = options['batch_size']
+        self.counts = {'imported': 0, 'skipped': 0, 'invalid': 0}
+
+        importer(self.read_rows(options['path']))
+
+        # Bulk writes send no model signals
+        with transaction.atomic():
+            reconcile_room_statuses()
+            notify_bulk_write()
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['kind'].capitalize()}: {self.counts['imported']} imported, "
+            f"{self.counts['skipped']} already present, {self.counts['invalid']} invalid."
+        ))
+
+    def read_rows(self, path):
+        """Yields (line_number, row) pairs without loading the whole file."""
+        try:
+            handle = open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot open {path}: {e}")
+        with handle:
+            if path.endswith(('.jsonl', '.ndjson')):
+                for line_number, line in enumerate(handle, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError as e:
+                        self.reject(line_number, f"not valid JSON ({e})")
+            else:
+                # Line 1 is the header
+                for line_number, row in enumerate(csv.DictReader(handle), start=2):
+                    yield line_number, row
+
+    def reject(self, line_number, errors):
+        self.counts['invalid'] += 1
+        if isinstance(errors, dict):
+            errors = '; '.join(f"{field}: {' '.join(messages)}" for field, messages in errors.items())
+        self.stderr.write(f"Line {line_number}: {errors}")
+
+    def flush(self, model, batch, after=None):
+        if not batch:
+            return
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+            if after:
+                after(batch)
+        self.counts['imported'] += len(batch)
+        self.stdout.write(f"  {self.counts['imported']} imported...")
+        batch.clear()
+
+    def import_rooms(self, rows):
+        seen = set(Room.objects.values_list('room_number', flat=True))
+        batch = []
+        for line_number, row in rows:
+            form = RoomImportForm(data=_with_defaults(Room, row))
+            if not form.is_valid():
+                self.reject(line_number, form.errors)
+                continue
+            room = form.save(commit=False)
+            if room.room_number in seen:
+                self.counts['skipped'] += 1
+                continue
+            seen.add(room.room_number)
+            batch.append(room)
+            if len(batch) >= self.batch_size:
+                self.flush(Room, batch)
+        self.flush(Room, batch)
+
+    def import_customers(self, rows):
+        """
+        Rows may carry customer_id (kept as the primary key) and room_number.
+        A row is already present if its customer_id exists or, without one,
+        a customer with the same name and date_entry does.
+        """
+        rooms = dict(Room.objects.values_list('room_number', 'id'))
+        seen_ids = set(Customer.objects.values_list('pk', flat=True))
+        seen_keys = set(Customer.objects.values_list('name', 'date_entry'))
+        batch = []
+        for line_number, row in rows:
+            room_number = row.get('room_number') or None
+            if room_number is not None and str(room_number) not in rooms:
+                self.reject(line_number, f"room_number: unknown room {room_number}")
+                continue
+            form = CustomerImportForm(data=_with_defaults(Customer, row))
+            if not form.is_valid():
+                self.reject(line_number, form.errors)
+                continue
+            customer = form.save(commit=False)
+            customer.room_id = rooms[str(room_number)] if room_number is not None else None
+            customer_id = row.get('customer_id') or None
+            if customer_id is not None:
+                try:
+                    customer.pk = int(customer_id)
+                except (TypeError, ValueError):
+                    self.reject(line_number, f"customer_id: {customer_id} is not a number")
+                    continue
+                if customer.pk in seen_ids:
+                    self.counts['skipped'] += 1
+                    continue
+            elif (customer.name, customer.date_entry) in seen_keys:
+                self.counts['skipped'] += 1
+                continue
+            seen_ids.add(customer.pk)
+            seen_keys.add((customer.name, customer.date_entry))
+            batch.append(customer)
+            if len(batch) >= self.batch_size:
+                self.flush(Customer, batch, after=self.refresh_customers)
+        self.flush(Customer, batch, after=self.refresh_customers)
+
+    def import_payments(self, rows):
+        """
+        Rows carry customer_id and may carry id (kept as the primary key).
+        Without an id, a payment is already present if one exists with the
+        same customer, due date, payment date and amount received.
+        """
+        customer_ids = set(Customer.objects.values_list('pk', flat=True))
+        seen_ids = set(Payment.objects.values_list('pk', flat=True))
+        seen_keys = set(Payment.objects.values_list('customer_id', 'due_date', 'date_paid', 'amount_received'))
+        batch = []
+        for line_number, row in rows:
+            try:
+                customer_id = int(row.get('customer_id'))
+            except (TypeError, ValueError):
+                self.reject(line_number, "customer_id: a customer id is required")
+                continue
+            if customer_id not in customer_ids:
+                self.reject(line_number, f"customer_id: unknown customer {customer_id}")
+                continue
+            form = PaymentImportForm(data=_with_defaults(Payment, row))
+            if not form.is_valid():
+                self.reject(line_number, form.errors)
+                continue
+            payment = form.save(commit=False)
+            payment.customer_id = customer_id
+            key = (customer_id, payment.due_date, payment.date_paid, payment.amount_received)
+            if row.get('id'):
+                try:
+                    payment.pk = int(row['id'])
+                except (TypeError, ValueError):
+                    self.reject(line_number, f"id: {row['id']} is not a number")
+                    continue
+                if payment.pk in seen_ids:
+                    self.counts['skipped'] += 1
+                    continue
+            elif key in seen_keys:
+                self.counts['skipped'] += 1
+                continue
+            seen_ids.add(payment.pk)
+            seen_keys.add(key)
+            batch.append(payment)
+            if len(batch) >= self.batch_size:
+                self.flush(Payment, batch, after=self.refresh_payments)
+        self.flush(Payment, batch, after=self.refresh_payments)
+
+    def refresh_customers(self, customers):
+        # Each customer's first cycle is owed from the start, as in customer_create
+        prices = dict(Room.objects.filter(pk__in={c.room_id for c in customers}).values_list('pk', 'price'))
+        post_entries([
+            charge_entry(customer.pk, customer.due_date, prices[customer.room_id])
+            for customer in customers if customer.due_date and customer.room_id
+        ])
+        refresh_billing_states([customer.pk for customer in customers])
+
+    def refresh_payments(self, payments):
+        customer_ids = {payment.customer_id for payment in payments}
+        # Imported rows are history, often for cycles already charged past: post
+        # the money received, then true the charges up to what the rows imply
+        post_entries([payment_entry(payment) for payment in payments if payment.is_paid])
+        sync_ledgers(customer_ids, "Charges for imported payments")
+        refresh_billing_states(customer_ids)
+
+
+def _with_defaults(model, row):
+    """Fills columns missing from the row with the model field's default, as a form post would carry."""
+    data = {key: value for key, value in row.items() if value is not None}
+    for field in model._meta.concrete_fields:
+        if field.name not in data and field.has_default():
+            default = field.get_default()
+            data[field.name] = str(default) if isinstance(default, Decimal) else default
+    return data
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Payment_Scheduler.billing import refresh_billing_states
+from Payment_Scheduler.models import CustomerBillingState
+
+
+class Command(BaseCommand):
+    help = "Recomputes the dashboard billing state for every customer from the payment records."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            CustomerBillingState.objects.all().delete()
+            count = refresh_billing_states()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt billing state for {count} customers."))
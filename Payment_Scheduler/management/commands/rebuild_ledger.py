@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Payment_Scheduler.ledger import rebuild_ledgers
+from Payment_Scheduler.models import Customer
+
+# Customers rebuilt per transaction
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds every customer's ledger and running balance from the payment "
+        "records. Run it once after upgrading to a version with the ledger."
+    )
+
+    def handle(self, *args, **options):
+        customer_ids = list(Customer.objects.order_by('pk').values_list('pk', flat=True))
+        count = 0
+        for start in range(0, len(customer_ids), CHUNK_SIZE):
+            with transaction.atomic():
+                count += rebuild_ledgers(customer_ids[start:start + CHUNK_SIZE])
+        self.stdout.write(self.style.SUCCESS(f"Posted {count} ledger entries for {len(customer_ids)} customers."))
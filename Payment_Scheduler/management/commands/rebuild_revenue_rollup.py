@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Payment_Scheduler.revenue import rebuild_revenue_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the monthly revenue rollup (paid totals per month and "
+        "room) from the payment records. Triggers keep it current on every "
+        "write; run this if it is ever suspected to have drifted."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_revenue_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} monthly revenue rows."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Payment_Scheduler.occupancy import reconcile_room_statuses
+
+
+class Command(BaseCommand):
+    help = "Sets every room's Available/Occupied status from its current occupant count."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = reconcile_room_statuses()
+        self.stdout.write(self.style.SUCCESS(f"Updated the status of {count} rooms."))
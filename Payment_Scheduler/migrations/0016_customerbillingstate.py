@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-17 02:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0015_fix_null_customer_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBillingState',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='billing_state', serialize=False, to='Payment_Scheduler.customer')),
+                ('last_paid', models.DateField(blank=True, db_index=True, null=True)),
+                ('last_paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('cycle_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status_priority', models.IntegerField(db_index=True, default=6)),
+                ('status', models.CharField(blank=True, max_length=100)),
+                ('as_of', models.DateField(db_index=True)),
+            ],
+        ),
+    ]
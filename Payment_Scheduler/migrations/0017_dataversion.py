@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    DataVersion = apps.get_model('Payment_Scheduler', 'DataVersion')
+    DataVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0016_customerbillingstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0017_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerbillingstate',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
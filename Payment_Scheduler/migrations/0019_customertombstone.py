@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-17 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0018_customerbillingstate_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_id', models.IntegerField()),
+                ('version', models.BigIntegerField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0019_customertombstone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['room', 'status'], name='customer_room_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['due_date'], name='customer_due_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['date_entry'], name='customer_date_entry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'due_date', 'is_paid', 'amount_received'], name='payment_cycle_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('is_paid', True)), fields=['date_paid'], name='payment_paid_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomtransferhistory',
+            index=models.Index(fields=['transfer_date'], name='transfer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 6.0 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+# Keep Room.active_count equal to the number of Active customers in the room.
+# Covers every write path, including QuerySet.update() and the SET NULL
+# cascade when a room is deleted, since none of them go through Python.
+# SQLite drops a table's triggers when a migration rebuilds that table, so a
+# later migration that alters Customer must run create_triggers again.
+TRIGGERS = [
+    """
+    CREATE TRIGGER room_active_count_insert
+    AFTER INSERT ON "Payment_Scheduler_customer"
+    WHEN NEW.status = 'Active' AND NEW.room_id IS NOT NULL
+    BEGIN
+        UPDATE "Payment_Scheduler_room" SET active_count = active_count + 1 WHERE id = NEW.room_id;
+    END
+    """,
+    """
+    CREATE TRIGGER room_active_count_delete
+    AFTER DELETE ON "Payment_Scheduler_customer"
+    WHEN OLD.status = 'Active' AND OLD.room_id IS NOT NULL
+    BEGIN
+        UPDATE "Payment_Scheduler_room" SET active_count = active_count - 1 WHERE id = OLD.room_id;
+    END
+    """,
+    """
+    CREATE TRIGGER room_active_count_update
+    AFTER UPDATE OF room_id, status ON "Payment_Scheduler_customer"
+    WHEN (OLD.status = 'Active' AND OLD.room_id IS NOT NULL)
+      OR (NEW.status = 'Active' AND NEW.room_id IS NOT NULL)
+    BEGIN
+        UPDATE "Payment_Scheduler_room" SET active_count = active_count - 1
+        WHERE id = OLD.room_id AND OLD.status = 'Active';
+        UPDATE "Payment_Scheduler_room" SET active_count = active_count + 1
+        WHERE id = NEW.room_id AND NEW.status = 'Active';
+    END
+    """,
+]
+
+TRIGGER_NAMES = ['room_active_count_insert', 'room_active_count_delete', 'room_active_count_update']
+
+BACKFILL = """
+    UPDATE "Payment_Scheduler_room" SET active_count = (
+        SELECT COUNT(*) FROM "Payment_Scheduler_customer"
+        WHERE "Payment_Scheduler_customer".room_id = "Payment_Scheduler_room".id
+          AND "Payment_Scheduler_customer".status = 'Active'
+    )
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise RuntimeError('Room.active_count triggers are only defined for SQLite')
+    for sql in TRIGGERS:
+        schema_editor.execute(sql)
+    schema_editor.execute(BACKFILL)
+
+
+def drop_triggers(apps, schema_editor):
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0020_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='active_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 6.0 on 2026-10-17 05:15
+
+from django.db import migrations
+
+# Full-text index over customer name, contact numbers, parents' names and room
+# number, with rowid = customer_id. The trigram tokenizer matches any
+# substring of three or more characters, case-insensitively. Triggers on the
+# customer and room tables keep it in step with every write path.
+# SQLite drops a table's triggers when a migration rebuilds that table, so a
+# later migration that alters Customer or Room must run create_index again.
+CUSTOMER_ROW = """
+    SELECT {c}.customer_id, {c}.name, {c}.contact_number, {c}.parents_name,
+           {c}.parents_contact_number,
+           (SELECT room_number FROM "Payment_Scheduler_room" WHERE id = {c}.room_id)
+"""
+
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE customer_search USING fts5(
+        name, contact_number, parents_name, parents_contact_number, room_number,
+        tokenize = 'trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER customer_search_insert
+    AFTER INSERT ON "Payment_Scheduler_customer"
+    BEGIN
+        INSERT INTO customer_search (rowid, name, contact_number, parents_name, parents_contact_number, room_number)
+        {CUSTOMER_ROW.format(c='NEW')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER customer_search_update
+    AFTER UPDATE OF name, contact_number, parents_name, parents_contact_number, room_id
+    ON "Payment_Scheduler_customer"
+    BEGIN
+        DELETE FROM customer_search WHERE rowid = OLD.customer_id;
+        INSERT INTO customer_search (rowid, name, contact_number, parents_name, parents_contact_number, room_number)
+        {CUSTOMER_ROW.format(c='NEW')};
+    END
+    """,
+    """
+    CREATE TRIGGER customer_search_delete
+    AFTER DELETE ON "Payment_Scheduler_customer"
+    BEGIN
+        DELETE FROM customer_search WHERE rowid = OLD.customer_id;
+    END
+    """,
+    """
+    CREATE TRIGGER customer_search_room_number
+    AFTER UPDATE OF room_number ON "Payment_Scheduler_room"
+    BEGIN
+        UPDATE customer_search SET room_number = NEW.room_number
+        WHERE rowid IN (SELECT customer_id FROM "Payment_Scheduler_customer" WHERE room_id = NEW.id);
+    END
+    """,
+]
+
+BACKFILL = f"""
+    INSERT INTO customer_search (rowid, name, contact_number, parents_name, parents_contact_number, room_number)
+    {CUSTOMER_ROW.format(c='"Payment_Scheduler_customer"')}
+    FROM "Payment_Scheduler_customer"
+"""
+
+DROP = [
+    'DROP TRIGGER IF EXISTS customer_search_insert',
+    'DROP TRIGGER IF EXISTS customer_search_update',
+    'DROP TRIGGER IF EXISTS customer_search_delete',
+    'DROP TRIGGER IF EXISTS customer_search_room_number',
+    'DROP TABLE IF EXISTS customer_search',
+]
+
+
+def create_index(apps, schema_editor):
+    # Other backends keep the icontains search (see search.find_customers)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP + SCHEMA:
+        schema_editor.execute(sql)
+    schema_editor.execute(BACKFILL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0021_room_active_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
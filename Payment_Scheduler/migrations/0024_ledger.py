@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-17 05:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_ledgers(apps, schema_editor):
+    # Existing customers start with the ledger their payment rows imply, so
+    # what they owe is the same after the migration as before it
+    from Payment_Scheduler.ledger import rebuild_ledgers
+
+    Customer = apps.get_model('Payment_Scheduler', 'Customer')
+    rebuild_ledgers(list(Customer.objects.values_list('pk', flat=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0023_payment_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_account', serialize=False, to='Payment_Scheduler.customer')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_seq', models.PositiveIntegerField(default=0)),
+                ('charged_through', models.DateField(blank=True, null=True)),
+                ('current_charge', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('charge', 'Charge'), ('payment', 'Payment'), ('adjustment', 'Adjustment'), ('credit', 'Credit')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('due_date', models.DateField(blank=True, null=True)),
+                ('memo', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='Payment_Scheduler.customer')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='Payment_Scheduler.payment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer', 'seq'), name='ledger_entry_customer_seq')],
+            },
+        ),
+        migrations.RunPython(backfill_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 6.0 on 2026-10-17 06:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Keep one BillingCycle row per (customer, due_date) that has payment rows,
+# recomputed from that cycle's payments whenever one of them is written. The
+# recompute reads only the cycle's rows through payment_cycle_idx, and covers
+# bulk_create(), bulk_update(), QuerySet.update() and cascades alike.
+# SQLite drops a table's triggers when a migration rebuilds that table, so a
+# later migration that alters Payment must run create_triggers again.
+CYCLE_TOTALS = """
+    SELECT customer_id, due_date, amount_due, total_received, total_change, last_paid, payment_count,
+           CASE WHEN amount_due > 0 AND total_received >= amount_due THEN 'Paid'
+                WHEN total_received > 0 THEN 'Partially Paid'
+                ELSE 'Unpaid' END
+    FROM (
+        SELECT customer_id, due_date,
+               COALESCE(MAX(amount), 0) AS amount_due,
+               COALESCE(SUM(CASE WHEN is_paid THEN amount_received END), 0) AS total_received,
+               COALESCE(SUM(CASE WHEN is_paid THEN change_amount END), 0) AS total_change,
+               MAX(CASE WHEN is_paid THEN date_paid END) AS last_paid,
+               COALESCE(SUM(is_paid), 0) AS payment_count
+        FROM "Payment_Scheduler_payment"
+        {where}
+        GROUP BY customer_id, due_date
+    )
+"""
+
+COLUMNS = 'customer_id, due_date, amount_due, total_received, total_change, last_paid, payment_count, status'
+
+
+def recompute(row):
+    return f"""
+        DELETE FROM "Payment_Scheduler_billingcycle" WHERE customer_id = {row}.customer_id AND due_date = {row}.due_date;
+        INSERT INTO "Payment_Scheduler_billingcycle" ({COLUMNS})
+        {CYCLE_TOTALS.format(where=f'WHERE customer_id = {row}.customer_id AND due_date = {row}.due_date')};
+    """
+
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER billing_cycle_insert
+    AFTER INSERT ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER billing_cycle_update
+    AFTER UPDATE OF customer_id, due_date, amount, is_paid, amount_received, change_amount, date_paid
+    ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('OLD')}
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER billing_cycle_delete
+    AFTER DELETE ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('OLD')}
+    END
+    """,
+]
+
+TRIGGER_NAMES = ['billing_cycle_insert', 'billing_cycle_update', 'billing_cycle_delete']
+
+BACKFILL = f"""
+    INSERT INTO "Payment_Scheduler_billingcycle" ({COLUMNS})
+    {CYCLE_TOTALS.format(where='')}
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise RuntimeError('BillingCycle triggers are only defined for SQLite')
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for sql in TRIGGERS:
+        schema_editor.execute(sql)
+    schema_editor.execute('DELETE FROM "Payment_Scheduler_billingcycle"')
+    schema_editor.execute(BACKFILL)
+
+
+def drop_triggers(apps, schema_editor):
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0024_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('amount_due', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10)),
+                ('total_change', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10)),
+                ('last_paid', models.DateField(blank=True, editable=False, null=True)),
+                ('payment_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('status', models.CharField(editable=False, max_length=20)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='billing_cycles', to='Payment_Scheduler.customer')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer', 'due_date'), name='billing_cycle_customer_due')],
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0025_billing_cycle'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('is_paid', True)), fields=['customer', 'date_paid'], name='payment_customer_paid_idx'),
+        ),
+    ]
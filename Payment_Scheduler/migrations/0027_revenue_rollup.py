@@ -0,0 +1,129 @@
+# Generated by Django 6.0 on 2026-10-17 06:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Keep one RevenueRollup row per (month of date_paid, payer's room) that has
+# paid payments, recomputed whenever a payment in it is written. The
+# recompute reads only the room's customers' paid rows for that month,
+# through payment_customer_paid_idx, and covers bulk_create(), bulk_update(),
+# QuerySet.update() and cascades alike. Moving a customer to another room recomputes the old and new room's
+# months that the customer paid in.
+# SQLite drops a table's triggers when a migration rebuilds that table, so a
+# later migration that alters Payment or Customer must run create_triggers again.
+ROLLUP_TOTALS = """
+    SELECT date(p.date_paid, 'start of month') AS paid_month, c.room_id,
+           COALESCE(SUM(p.amount_received), 0), COUNT(*), COUNT(DISTINCT p.customer_id)
+    FROM "Payment_Scheduler_payment" p
+    JOIN "Payment_Scheduler_customer" c ON c.customer_id = p.customer_id
+    WHERE p.is_paid AND p.date_paid IS NOT NULL {where}
+    GROUP BY paid_month, c.room_id
+"""
+
+COLUMNS = 'month, room_id, total_received, payment_count, payer_count'
+
+
+def recompute(row):
+    month = f"date({row}.date_paid, 'start of month')"
+    room = f'(SELECT room_id FROM "Payment_Scheduler_customer" WHERE customer_id = {row}.customer_id)'
+    where = f"AND p.date_paid >= {month} AND p.date_paid < date({month}, '+1 month') AND c.room_id IS {room}"
+    return f"""
+        DELETE FROM "Payment_Scheduler_revenuerollup" WHERE month = {month} AND room_id IS {room};
+        INSERT INTO "Payment_Scheduler_revenuerollup" ({COLUMNS})
+        {ROLLUP_TOTALS.format(where=where)};
+    """
+
+
+# The months a customer has paid in
+CUSTOMER_MONTHS = """
+    SELECT date(date_paid, 'start of month') FROM "Payment_Scheduler_payment"
+    WHERE customer_id = NEW.customer_id AND is_paid AND date_paid IS NOT NULL
+"""
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER revenue_rollup_insert
+    AFTER INSERT ON "Payment_Scheduler_payment"
+    WHEN NEW.is_paid
+    BEGIN
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_update
+    AFTER UPDATE OF customer_id, is_paid, amount_received, date_paid
+    ON "Payment_Scheduler_payment"
+    WHEN OLD.is_paid OR NEW.is_paid
+    BEGIN
+        {recompute('OLD')}
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_delete
+    AFTER DELETE ON "Payment_Scheduler_payment"
+    WHEN OLD.is_paid
+    BEGIN
+        {recompute('OLD')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_customer_room
+    AFTER UPDATE OF room_id ON "Payment_Scheduler_customer"
+    WHEN OLD.room_id IS NOT NEW.room_id
+    BEGIN
+        DELETE FROM "Payment_Scheduler_revenuerollup"
+        WHERE (room_id IS OLD.room_id OR room_id IS NEW.room_id) AND month IN ({CUSTOMER_MONTHS});
+        INSERT INTO "Payment_Scheduler_revenuerollup" ({COLUMNS})
+        {ROLLUP_TOTALS.format(where=f"AND (c.room_id IS OLD.room_id OR c.room_id IS NEW.room_id) AND date(p.date_paid, 'start of month') IN ({CUSTOMER_MONTHS})")};
+    END
+    """,
+]
+
+TRIGGER_NAMES = ['revenue_rollup_insert', 'revenue_rollup_update', 'revenue_rollup_delete', 'revenue_rollup_customer_room']
+
+BACKFILL = f"""
+    INSERT INTO "Payment_Scheduler_revenuerollup" ({COLUMNS})
+    {ROLLUP_TOTALS.format(where='')}
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise RuntimeError('RevenueRollup triggers are only defined for SQLite')
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for sql in TRIGGERS:
+        schema_editor.execute(sql)
+    schema_editor.execute('DELETE FROM "Payment_Scheduler_revenuerollup"')
+    schema_editor.execute(BACKFILL)
+
+
+def drop_triggers(apps, schema_editor):
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0026_payment_customer_paid_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+                ('payment_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('payer_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='Payment_Scheduler.room')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('month', 'room'), name='revenue_rollup_month_room')],
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 6.0 on 2026-10-17 07:00
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Recreate the 0025 triggers so a cycle also totals the amount_received on
+# its unpaid rows (transfer credit toward a cycle not yet settled) as
+# total_credited, and its status counts that credit as the payment history
+# always did: a credited cycle reads "Partially Paid". total_received,
+# total_change, last_paid and payment_count still count paid rows only.
+CYCLE_TOTALS = """
+    SELECT customer_id, due_date, amount_due, total_received, total_credited, total_change, last_paid, payment_count,
+           CASE WHEN amount_due > 0 AND total_received + total_credited >= amount_due THEN 'Paid'
+                WHEN total_received + total_credited > 0 THEN 'Partially Paid'
+                ELSE 'Unpaid' END
+    FROM (
+        SELECT customer_id, due_date,
+               COALESCE(MAX(amount), 0) AS amount_due,
+               COALESCE(SUM(CASE WHEN is_paid THEN amount_received END), 0) AS total_received,
+               COALESCE(SUM(CASE WHEN NOT is_paid THEN amount_received END), 0) AS total_credited,
+               COALESCE(SUM(CASE WHEN is_paid THEN change_amount END), 0) AS total_change,
+               MAX(CASE WHEN is_paid THEN date_paid END) AS last_paid,
+               COALESCE(SUM(is_paid), 0) AS payment_count
+        FROM "Payment_Scheduler_payment"
+        {where}
+        GROUP BY customer_id, due_date
+    )
+"""
+
+COLUMNS = 'customer_id, due_date, amount_due, total_received, total_credited, total_change, last_paid, payment_count, status'
+
+
+def recompute(row):
+    return f"""
+        DELETE FROM "Payment_Scheduler_billingcycle" WHERE customer_id = {row}.customer_id AND due_date = {row}.due_date;
+        INSERT INTO "Payment_Scheduler_billingcycle" ({COLUMNS})
+        {CYCLE_TOTALS.format(where=f'WHERE customer_id = {row}.customer_id AND due_date = {row}.due_date')};
+    """
+
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER billing_cycle_insert
+    AFTER INSERT ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER billing_cycle_update
+    AFTER UPDATE OF customer_id, due_date, amount, is_paid, amount_received, change_amount, date_paid
+    ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('OLD')}
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER billing_cycle_delete
+    AFTER DELETE ON "Payment_Scheduler_payment"
+    BEGIN
+        {recompute('OLD')}
+    END
+    """,
+]
+
+TRIGGER_NAMES = ['billing_cycle_insert', 'billing_cycle_update', 'billing_cycle_delete']
+
+BACKFILL = f"""
+    INSERT INTO "Payment_Scheduler_billingcycle" ({COLUMNS})
+    {CYCLE_TOTALS.format(where='')}
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise RuntimeError('BillingCycle triggers are only defined for SQLite')
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for sql in TRIGGERS:
+        schema_editor.execute(sql)
+    schema_editor.execute('DELETE FROM "Payment_Scheduler_billingcycle"')
+    schema_editor.execute(BACKFILL)
+
+
+def drop_triggers(apps, schema_editor):
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def restore_triggers(apps, schema_editor):
+    import_module('Payment_Scheduler.migrations.0025_billing_cycle').create_triggers(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0027_revenue_rollup'),
+    ]
+
+    # SQLite rebuilds the table to add the column, which fails while triggers
+    # name it, so they are dropped around the change either way
+    operations = [
+        migrations.RunPython(drop_triggers, restore_triggers),
+        migrations.AddField(
+            model_name='billingcycle',
+            name='total_credited',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,156 @@
+# Generated by Django 6.0 on 2026-10-17 07:30
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Record on each paid payment the room its customer was in when it was paid,
+# and key RevenueRollup rows to that room instead of the customer's current
+# one, so a transfer no longer moves past revenue. A paid row written without
+# a room (bulk_create(), QuerySet.update(), the admin) takes the customer's
+# room from a trigger; rows paid before this migration are backfilled with
+# the customer's current room, the best record there is.
+# SQLite drops a table's triggers when a migration rebuilds that table, so a
+# later migration that alters Payment must run create_triggers again.
+SET_ROOM = """
+    UPDATE "Payment_Scheduler_payment"
+    SET room_id = (SELECT room_id FROM "Payment_Scheduler_customer" WHERE customer_id = NEW.customer_id)
+    WHERE id = NEW.id;
+"""
+
+ROLLUP_TOTALS = """
+    SELECT date(date_paid, 'start of month') AS paid_month, room_id,
+           COALESCE(SUM(amount_received), 0), COUNT(*), COUNT(DISTINCT customer_id)
+    FROM "Payment_Scheduler_payment"
+    WHERE is_paid AND date_paid IS NOT NULL {where}
+    GROUP BY paid_month, room_id
+"""
+
+COLUMNS = 'month, room_id, total_received, payment_count, payer_count'
+
+
+def recompute(row):
+    month = f"date({row}.date_paid, 'start of month')"
+    where = f"AND date_paid >= {month} AND date_paid < date({month}, '+1 month') AND room_id IS {row}.room_id"
+    return f"""
+        DELETE FROM "Payment_Scheduler_revenuerollup" WHERE month = {month} AND room_id IS {row}.room_id;
+        INSERT INTO "Payment_Scheduler_revenuerollup" ({COLUMNS})
+        {ROLLUP_TOTALS.format(where=where)};
+    """
+
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER payment_room_insert
+    AFTER INSERT ON "Payment_Scheduler_payment"
+    WHEN NEW.is_paid AND NEW.room_id IS NULL
+    BEGIN
+        {SET_ROOM}
+    END
+    """,
+    f"""
+    CREATE TRIGGER payment_room_paid
+    AFTER UPDATE OF is_paid ON "Payment_Scheduler_payment"
+    WHEN NEW.is_paid AND NOT OLD.is_paid AND NEW.room_id IS NULL
+    BEGIN
+        {SET_ROOM}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_insert
+    AFTER INSERT ON "Payment_Scheduler_payment"
+    WHEN NEW.is_paid
+    BEGIN
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_update
+    AFTER UPDATE OF customer_id, room_id, is_paid, amount_received, date_paid
+    ON "Payment_Scheduler_payment"
+    WHEN OLD.is_paid OR NEW.is_paid
+    BEGIN
+        {recompute('OLD')}
+        {recompute('NEW')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER revenue_rollup_delete
+    AFTER DELETE ON "Payment_Scheduler_payment"
+    WHEN OLD.is_paid
+    BEGIN
+        {recompute('OLD')}
+    END
+    """,
+]
+
+TRIGGER_NAMES = [
+    'payment_room_insert', 'payment_room_paid',
+    'revenue_rollup_insert', 'revenue_rollup_update', 'revenue_rollup_delete',
+    # From 0027; customer moves no longer touch the rollup
+    'revenue_rollup_customer_room',
+]
+
+BACKFILL = f"""
+    INSERT INTO "Payment_Scheduler_revenuerollup" ({COLUMNS})
+    {ROLLUP_TOTALS.format(where='')}
+"""
+
+
+def drop_triggers(apps, schema_editor):
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def backfill_rooms(apps, schema_editor):
+    schema_editor.execute("""
+        UPDATE "Payment_Scheduler_payment"
+        SET room_id = (SELECT room_id FROM "Payment_Scheduler_customer" c WHERE c.customer_id = "Payment_Scheduler_payment".customer_id)
+        WHERE is_paid AND room_id IS NULL
+    """)
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise RuntimeError('RevenueRollup triggers are only defined for SQLite')
+    drop_triggers(apps, schema_editor)
+    for sql in TRIGGERS:
+        schema_editor.execute(sql)
+    schema_editor.execute('DELETE FROM "Payment_Scheduler_revenuerollup"')
+    schema_editor.execute(BACKFILL)
+
+
+def restore_triggers(apps, schema_editor):
+    # Removing the column rebuilds the payment table, which drops the billing cycle triggers too
+    import_module('Payment_Scheduler.migrations.0028_billingcycle_total_credited').create_triggers(apps, schema_editor)
+    import_module('Payment_Scheduler.migrations.0027_revenue_rollup').create_triggers(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0028_billingcycle_total_credited'),
+    ]
+
+    # The rollup triggers are dropped around the schema changes either way,
+    # and 0027's put back last when going backwards
+    operations = [
+        migrations.RunPython(drop_triggers, restore_triggers),
+        migrations.AddField(
+            model_name='payment',
+            name='room',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Payment_Scheduler.room'),
+        ),
+        migrations.AlterField(
+            model_name='revenuerollup',
+            name='room',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revenue_rollups', to='Payment_Scheduler.room'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['room', 'date_paid'], name='payment_room_date_idx'),
+        ),
+        migrations.RunPython(backfill_rooms, migrations.RunPython.noop),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Payment_Scheduler', '0029_payment_room'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customerbillingstate',
+            name='last_paid_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name'], name='customer_name_idx'),
+        ),
+    ]
@@ -37,9 +37,7 @@ class Room(models.Model):
         """Calculates occupancy percentage for the progress bar."""
         if not self.capacity or self.capacity == 0:
             return 0
-        # This 'active_customers_count' comes from the view annotation below
-        count = getattr(self, 'active_customers_count', 0)
-        return min(int((count / self.capacity) * 100), 100)
+        return min(int((self.active_count / self.capacity) * 100), 100)
 
     room_number = models.CharField(max_length=50, unique=True, verbose_name="Room No.")
     date_created = models.DateTimeField(auto_now_add=True)
@@ -48,7 +46,18 @@ class Room(models.Model):
     capacity = models.IntegerField(default=1) # How many people can occupy
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Room Price")
     date_left = models.DateField(null=True, blank=True) # New field
-    
+    # Active occupants, maintained by database triggers on the customer table
+    # (see migration 0021); reload with refresh_from_db() after customer writes
+    active_count = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # Never write back a possibly stale copy of the trigger-maintained counter
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'active_count'
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.room_number} - {self.room_type}"
@@ -74,6 +83,14 @@ class Customer(models.Model):
     date_left = models.DateField(null=True, blank=True)
     date_entry = models.DateField(default=timezone.now, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'status'], name='customer_room_status_idx'),
+            models.Index(fields=['name'], name='customer_name_idx'),
+            models.Index(fields=['due_date'], name='customer_due_date_idx'),
+            models.Index(fields=['date_entry'], name='customer_date_entry_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -87,6 +104,27 @@ class Payment(models.Model):
     date_paid = models.DateField(null=True, blank=True)
     amount_received = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     change_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Set by cashier terminals so a retried request is not recorded twice
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    # The customer's room when the row was paid, for revenue per room; set by
+    # a trigger (migration 0029) unless the writer sets it
+    room = models.ForeignKey(
+        Room, on_delete=models.SET_NULL, null=True, blank=True, editable=False, db_index=False, related_name='+',
+    )
+
+    class Meta:
+        indexes = [
+            # Cycle lookups and sums; amount_received makes the sums index-only
+            models.Index(fields=['customer', 'due_date', 'is_paid', 'amount_received'], name='payment_cycle_idx'),
+            # Partial rather than (is_paid, date_paid): is_paid=True compiles to a bare
+            # boolean test, which SQLite matches against the index condition but
+            # cannot use as an index key
+            models.Index(fields=['date_paid'], condition=models.Q(is_paid=True), name='payment_paid_date_idx'),
+            # Each customer's latest paid payment, for the report's default view
+            models.Index(fields=['customer', 'date_paid'], condition=models.Q(is_paid=True), name='payment_customer_paid_idx'),
+            # A room's payments by month, for the revenue rollup; also serves room deletes
+            models.Index(fields=['room', 'date_paid'], name='payment_room_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.customer.name} - {self.due_date}"
@@ -99,6 +137,188 @@ class RoomTransferHistory(models.Model):
     room_from_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     room_to_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     transfer_date = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transfer_date'], name='transfer_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.customer.name}: {self.room_from} -> {self.room_to} on {self.transfer_date}"
+
+class CustomerBillingState(models.Model):
+    """
+    Snapshot of a customer's current billing cycle, kept in sync by the write
+    paths (see billing.refresh_billing_states) so the dashboard can read it
+    instead of recomputing it from payments on every request.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='billing_state')
+    last_paid = models.DateField(null=True, blank=True, db_index=True)
+    last_paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True)
+    cycle_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status_priority = models.IntegerField(default=6, db_index=True)
+    status = models.CharField(max_length=100, blank=True)
+    # The day the status was computed for; statuses like "Due Today" go stale overnight
+    as_of = models.DateField(db_index=True)
+    # DataVersion value when this row last changed, used to push/serve only changed rows
+    version = models.BigIntegerField(default=0, db_index=True)
+
+    def __str__(self):
+        return f"{self.customer.name}: {self.status}"
+
+class BillingCycle(models.Model):
+    """
+    Totals of a customer's payment rows for one due date, maintained by
+    SQLite triggers on the payment table (migrations 0025 and 0028) on every
+    write path, bulk ones included. Read-only from
+    Python. Sums, the last payment date and the payment count cover paid
+    rows only; total_credited is money on unpaid rows (transfer credit),
+    which the status also counts. amount_due is the largest amount on any row.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='billing_cycles')
+    due_date = models.DateField()
+    amount_due = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_received = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_credited = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_change = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    last_paid = models.DateField(null=True, blank=True, editable=False)
+    payment_count = models.PositiveIntegerField(default=0, editable=False)
+    status = models.CharField(max_length=20, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'due_date'], name='billing_cycle_customer_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.name} - {self.due_date}: {self.status}"
+
+class RevenueRollup(models.Model):
+    """
+    Paid totals for one calendar month and room, maintained by SQLite
+    triggers on the payment table (migration 0029) on every write path. A
+    payment counts toward the month of its date_paid and Payment.room, the
+    room it was paid in, so a transfer leaves earlier months where they
+    were. Revenue of a deleted room stays in the month's total under no
+    room. Read-only from Python; revenue.rebuild_revenue_rollup()
+    recomputes it in full.
+    """
+    # First day of the month
+    month = models.DateField()
+    room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True, blank=True, related_name='revenue_rollups')
+    total_received = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    payment_count = models.PositiveIntegerField(default=0, editable=False)
+    payer_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'room'], name='revenue_rollup_month_room'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} room {self.room_id}: {self.total_received}"
+
+class DataVersion(models.Model):
+    """
+    Single-row counter bumped on every Payment, Customer or Room write
+    (see signals.py). Read-mostly endpoints use it as their ETag.
+    """
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(value=models.F('value') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'value': 1})
+
+    def __str__(self):
+        return str(self.value)
+
+class CustomerTombstone(models.Model):
+    """
+    Records deleted customers so dashboard delta readers can drop their rows.
+    Only the last RETAINED_VERSIONS data versions are kept; a reader further
+    behind than that reloads instead of asking for a delta.
+    """
+    RETAINED_VERSIONS = 10000
+
+    customer_id = models.IntegerField()
+    version = models.BigIntegerField(db_index=True)
+
+    @classmethod
+    def record(cls, customer_id):
+        version = DataVersion.current()
+        cls.objects.create(customer_id=customer_id, version=version)
+        cls.objects.filter(version__lte=version - cls.RETAINED_VERSIONS).delete()
+
+    def __str__(self):
+        return f"{self.customer_id} removed at {self.version}"
+
+class LedgerAccount(models.Model):
+    """
+    A customer's running balance, updated in the same transaction as every
+    ledger entry (see ledger.post_entries), so the balance owed is a
+    one-row read. The balance covers every cycle up to charged_through,
+    less everything paid or credited; a negative balance is credit.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='ledger_account')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_seq = models.PositiveIntegerField(default=0)
+    # The latest cycle charged, and what it is charged at after adjustments
+    charged_through = models.DateField(null=True, blank=True)
+    current_charge = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    def arrears(self, today):
+        """The part of the balance already due; the current charge counts only once its due date arrives."""
+        if self.charged_through and self.charged_through > today:
+            return max(self.balance - self.current_charge, 0)
+        return max(self.balance, 0)
+
+    def __str__(self):
+        return f"{self.customer.name}: {self.balance}"
+
+class LedgerEntry(models.Model):
+    """
+    One immutable line of a customer's ledger. Charges are positive,
+    payments and credits negative; balance is the running total after this
+    entry. seq numbers each customer's entries from 1, so a statement is a
+    range scan on (customer, seq).
+    """
+    CHARGE = 'charge'
+    PAYMENT = 'payment'
+    ADJUSTMENT = 'adjustment'
+    CREDIT = 'credit'
+    KIND_CHOICES = (
+        (CHARGE, 'Charge'),
+        (PAYMENT, 'Payment'),
+        (ADJUSTMENT, 'Adjustment'),
+        (CREDIT, 'Credit'),
+    )
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='ledger_entries')
+    seq = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    # The billing cycle the entry belongs to
+    due_date = models.DateField(null=True, blank=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    memo = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'seq'], name='ledger_entry_customer_seq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Ledger entries are immutable; post a correcting entry instead.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.customer.name} #{self.seq}: {self.kind} {self.amount}"
@@ -0,0 +1,116 @@
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import Case, F, Q, Value, When
+
+from .models import DataVersion, Room
+
+AVAILABLE = 'Available'
+OCCUPIED = 'Occupied'
+UNDER_MAINTENANCE = 'Under Maintenance'
+
+
+def reconcile_room_statuses(room_ids=None):
+    """
+    Sets every room's status from its occupant count in one UPDATE: empty
+    rooms are Available, the rest Occupied, and rooms Under Maintenance are
+    left alone. Only rooms whose status has drifted are written, so a call
+    with nothing to fix takes no write lock.
+    Call it inside the same transaction as the write that moved occupants.
+    Returns the number of rooms changed.
+    """
+    rooms = Room.objects.exclude(status=UNDER_MAINTENANCE).filter(
+        Q(active_count=0) & ~Q(status=AVAILABLE) | Q(active_count__gt=0) & ~Q(status=OCCUPIED)
+    )
+    if room_ids is not None:
+        room_ids = [pk for pk in room_ids if pk is not None]
+        if not room_ids:
+            return 0
+        rooms = rooms.filter(pk__in=room_ids)
+    count = rooms.update(status=Case(
+        When(active_count=0, then=Value(AVAILABLE)),
+        default=Value(OCCUPIED),
+    ))
+    if count:
+        # QuerySet.update() sends no signals; readers keyed on the version must still see it
+        DataVersion.bump()
+    return count
+
+
+@dataclass(frozen=True)
+class Vacancy:
+    id: int
+    room_number: str
+    room_type: str
+    price: Decimal
+    status: str
+    active_count: int
+    capacity: int
+
+    @property
+    def available_slots(self):
+        return self.capacity - self.active_count
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'room_number': self.room_number,
+            'room_type': self.room_type,
+            'price': str(self.price),
+            'status': self.status,
+            'current_occupants': self.active_count,
+            'capacity': self.capacity,
+            'available_slots': self.available_slots,
+        }
+
+
+class VacancyIndex:
+    """
+    Rooms with a free slot, not Under Maintenance, held in memory sorted by
+    lower-cased room number so a prefix search is a bisect. The index is
+    rebuilt when DataVersion moves, which every room or customer write does,
+    so each lookup costs one primary-key read while nothing has changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def rooms(self, prefix='', exclude=None):
+        keys, vacancies = self._current()
+        prefix = prefix.strip().lower()
+        matches = []
+        for i in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            if vacancies[i].id != exclude:
+                matches.append(vacancies[i])
+        return matches
+
+    def clear(self):
+        self._snapshot = None
+
+    def _current(self):
+        version = DataVersion.current()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[0] != version:
+                    snapshot = (version, *self._build())
+                    self._snapshot = snapshot
+        return snapshot[1], snapshot[2]
+
+    def _build(self):
+        rooms = (
+            Room.objects.exclude(status=UNDER_MAINTENANCE)
+            .filter(active_count__lt=F('capacity'))
+            .values_list('id', 'room_number', 'room_type', 'price', 'status', 'active_count', 'capacity')
+        )
+        entries = sorted(((row[1].lower(), Vacancy(*row)) for row in rooms), key=lambda entry: entry[0])
+        return [key for key, _ in entries], [vacancy for _, vacancy in entries]
+
+
+vacancy_index = VacancyIndex()
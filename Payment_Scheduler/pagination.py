@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def resolve_path(obj, path):
+    """Follows a lookup path like 'room__price' on a loaded object."""
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name, None)
+    return obj
+
+
+def _after(path, value, descending):
+    """
+    Rows strictly after `value` on one key. NULLs sort first ascending and
+    last descending, matching the order_by() built in keyset_page.
+    """
+    if descending:
+        if value is None:
+            return None
+        return Q(**{f'{path}__lt': value}) | Q(**{f'{path}__isnull': True})
+    if value is None:
+        return Q(**{f'{path}__isnull': False})
+    return Q(**{f'{path}__gt': value})
+
+
+def _equal(path, value):
+    if value is None:
+        return Q(**{f'{path}__isnull': True})
+    return Q(**{path: value})
+
+
+def keyset_page(queryset, keys, cursor=None, limit=12):
+    """
+    Returns (rows, next_cursor) for one page of `queryset` ordered by `keys`,
+    a list of (lookup_path, descending) pairs. The primary key is appended as
+    the final tie-breaker so every row has a unique position, which lets the
+    next page start with a WHERE instead of an OFFSET.
+    """
+    keys = list(keys) + [('pk', keys[0][1] if keys else False)]
+
+    ordering = []
+    for path, descending in keys:
+        ordering.append(F(path).desc(nulls_last=True) if descending else F(path).asc(nulls_first=True))
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise InvalidCursor(cursor)
+        # (k1 after v1) OR (k1 = v1 AND k2 after v2) OR ...
+        conditions = []
+        prefix = Q()
+        for (path, descending), value in zip(keys, values):
+            after = _after(path, value, descending)
+            if after is not None:
+                conditions.append(prefix & after)
+            prefix &= _equal(path, value)
+        if not conditions:
+            return [], None
+        queryset = queryset.filter(reduce(operator.or_, conditions))
+
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([resolve_path(rows[-1], path) for path, _ in keys])
+    return rows, next_cursor
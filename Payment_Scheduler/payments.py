@@ -0,0 +1,268 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Sum
+from django.utils import timezone
+
+from .billing import refresh_billing_states
+from .ledger import charge_entry, payment_entry, post_entries
+from .models import Customer, LedgerAccount, Payment
+from .signals import notify_bulk_write
+
+# Client-generated keys are UUIDs; anything longer is not one of ours
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+
+class PaymentError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PaymentResult:
+    payment: Payment
+    due_date: date
+    balance: Decimal
+    replayed: bool = False
+
+    def as_dict(self):
+        return {
+            'payment_id': self.payment.pk,
+            'amount_received': self.payment.amount_received,
+            'change_amount': self.payment.change_amount,
+            'due_date': self.due_date.strftime('%Y-%m-%d'),
+            'balance': self.balance,
+            'replayed': self.replayed,
+        }
+
+
+def record_payment(customer_id, amount_received, remarks=None, payment_id=None, idempotency_key=None, today=None):
+    """
+    Applies cash to the customer's current billing cycle. Only what the
+    cycle still owes is applied; the rest is change. A payment that settles
+    the cycle advances the due date by one month.
+
+    The customer row is locked first, so two cashiers paying for the same
+    customer are applied one after the other and the second one sees the
+    first one's payment. A request that repeats an idempotency key already
+    recorded returns the original payment instead of paying twice.
+    Call it inside a transaction; raises PaymentError if nothing can be
+    applied, and Customer.DoesNotExist / Payment.DoesNotExist for unknown ids.
+    Returns a PaymentResult with the balance now owed, as the ledger has it.
+    """
+    today = today or timezone.localdate()
+
+    # of=('self',): the room join is nullable and must not be locked
+    customer = Customer.objects.select_for_update(of=('self',)).select_related('room').get(pk=customer_id)
+
+    if idempotency_key:
+        previous = Payment.objects.filter(idempotency_key=idempotency_key).first()
+        if previous:
+            if previous.customer_id != customer.pk:
+                raise PaymentError("Idempotency key was already used for another customer.")
+            return PaymentResult(previous, customer.due_date, ledger_balances([customer.pk])[customer.pk], replayed=True)
+
+    # Ensure the customer has an active billing cycle
+    if not customer.due_date:
+        customer.due_date = today
+        customer.save(update_fields=['due_date'])
+    current_due = customer.due_date
+    room_price = customer.room.price if customer.room else Decimal('0')
+
+    if payment_id:
+        payment = Payment.objects.select_for_update().get(pk=payment_id, customer=customer)
+    else:
+        payment = Payment(customer=customer, amount=room_price, due_date=current_due)
+
+    # Calculate how much has already been applied to this billing cycle
+    existing_qs = Payment.objects.filter(customer=customer, due_date=current_due, is_paid=True)
+    if payment.pk:
+        existing_qs = existing_qs.exclude(pk=payment.pk)
+    already_paid = existing_qs.aggregate(Sum('amount_received'))['amount_received__sum'] or Decimal('0')
+
+    _apply(payment, room_price, already_paid, amount_received, remarks, idempotency_key, today)
+    payment.save()
+
+    ledger = [charge_entry(customer.pk, current_due, room_price), payment_entry(payment)]
+
+    # Advance due date when the current cycle is fully paid (early, on time, or late)
+    if room_price > 0 and already_paid + payment.amount_received >= room_price:
+        customer.due_date = current_due + relativedelta(months=1)
+        customer.save(update_fields=['due_date'])
+        ledger.append(charge_entry(customer.pk, customer.due_date, room_price))
+
+    post_entries(ledger)
+    refresh_billing_states([customer.pk], today)
+    return PaymentResult(payment, customer.due_date, ledger_balances([customer.pk])[customer.pk])
+
+
+def record_payments(entries, today=None):
+    """
+    Records a stack of payments, e.g. the envelopes collected at the start
+    of the month. `entries` is a list of dicts with customer_id,
+    amount_received and optionally remarks and idempotency_key. Each entry
+    follows the same cycle rules as record_payment, in list order, so a
+    second entry for a customer whose cycle the first one settled pays
+    toward the next cycle.
+
+    Customers, idempotency keys, cycle sums and unpaid cycle payments are
+    read with one query each; payments, due dates and ledger entries are
+    written in bulk.
+    An entry that cannot be applied is reported and the others still go
+    through. Call it inside a transaction.
+    Returns one dict per entry: {'success': True, **PaymentResult.as_dict()}
+    or {'success': False, 'error': ...}. Each balance is the ledger's as of
+    that entry.
+    """
+    today = today or timezone.localdate()
+    entries = [_parse_entry(entry) for entry in entries]
+
+    customer_ids = {entry['customer_id'] for entry in entries if 'error' not in entry}
+    customers = Customer.objects.select_for_update(of=('self',)).select_related('room').in_bulk(customer_ids)
+    keys = {entry['idempotency_key'] for entry in entries if entry.get('idempotency_key')}
+    previous = {p.idempotency_key: p for p in Payment.objects.filter(idempotency_key__in=keys)} if keys else {}
+
+    initial_due = {customer.pk: customer.due_date for customer in customers.values()}
+    # Ensure every customer has an active billing cycle
+    for customer in customers.values():
+        if not customer.due_date:
+            customer.due_date = today
+    # Every cycle an entry can reach starts on or after the earliest current due date
+    earliest = min((customer.due_date for customer in customers.values()), default=today)
+    cycle_paid = defaultdict(Decimal)
+    unpaid = {}
+    if customers:
+        payments = Payment.objects.filter(customer__in=list(customers), due_date__gte=earliest)
+        for customer_id, due_date, total in (
+            payments.filter(is_paid=True).values('customer', 'due_date')
+            .annotate(total=Sum('amount_received')).values_list('customer', 'due_date', 'total')
+        ):
+            cycle_paid[customer_id, due_date] = total or Decimal('0')
+        # The first unpaid payment of a cycle is filled in, as the payment page does
+        for payment in payments.filter(is_paid=False).order_by('-pk'):
+            unpaid[payment.customer_id, payment.due_date] = payment
+
+    # (payment, due_date, replayed, ledger entries so far) per recorded entry, or an error dict
+    results = []
+    ledger = []
+    new_payments = []
+    updated_payments = []
+    for entry in entries:
+        if 'error' in entry:
+            results.append({'success': False, 'error': entry['error']})
+            continue
+        customer = customers.get(entry['customer_id'])
+        if customer is None:
+            results.append({'success': False, 'error': 'Record not found'})
+            continue
+        room_price = customer.room.price if customer.room else Decimal('0')
+        key = entry.get('idempotency_key')
+        if key in previous:
+            if previous[key].customer_id != customer.pk:
+                results.append({'success': False, 'error': "Idempotency key was already used for another customer."})
+                continue
+            results.append((previous[key], customer.due_date, True, len(ledger)))
+            continue
+
+        current_due = customer.due_date
+        payment = unpaid.pop((customer.pk, current_due), None)
+        if payment is None:
+            payment = Payment(customer=customer, amount=room_price, due_date=current_due)
+            pending = new_payments
+        else:
+            pending = updated_payments
+        already_paid = cycle_paid[customer.pk, current_due]
+        try:
+            _apply(payment, room_price, already_paid, entry['amount_received'], entry.get('remarks'), key, today)
+        except PaymentError as e:
+            results.append({'success': False, 'error': str(e)})
+            continue
+        pending.append(payment)
+        if key:
+            previous[key] = payment
+        cycle_paid[customer.pk, current_due] = already_paid + payment.amount_received
+        ledger += [charge_entry(customer.pk, current_due, room_price), payment_entry(payment)]
+        if room_price > 0 and cycle_paid[customer.pk, current_due] >= room_price:
+            customer.due_date = current_due + relativedelta(months=1)
+            ledger.append(charge_entry(customer.pk, customer.due_date, room_price))
+        results.append((payment, customer.due_date, False, len(ledger)))
+
+    Payment.objects.bulk_create(new_payments)
+    Payment.objects.bulk_update(updated_payments, [
+        'date_paid', 'previous_date', 'amount', 'amount_received', 'change_amount', 'remarks', 'is_paid', 'idempotency_key',
+    ])
+    Customer.objects.bulk_update(
+        [customer for customer in customers.values() if customer.due_date != initial_due[customer.pk]], ['due_date']
+    )
+    opening = dict(LedgerAccount.objects.filter(customer__in=list(customers)).values_list('customer', 'balance'))
+    post_entries(ledger)
+    refresh_billing_states(list(customers), today)
+    notify_bulk_write()
+
+    # Results are built last, once bulk_create() has set the new payments' ids.
+    # post_entries() sets the running balance on each entry it posts, so the
+    # balance after an entry is read back from the ledger entries before it
+    running = defaultdict(Decimal, opening)
+    read = 0
+    response = []
+    for result in results:
+        if isinstance(result, tuple):
+            payment, due_date, replayed, mark = result
+            for entry in ledger[read:mark]:
+                if entry.seq:
+                    running[entry.customer_id] = entry.balance
+            read = mark
+            balance = max(running[payment.customer_id], Decimal('0'))
+            result = {'success': True, **PaymentResult(payment, due_date, balance, replayed).as_dict()}
+        response.append(result)
+    return response
+
+
+def _parse_entry(entry):
+    try:
+        parsed = {
+            'customer_id': int(entry['customer_id']),
+            'amount_received': Decimal(str(entry['amount_received'])),
+            'remarks': entry.get('remarks'),
+            'idempotency_key': (entry.get('idempotency_key') or '').strip() or None,
+        }
+    except (KeyError, TypeError, ValueError, InvalidOperation):
+        return {'error': 'Invalid customer id or amount'}
+    if not parsed['amount_received'].is_finite():
+        return {'error': 'Invalid customer id or amount'}
+    return parsed
+
+
+def _apply(payment, room_price, already_paid, amount_received, remarks, idempotency_key, today):
+    """Fills in `payment` for cash applied to a cycle that already has `already_paid`."""
+    if amount_received < 0:
+        raise PaymentError("Amount received cannot be negative.")
+    if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise PaymentError("Invalid idempotency key.")
+
+    # Remaining balance for the current cycle (cannot go below zero)
+    remaining_balance = max(room_price - already_paid, Decimal('0'))
+
+    # If the cycle is already fully paid, do not allow additional payments to advance future cycles
+    if room_price > 0 and remaining_balance <= 0:
+        raise PaymentError("Current billing cycle is already fully paid. Prepayments are not allowed.")
+
+    # Amount to apply to this cycle (cannot exceed remaining balance)
+    applied_amount = min(amount_received, remaining_balance) if room_price > 0 else amount_received
+
+    payment.date_paid = today
+    payment.previous_date = payment.date_paid
+    payment.amount = room_price
+    payment.amount_received = applied_amount
+    payment.change_amount = max(amount_received - applied_amount, Decimal('0'))
+    payment.remarks = remarks
+    payment.is_paid = True
+    payment.idempotency_key = idempotency_key or payment.idempotency_key
+
+
+def ledger_balances(customer_ids):
+    """What each customer owes by their ledger, as get_customer_balance shows it; credit owes nothing."""
+    balances = dict(LedgerAccount.objects.filter(customer__in=customer_ids).values_list('customer', 'balance'))
+    return {pk: max(balances.get(pk) or Decimal('0'), Decimal('0')) for pk in customer_ids}
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import Payment, RevenueRollup
+
+
+def month_revenue(month_start):
+    """Total received in the month starting on `month_start`, across rooms."""
+    total = RevenueRollup.objects.filter(month=month_start).aggregate(total=Sum('total_received'))['total']
+    return total or Decimal('0')
+
+
+def revenue_trend(months=36, room_id=None, today=None):
+    """
+    Paid totals, payment counts and payers per month for the last `months`
+    months up to the current one, oldest first, with months nobody paid in
+    as zeros. Across rooms, payers are summed per room, so a customer who
+    paid in two rooms in one month (a transfer) counts in both.
+    """
+    today = today or timezone.localdate()
+    last = today.replace(day=1)
+    first = last - relativedelta(months=months - 1)
+
+    rows = RevenueRollup.objects.filter(month__gte=first, month__lte=last)
+    if room_id:
+        rows = rows.filter(room_id=room_id)
+    totals = {
+        row['month']: row
+        for row in rows.values('month').annotate(
+            total=Sum('total_received'), payments=Sum('payment_count'), payers=Sum('payer_count'),
+        ).order_by()
+    }
+
+    trend = []
+    for offset in range(months):
+        month = first + relativedelta(months=offset)
+        row = totals.get(month, {})
+        trend.append({
+            'month': month,
+            'total_received': row.get('total') or Decimal('0'),
+            'payment_count': row.get('payments') or 0,
+            'payer_count': row.get('payers') or 0,
+        })
+    return trend
+
+
+def rebuild_revenue_rollup():
+    """
+    Replaces every RevenueRollup row with totals recomputed from the paid
+    payment rows, as the triggers would have kept them. Call it inside a
+    transaction. Returns the number of rows written.
+    """
+    totals = (
+        Payment.objects.filter(is_paid=True, date_paid__isnull=False)
+        .annotate(month=TruncMonth('date_paid'))
+        .values('month', 'room')
+        .annotate(
+            total=Coalesce(Sum('amount_received'), Value(0, output_field=DecimalField())),
+            payments=Count('pk'),
+            payers=Count('customer', distinct=True),
+        )
+        .order_by()
+    )
+    rows = [
+        RevenueRollup(
+            month=row['month'], room_id=row['room'], total_received=row['total'],
+            payment_count=row['payments'], payer_count=row['payers'],
+        )
+        for row in totals
+    ]
+    RevenueRollup.objects.all().delete()
+    RevenueRollup.objects.bulk_create(rows)
+    return len(rows)
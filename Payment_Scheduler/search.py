@@ -0,0 +1,50 @@
+from django.db import connection
+from django.db.models import Q
+
+from .models import Customer
+
+# The trigram tokenizer cannot match anything shorter than this
+MIN_TERM_LENGTH = 3
+
+# bm25() column weights: name, contact_number, parents_name,
+# parents_contact_number, room_number
+SEARCH_WEIGHTS = (10.0, 2.0, 3.0, 1.0, 5.0)
+
+
+def find_customers(query, limit=10):
+    """
+    Customers matching every term of `query` (three or more characters) in
+    their name, contact numbers, parents' names or room number, from the
+    customer_search FTS5 index (migration 0022). Names starting with the
+    query come first, then bm25 rank. Shorter queries, and databases other
+    than SQLite, fall back to an ORM search.
+    """
+    terms = [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+    if connection.vendor != 'sqlite' or not terms:
+        return list(_orm_search(query.strip(), limit))
+
+    match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+    name_prefix = connection.ops.prep_for_like_query(query.strip()) + '%'
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM customer_search WHERE customer_search MATCH %s "
+            f"ORDER BY CASE WHEN name LIKE %s ESCAPE '\\' THEN 0 ELSE 1 END, bm25(customer_search, {weights}) "
+            f"LIMIT %s",
+            [match, name_prefix, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    customers = Customer.objects.select_related('room').in_bulk(ids)
+    return [customers[pk] for pk in ids if pk in customers]
+
+
+def _orm_search(query, limit):
+    if not query:
+        return Customer.objects.none()
+    if len(query) < MIN_TERM_LENGTH:
+        # One or two typed characters: prefix matches are what the cashier wants
+        condition = Q(name__istartswith=query) | Q(room__room_number__istartswith=query)
+    else:
+        condition = Q(name__icontains=query) | Q(room__room_number__icontains=query)
+    return Customer.objects.filter(condition).select_related('room')[:limit]
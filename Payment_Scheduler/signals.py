@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .events import broadcaster
+from .models import Customer, CustomerTombstone, DataVersion, Payment, Room
+from .summary import invalidate_summary
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Room)
+def bump_data_version(sender, **kwargs):
+    DataVersion.bump()
+    # Wake this process's dashboard event streams once the write is visible
+    transaction.on_commit(broadcaster.notify)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Room)
+def invalidate_dashboard_summary(sender, **kwargs):
+    invalidate_summary()
+    # Again after commit, in case a concurrent request re-cached the pre-write counters
+    transaction.on_commit(invalidate_summary)
+
+
+def notify_bulk_write():
+    """
+    Does what the receivers above do for writes made with bulk_create(),
+    bulk_update() or QuerySet.update(), which send no model signals.
+    """
+    bump_data_version(sender=None)
+    invalidate_dashboard_summary(sender=None)
+
+
+@receiver(post_delete, sender=Customer)
+def record_customer_tombstone(sender, instance, **kwargs):
+    CustomerTombstone.record(instance.pk)
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .ledger import total_arrears
+from .models import Customer, Room
+from .revenue import month_revenue
+
+SUMMARY_CACHE_KEY = 'dashboard-summary'
+# Writes invalidate the cached counters in the process that made them; the
+# timeout bounds how stale another process's copy can get under a per-process
+# cache backend such as the default LocMemCache
+SUMMARY_CACHE_SECONDS = 300
+
+
+def dashboard_summary(today=None):
+    """
+    Counters and KPIs for the dashboard summary cards, served from the cache
+    until a write or the start of a new day invalidates them.
+    """
+    today = today or timezone.localdate()
+    cached = cache.get(SUMMARY_CACHE_KEY)
+    if cached is not None and cached['day'] == today:
+        return cached['stats']
+
+    stats = compute_summary(today)
+    cache.set(SUMMARY_CACHE_KEY, {'day': today, 'stats': stats}, SUMMARY_CACHE_SECONDS)
+    return stats
+
+
+def invalidate_summary():
+    cache.delete(SUMMARY_CACHE_KEY)
+
+
+def compute_summary(today):
+    """
+    One aggregate over customers for the counters, one over ledger accounts
+    for the arrears, one over the month's revenue rollup rows, and one over
+    rooms for the bed capacity behind the occupancy rate.
+    """
+    active = Q(status='Active')
+    housed = active & Q(room__isnull=False)
+    stats = Customer.objects.aggregate(
+        total_customers=Count('pk'),
+        active_customers=Count('pk', filter=active),
+        occupied_rooms=Count('pk', filter=housed),
+        expected_revenue=Sum('room__price', filter=housed),
+    )
+    stats['arrears'] = total_arrears(today)
+    # Read from the trigger-maintained rollup instead of this month's payment rows
+    stats['monthly_revenue'] = month_revenue(today.replace(day=1))
+    capacity = Room.objects.aggregate(total=Sum('capacity'))['total'] or 0
+
+    stats['expected_revenue'] = stats['expected_revenue'] or 0
+    stats['bed_capacity'] = capacity
+    stats['collection_rate'] = _percent(stats['monthly_revenue'], stats['expected_revenue'])
+    stats['occupancy_rate'] = _percent(stats['occupied_rooms'], capacity)
+    return stats
+
+
+def _percent(part, whole):
+    if not whole:
+        return None
+    return round(float(part) * 100 / float(whole), 1)
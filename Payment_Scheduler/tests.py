@@ -1,9 +1,30 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
+from unittest import skipUnless
 from django.urls import reverse
-from .models import Room, Customer, Payment, BoardingHouseUser
+from .models import Room, Customer, Payment, BoardingHouseUser, CustomerBillingState, CustomerTombstone, DataVersion, RoomTransferHistory, LedgerAccount, LedgerEntry, BillingCycle, RevenueRollup
+from .events import VersionBroadcaster
+from .billing import refresh_billing_states
+from .summary import dashboard_summary
+from .occupancy import reconcile_room_statuses, vacancy_index
+from .search import find_customers
+from .revenue import revenue_trend
+from .ledger import rebuild_ledgers
+from . import views
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+from asgiref.sync import sync_to_async
 from django.utils import timezone
+import asyncio
+import csv
+import os
+import tempfile
+import json
 from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
 
 
 class TransferCustomerTest(TestCase):
@@ -114,6 +135,22 @@ class TransferCustomerTest(TestCase):
         self.assertEqual(total_paid_current, Decimal('1500.00'))
 
 
+    def test_rejected_transfer_shows_the_reason(self):
+        Customer.objects.create(name='Jane Roe', room=self.room_expensive, due_date=timezone.localdate(), status='Active')
+        response = self.client.post(reverse('transfer_customer', args=[self.customer.pk]), {
+            'new_room': self.room_expensive.pk
+        }, follow=True)
+        self.assertContains(response, 'Room 202 does not have 1 free slot(s).')
+
+        Room.objects.filter(pk=self.room_vacant.pk).update(status='Under Maintenance')
+        response = self.client.post(reverse('transfer_customer', args=[self.customer.pk]), {
+            'new_room': self.room_vacant.pk
+        }, follow=True)
+        self.assertContains(response, 'Room 303 is under maintenance.')
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.room, self.room_cheap)
+
+
 class PaymentCycleTest(TestCase):
     def setUp(self):
         self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
@@ -225,3 +262,1360 @@ class PaymentCycleTest(TestCase):
         data = response.json()
         self.assertFalse(data.get('success'))
         self.assertIn('already fully paid', data.get('error', ''))
+
+    def test_payment_returns_new_balance(self):
+        from dateutil.relativedelta import relativedelta
+
+        data = self.client.post(reverse('process_payment'), {
+            'customer_id': self.customer.pk, 'amount_received': '400.00',
+        }).json()
+        self.assertEqual(data['balance'], '600.00')
+        self.assertEqual(data['due_date'], timezone.localdate().isoformat())
+
+        data = self.client.post(reverse('process_payment'), {
+            'customer_id': self.customer.pk, 'amount_received': '700.00',
+        }).json()
+        self.assertEqual(data['change_amount'], '100.00')
+        # The cycle is settled; the balance is the next cycle's full price
+        self.assertEqual(data['balance'], '1000.00')
+        self.assertEqual(data['due_date'], (timezone.localdate() + relativedelta(months=1)).isoformat())
+
+    def test_retry_with_same_idempotency_key_pays_once(self):
+        post = {'customer_id': self.customer.pk, 'amount_received': '400.00', 'idempotency_key': 'key-1'}
+        first = self.client.post(reverse('process_payment'), post).json()
+        retry = self.client.post(reverse('process_payment'), post).json()
+
+        self.assertTrue(retry['success'])
+        self.assertTrue(retry['replayed'])
+        self.assertEqual(retry['payment_id'], first['payment_id'])
+        self.assertEqual(retry['balance'], '600.00')
+        self.assertEqual(Payment.objects.filter(customer=self.customer).count(), 1)
+
+        other = Customer.objects.create(name='Bob', room=self.room, due_date=timezone.localdate())
+        data = self.client.post(reverse('process_payment'), {**post, 'customer_id': other.pk}).json()
+        self.assertFalse(data['success'])
+
+    def test_payment_id_must_belong_to_customer(self):
+        other = Customer.objects.create(name='Bob', due_date=timezone.localdate())
+        payment = Payment.objects.create(customer=other, due_date=other.due_date, amount=Decimal('0'))
+        data = self.client.post(reverse('process_payment'), {
+            'customer_id': self.customer.pk, 'payment_id': payment.pk, 'amount_received': '400.00',
+        }).json()
+        self.assertEqual(data, {'success': False, 'error': 'Record not found'})
+
+
+class BillingStateTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+
+        self.room = Room.objects.create(
+            room_number='501',
+            room_type='Single',
+            price=Decimal('1000.00'),
+            capacity=1,
+            status='Available'
+        )
+        self.customer = Customer.objects.create(
+            name='Bob',
+            room=self.room,
+            due_date=timezone.localdate() - timedelta(days=2),
+            status='Active'
+        )
+
+    def test_payment_updates_billing_state(self):
+        response = self.client.post(reverse('process_payment'), {
+            'customer_id': self.customer.pk,
+            'payment_id': '',
+            'amount_received': '400.00',
+            'change_amount': '0.00',
+            'remarks': 'partial',
+        })
+        self.assertTrue(response.json().get('success'))
+
+        state = CustomerBillingState.objects.get(customer=self.customer)
+        self.assertEqual(state.cycle_paid, Decimal('400.00'))
+        self.assertEqual(state.balance, Decimal('600.00'))
+        self.assertEqual(state.last_paid, timezone.localdate())
+        self.assertEqual(state.status, "Partially Paid • Balance: ₱600.00")
+
+    def test_dashboard_api_reads_billing_state(self):
+        response = self.client.get(reverse('dashboard_api'))
+        data = response.json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['payment_data'][0]['status'], "Overdue")
+        self.assertEqual(data['payment_data'][0]['color'], 'black')
+        self.assertTrue(CustomerBillingState.objects.filter(customer=self.customer).exists())
+
+    def test_rebuild_command(self):
+        Payment.objects.create(
+            customer=self.customer,
+            due_date=self.customer.due_date,
+            amount=self.room.price,
+            amount_received=self.room.price,
+            date_paid=timezone.localdate(),
+            is_paid=True
+        )
+        call_command('rebuild_billing_state', stdout=StringIO())
+
+        state = CustomerBillingState.objects.get(customer=self.customer)
+        self.assertEqual(state.balance, Decimal('0'))
+        self.assertEqual(state.status, "Paid")
+
+
+class DashboardViewTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+
+        room = Room.objects.create(room_number='601', room_type='Bed Spacer', price=Decimal('800.00'), capacity=4)
+        for i in range(5):
+            customer = Customer.objects.create(name=f'Tenant {i}', room=room, due_date=timezone.localdate(), status='Active')
+            Payment.objects.create(
+                customer=customer,
+                due_date=customer.due_date,
+                amount=room.price,
+                amount_received=room.price,
+                date_paid=timezone.localdate(),
+                is_paid=True
+            )
+        Customer.objects.create(name='Former Tenant', status='Inactive')
+
+    def test_summary_cards_and_embedded_first_page(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_customers'], 6)
+        self.assertEqual(response.context['active_customers'], 5)
+        self.assertEqual(response.context['occupied_rooms'], 5)
+        self.assertEqual(response.context['monthly_revenue'], Decimal('4000.00'))
+        self.assertEqual(len(response.context['initial_page']['payment_data']), 6)
+
+    def test_query_count_does_not_grow_with_customers(self):
+        self.client.get(reverse('dashboard'))  # fills the billing state
+        with self.assertNumQueries(7):
+            self.client.get(reverse('dashboard'))
+
+    def test_summary_kpis_are_cached_until_a_write(self):
+        today = timezone.localdate()
+        stats = dashboard_summary(today)
+        self.assertEqual(stats['collection_rate'], 100.0)
+        self.assertEqual(stats['occupancy_rate'], 125.0)
+        self.assertEqual(stats['arrears'], 0)
+        with self.assertNumQueries(0):
+            dashboard_summary(today)
+
+        room = Room.objects.create(room_number='602', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        late = Customer.objects.create(name='Late Tenant', room=room, due_date=today - timedelta(days=5), status='Active')
+        Payment.objects.create(
+            customer=late, due_date=late.due_date, amount=Decimal('400.00'),
+            amount_received=Decimal('400.00'), date_paid=today - timedelta(days=5), is_paid=True
+        )
+        # Arrears are read from the ledger
+        rebuild_ledgers([late.pk])
+        refresh_billing_states([late.pk], today)
+        stats = dashboard_summary(today)
+        self.assertEqual(stats['active_customers'], 6)
+        self.assertEqual(stats['occupancy_rate'], 120.0)
+        self.assertEqual(stats['arrears'], Decimal('600.00'))
+
+    def test_status_facets_and_filter(self):
+        today = timezone.localdate()
+        Customer.objects.create(name='Late Tenant', due_date=today - timedelta(days=5), status='Active')
+        response = self.client.get(reverse('dashboard_api'))
+        facets = response.json()['facets']
+        self.assertEqual(facets['paid'], 5)
+        self.assertEqual(facets['overdue'], 1)
+        self.assertEqual(facets['no_schedule'], 1)
+
+        response = self.client.get(reverse('dashboard_api'), {'status': 'overdue'})
+        rows = response.json()['payment_data']
+        self.assertEqual([row['name'] for row in rows], ['Late Tenant'])
+        self.assertEqual(rows[0]['status_key'], 'overdue')
+
+        response = self.client.get(reverse('dashboard_api'), {'status': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DataVersionETagTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.room = Room.objects.create(room_number='701', room_type='Single', price=Decimal('900.00'), capacity=1)
+        self.customer = Customer.objects.create(name='Carol', room=self.room, due_date=timezone.localdate(), status='Active')
+
+    def test_unchanged_data_returns_304(self):
+        url = reverse('dashboard_api') + '?offset=0&limit=12'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        with self.assertNumQueries(3):  # session, user, version
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+
+    def test_write_changes_etag(self):
+        url = reverse('customers_api')
+        etag = self.client.get(url)['ETag']
+
+        self.customer.name = 'Caroline'
+        self.customer.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class DashboardEventsTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.room = Room.objects.create(room_number='801', room_type='Bed Spacer', price=Decimal('700.00'), capacity=2)
+        self.alice = Customer.objects.create(name='Alice', room=self.room, due_date=timezone.localdate(), status='Active')
+        self.bob = Customer.objects.create(name='Bob', room=self.room, due_date=timezone.localdate(), status='Active')
+
+    def test_wsgi_request_gets_no_stream(self):
+        response = self.client.get(reverse('dashboard_events'))
+        self.assertEqual(response.status_code, 204)
+
+    def test_changes_contain_only_rows_written_since_version(self):
+        today = timezone.localdate()
+        since = views._dashboard_changes(0, today)['version']
+
+        self.client.post(reverse('process_payment'), {
+            'customer_id': self.alice.pk,
+            'payment_id': '',
+            'amount_received': '700.00',
+            'change_amount': '0.00',
+            'remarks': '',
+        })
+
+        changes = views._dashboard_changes(since, today)
+        self.assertGreater(changes['version'], since)
+        self.assertEqual([row['id'] for row in changes['rows']], [self.alice.pk])
+        self.assertEqual(changes['rows'][0]['status'], 'Paid')
+        self.assertEqual(changes['summary']['monthly_revenue'], Decimal('700.00'))
+        # Keyset values let the page tell whether the row sorts among the ones it has loaded
+        sort_values = changes['rows'][0]['sort_values']
+        self.assertEqual(set(sort_values), {path for paths in views.DASHBOARD_SORT_KEYS.values() for path in paths})
+        self.assertEqual((sort_values['billing_state__last_paid'], sort_values['room__price']), (today, 700.0))
+
+    async def test_broadcaster_wakes_on_version_change(self):
+        broadcaster = VersionBroadcaster()
+        self.assertIsNone(await broadcaster.wait_for_change(10 ** 9, 0.05))
+
+        version = broadcaster.version
+        waiter = asyncio.ensure_future(broadcaster.wait_for_change(version, 5))
+        await asyncio.sleep(0)
+        await sync_to_async(DataVersion.bump)()
+        broadcaster.notify()
+        self.assertEqual(await waiter, version + 1)
+
+    async def test_streams_share_the_latest_change_payload(self):
+        broadcaster = VersionBroadcaster()
+        await broadcaster.wait_for_change(10 ** 9, 0.05)
+        version = broadcaster.version
+        waiters = [asyncio.ensure_future(broadcaster.wait_for_change(version, 5)) for _ in range(3)]
+        await asyncio.sleep(0)
+        await sync_to_async(DataVersion.bump)()
+        broadcaster.notify()
+        await asyncio.gather(*waiters)
+
+        builds = []
+
+        def build(since):
+            builds.append(since)
+            return {'since': since}
+
+        # Two streams were current before the change; the third is further behind and builds its own
+        results = await asyncio.gather(*(broadcaster.changes_since(since, build) for since in (version, version, version - 1)))
+        self.assertEqual([r['since'] for r in results], [version, version, version - 1])
+        self.assertEqual(sorted(builds), [version - 1, version])
+
+    def test_dashboard_api_since_returns_delta(self):
+        since = self.client.get(reverse('dashboard_api'))
+        since = since.json()['version']
+
+        bob_id = self.bob.pk
+        self.bob.delete()
+        self.client.post(reverse('process_payment'), {
+            'customer_id': self.alice.pk,
+            'payment_id': '',
+            'amount_received': '100.00',
+            'change_amount': '0.00',
+            'remarks': '',
+        })
+
+        data = self.client.get(reverse('dashboard_api'), {'since': since}).json()
+        self.assertEqual([row['id'] for row in data['rows']], [self.alice.pk])
+        self.assertEqual(data['removed'], [bob_id])
+        self.assertGreater(data['version'], since)
+
+        data = self.client.get(reverse('dashboard_api'), {'since': data['version']}).json()
+        self.assertEqual(data['rows'], [])
+        self.assertEqual(data['removed'], [])
+
+    def test_stale_or_large_deltas_ask_for_a_reload(self):
+        today = timezone.localdate()
+        self.assertTrue(views._dashboard_changes(0, today)['reload'])
+
+        since = views._dashboard_changes(0, today)['version']
+        for customer in (self.alice, self.bob):
+            self.client.post(reverse('process_payment'), {'customer_id': customer.pk, 'amount_received': '100.00'})
+        self.assertFalse(views._dashboard_changes(since, today)['reload'])
+        self.addCleanup(setattr, views, 'MAX_DASHBOARD_CHANGES', views.MAX_DASHBOARD_CHANGES)
+        views.MAX_DASHBOARD_CHANGES = 1
+        changes = views._dashboard_changes(since, today)
+        self.assertEqual((changes['reload'], changes['rows']), (True, []))
+
+        # Tombstones older than the retained versions are pruned, and readers that far behind reload
+        self.alice.delete()
+        DataVersion.objects.filter(pk=1).update(value=F('value') + CustomerTombstone.RETAINED_VERSIONS)
+        bob_id = self.bob.pk
+        self.bob.delete()
+        self.assertEqual(list(CustomerTombstone.objects.values_list('customer_id', flat=True)), [bob_id])
+        self.assertTrue(views._dashboard_changes(since, today)['reload'])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+
+        today = timezone.localdate()
+        rooms = [
+            Room.objects.create(room_number='A1', room_type='Bed Spacer', price=Decimal('500.00'), capacity=4),
+            Room.objects.create(room_number='B2', room_type='Bed Spacer', price=Decimal('900.00'), capacity=4),
+        ]
+        for i in range(9):
+            customer = Customer.objects.create(
+                name=f'Tenant {i % 4}',  # duplicate names exercise the pk tie-breaker
+                room=rooms[i % 2] if i % 3 else None,
+                due_date=today + timedelta(days=i - 4) if i % 4 else None,
+                status='Active',
+            )
+            if i % 2:
+                Payment.objects.create(
+                    customer=customer,
+                    due_date=customer.due_date or today,
+                    amount=Decimal('500.00'),
+                    amount_received=Decimal('100.00') * i,
+                    date_paid=today - timedelta(days=i),
+                    is_paid=True
+                )
+
+    def collect(self, url, params, key):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, limit=2)
+            if cursor:
+                query['cursor'] = cursor
+            data = self.client.get(url, query).json()
+            ids += [row['id'] for row in data[key]]
+            cursor = data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_dashboard_pages_cover_every_customer_once(self):
+        url = reverse('dashboard_api')
+        expected = sorted(Customer.objects.values_list('pk', flat=True))
+        for sort in views.DASHBOARD_SORT_KEYS:
+            for direction in ('asc', 'desc'):
+                full = self.client.get(url, {'sort': sort, 'direction': direction, 'limit': 100}).json()
+                full_ids = [row['id'] for row in full['payment_data']]
+                paged_ids = self.collect(url, {'sort': sort, 'direction': direction}, 'payment_data')
+                self.assertEqual(paged_ids, full_ids, (sort, direction))
+                self.assertEqual(sorted(paged_ids), expected)
+
+    def test_customers_api_pages(self):
+        page = self.client.get(reverse('customers'))
+        self.assertEqual(page.status_code, 200)
+        self.assertEqual(len(page.context['customers']), 9)
+        self.assertIsNone(page.context['next_cursor'])
+
+        url = reverse('customers_api')
+        for sort in ('latest_entry', 'latest_payment'):
+            ids = self.collect(url, {'sort': sort}, 'customers')
+            self.assertEqual(sorted(ids), sorted(Customer.objects.values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('dashboard_api'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RoomActiveCountTest(TestCase):
+    def setUp(self):
+        self.room_a = Room.objects.create(room_number='A1', room_type='Bed Spacer', price=Decimal('800.00'), capacity=3)
+        self.room_b = Room.objects.create(room_number='B1', room_type='Bed Spacer', price=Decimal('800.00'), capacity=3)
+
+    def assertCounts(self, a, b):
+        self.room_a.refresh_from_db()
+        self.room_b.refresh_from_db()
+        self.assertEqual((self.room_a.active_count, self.room_b.active_count), (a, b))
+
+    def test_triggers_follow_every_customer_write(self):
+        first = Customer.objects.create(name='First', room=self.room_a, status='Active')
+        second = Customer.objects.create(name='Second', room=self.room_a, status='Active')
+        Customer.objects.create(name='Gone', room=self.room_a, status='Inactive')
+        self.assertCounts(2, 0)
+
+        # Bulk move, as room_delete's transfer does
+        Customer.objects.filter(pk=first.pk).update(room=self.room_b)
+        self.assertCounts(1, 1)
+
+        second.status = 'Inactive'
+        second.save()
+        self.assertCounts(0, 1)
+
+        first.delete()
+        self.assertCounts(0, 0)
+
+    def test_room_save_keeps_counter(self):
+        stale = Room.objects.get(pk=self.room_a.pk)
+        Customer.objects.create(name='Tenant', room=self.room_a, status='Active')
+        stale.price = Decimal('900.00')
+        stale.save()
+        self.assertCounts(1, 0)
+        self.assertEqual(self.room_a.price, Decimal('900.00'))
+
+
+class RoomStatusTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.empty = Room.objects.create(room_number='C1', room_type='Single', price=Decimal('900.00'), capacity=1, status='Occupied')
+        self.full = Room.objects.create(room_number='C2', room_type='Single', price=Decimal('900.00'), capacity=1)
+        self.repair = Room.objects.create(room_number='C3', room_type='Single', price=Decimal('900.00'), capacity=1, status='Under Maintenance')
+        Customer.objects.create(name='Tenant', room=self.full, status='Active')
+
+    def test_reconcile_command_fixes_drift_in_one_pass(self):
+        out = StringIO()
+        call_command('reconcile_room_status', stdout=out)
+        self.assertIn('2 rooms', out.getvalue())
+        statuses = dict(Room.objects.values_list('room_number', 'status'))
+        self.assertEqual(statuses, {'C1': 'Available', 'C2': 'Occupied', 'C3': 'Under Maintenance'})
+        # Nothing left to fix
+        self.assertEqual(reconcile_room_statuses(), 0)
+
+    def test_room_view_is_read_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('rooms'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))])
+
+    def test_transfer_marks_old_room_available_and_new_room_occupied(self):
+        customer = Customer.objects.get(name='Tenant')
+        self.client.post(reverse('transfer_customer', args=[customer.pk]), {'new_room': self.empty.pk})
+        self.empty.refresh_from_db()
+        self.full.refresh_from_db()
+        self.assertEqual((self.empty.status, self.full.status), ('Occupied', 'Available'))
+
+
+class VacancyIndexTest(TestCase):
+    def setUp(self):
+        # Versions restart with each test's rolled-back database
+        vacancy_index.clear()
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.single = Room.objects.create(room_number='D1', room_type='Single', price=Decimal('900.00'), capacity=1)
+        self.shared = Room.objects.create(room_number='D2', room_type='Bed Spacer', price=Decimal('700.00'), capacity=2)
+        Room.objects.create(room_number='E1', room_type='Single', price=Decimal('900.00'), capacity=1, status='Under Maintenance')
+
+    def test_prefix_search_from_memory(self):
+        response = self.client.get(reverse('search_rooms'), {'q': 'd'})
+        self.assertEqual([r['room_number'] for r in response.json()], ['D1', 'D2'])
+        self.assertEqual(self.client.get(reverse('search_rooms'), {'q': 'E'}).json(), [])
+
+        # Only the version check reaches the database once the index is built
+        with self.assertNumQueries(1):
+            self.assertEqual([v.room_number for v in vacancy_index.rooms('D2')], ['D2'])
+
+    def test_customer_write_rebuilds_index(self):
+        vacancy_index.rooms()
+        Customer.objects.create(name='Tenant', room=self.single, status='Active')
+        rooms = {v.room_number: v for v in vacancy_index.rooms('d')}
+        self.assertNotIn('D1', rooms)
+        Customer.objects.create(name='Bunkmate', room=self.shared, status='Active')
+        self.assertEqual(vacancy_index.rooms('d2')[0].available_slots, 1)
+
+
+class BatchTransferTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        today = timezone.localdate()
+        self.cheap = Room.objects.create(room_number='F1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.dear = Room.objects.create(room_number='F2', room_type='Single', price=Decimal('1500.00'), capacity=1)
+        self.ann = Customer.objects.create(name='Ann', room=self.cheap, due_date=today, status='Active')
+        self.ben = Customer.objects.create(name='Ben', room=self.dear, due_date=today, status='Active')
+        for customer, room in ((self.ann, self.cheap), (self.ben, self.dear)):
+            Payment.objects.create(
+                customer=customer, due_date=today, amount=room.price,
+                amount_received=room.price, date_paid=today, is_paid=True
+            )
+
+    def post_moves(self, moves):
+        return self.client.post(
+            reverse('transfer_customers'),
+            json.dumps({'moves': [{'customer_id': c, 'room_id': r} for c, r in moves]}),
+            content_type='application/json',
+        )
+
+    def test_swap_between_full_rooms(self):
+        response = self.post_moves([(self.ann.pk, self.dear.pk), (self.ben.pk, self.cheap.pk)])
+        self.assertEqual(response.json(), {'success': True, 'transferred': 2})
+
+        self.ann.refresh_from_db()
+        self.ben.refresh_from_db()
+        self.assertEqual((self.ann.room, self.ben.room), (self.dear, self.cheap))
+        self.assertEqual(RoomTransferHistory.objects.count(), 2)
+        # Ann's upgrade is topped up; Ben's surplus goes to next month
+        self.assertTrue(Payment.objects.filter(customer=self.ann, amount_received=Decimal('500.00'), remarks__startswith='Transfer Adjustment').exists())
+        self.assertTrue(Payment.objects.filter(customer=self.ben, amount_received=Decimal('500.00'), remarks__startswith='Transfer Credit').exists())
+        self.assertEqual(set(Room.objects.values_list('active_count', flat=True)), {1})
+
+    def test_overflow_is_rejected_without_writes(self):
+        response = self.post_moves([(self.ann.pk, self.dear.pk)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        self.ann.refresh_from_db()
+        self.assertEqual(self.ann.room, self.cheap)
+        self.assertFalse(RoomTransferHistory.objects.exists())
+
+    def test_room_delete_transfer_records_history(self):
+        spare = Room.objects.create(room_number='F3', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=2)
+        response = self.client.post(reverse('room_delete', args=[self.cheap.pk]), {'transfer_delete': '1', 'new_room': spare.pk})
+        self.assertRedirects(response, reverse('rooms'), fetch_redirect_response=False)
+        self.ann.refresh_from_db()
+        self.assertEqual(self.ann.room, spare)
+        self.assertTrue(RoomTransferHistory.objects.filter(customer=self.ann, room_to=spare).exists())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The FTS5 index is SQLite-only')
+class CustomerSearchTest(TestCase):
+    def setUp(self):
+        self.user = BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.room = Room.objects.create(room_number='G-12', room_type='Single', price=Decimal('900.00'), capacity=2)
+        self.maria = Customer.objects.create(name='Maria Santos', room=self.room, parents_contact_number='09171234567')
+        self.ana = Customer.objects.create(name='Ana Marasigan', room=self.room)
+
+    def names(self, query):
+        return [c.name for c in find_customers(query)]
+
+    def test_substring_fields_and_prefix_first(self):
+        self.assertEqual(self.names('mar'), ['Maria Santos', 'Ana Marasigan'])
+        self.assertEqual(self.names('1234'), ['Maria Santos'])
+        self.assertEqual(self.names('santos mar'), ['Maria Santos'])
+        response = self.client.get(reverse('search_customers'), {'q': 'G-12'})
+        self.assertEqual({c['room_no'] for c in response.json()}, {'G-12'})
+
+    def test_index_follows_writes(self):
+        self.room.room_number = 'H-7'
+        self.room.save()
+        self.assertEqual(len(find_customers('H-7')), 2)
+        self.ana.name = 'Ana Reyes'
+        self.ana.save()
+        self.assertEqual(self.names('mar'), ['Maria Santos'])
+        self.maria.delete()
+        self.assertEqual(self.names('mar'), [])
+
+    def test_short_queries_match_prefixes(self):
+        self.assertEqual(self.names('an'), ['Ana Marasigan'])
+
+
+class ImportDataTest(TestCase):
+    def write(self, suffix, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        with handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def run_import(self, kind, path):
+        out, err = StringIO(), StringIO()
+        call_command('import_data', kind, path, '--batch-size', '2', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_is_validated_batched_and_repeatable(self):
+        today = timezone.localdate().isoformat()
+        rooms = self.write('.csv', (
+            "room_number,room_type,capacity,price,status\n"
+            "R1,Single,1,1000.00,Available\n"
+            "R2,Bed Spacer,4,700.00,Available\n"
+            "R3,Single,2,900.00,Available\n"
+        ))
+        customers = self.write('.jsonl', "\n".join(json.dumps(row) for row in [
+            {'customer_id': 501, 'name': 'Lea', 'address': 'Cebu', 'room_number': 'R1', 'due_date': today, 'date_entry': today},
+            {'customer_id': 502, 'name': 'Mark', 'address': 'Davao', 'room_number': 'R2', 'due_date': today, 'date_entry': today},
+            {'customer_id': 503, 'name': 'Nina', 'address': 'Iloilo', 'room_number': 'R9'},
+        ]))
+        payments = self.write('.csv', (
+            "customer_id,due_date,amount,amount_received,is_paid,date_paid\n"
+            f"501,{today},1000.00,1000.00,true,{today}\n"
+        ))
+
+        out, err = self.run_import('rooms', rooms)
+        self.assertIn('2 imported', out)
+        self.assertIn('Line 4: capacity', err)
+        out, err = self.run_import('customers', customers)
+        self.assertIn('2 imported', out)
+        self.assertIn('unknown room R9', err)
+        self.run_import('payments', payments)
+
+        lea = Customer.objects.get(pk=501)
+        self.assertEqual(lea.room.room_number, 'R1')
+        self.assertEqual(lea.room.active_count, 1)
+        self.assertEqual(lea.room.status, 'Occupied')
+        self.assertEqual(lea.billing_state.status, 'Paid')
+
+        # Running again finds everything already there
+        out, _ = self.run_import('customers', customers)
+        self.assertIn('0 imported, 2 already present', out)
+        out, _ = self.run_import('payments', payments)
+        self.assertIn('0 imported, 1 already present', out)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        # Imported customers and payments are posted to the ledger as a rebuild would derive them
+        live = dict(LedgerAccount.objects.values_list('customer', 'balance'))
+        self.assertEqual(live, {501: Decimal('0.00'), 502: Decimal('700.00')})
+        call_command('rebuild_ledger', stdout=StringIO())
+        self.assertEqual(dict(LedgerAccount.objects.values_list('customer', 'balance')), live)
+
+        # A payment id that is not a number rejects its row like a bad customer id does
+        payments = self.write('.csv', (
+            "id,customer_id,due_date,amount,amount_received,is_paid,date_paid\n"
+            f"abc,502,{today},700.00,700.00,true,{today}\n"
+        ))
+        out, err = self.run_import('payments', payments)
+        self.assertIn('Line 2: id: abc is not a number', err)
+        self.assertEqual(Payment.objects.count(), 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+class ReportViewTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        today = timezone.localdate()
+        room = Room.objects.create(room_number='R7', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=8)
+        for name, amounts in (('Paid Pia', ['600.00', '400.00']), ('Partial Pat', ['400.00']), ('Unpaid Uma', [])):
+            customer = Customer.objects.create(name=name, room=room, due_date=today, status='Active')
+            for offset, amount in enumerate(amounts):
+                Payment.objects.create(
+                    customer=customer, due_date=today, amount=Decimal('1000.00'), amount_received=Decimal(amount),
+                    date_paid=today - timedelta(days=offset), is_paid=True, remarks=f'paid {amount}',
+                )
+        Customer.objects.create(name='Roomless Rae', due_date=today, status='Active')
+
+    def page(self, **params):
+        response = self.client.get(reverse('report_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def rows(self, **params):
+        return {row['name']: row for row in self.page(limit=100, **params)['rows']}
+
+    def test_default_view_rows(self):
+        rows = self.rows()
+        self.assertEqual(rows['Paid Pia']['paid_amount'], '1000.00')
+        self.assertEqual(rows['Paid Pia']['remarks'], 'paid 600.00')
+        # Statuses follow the dashboard's billing status rules
+        self.assertEqual(rows['Paid Pia']['status'], 'Paid')
+        self.assertEqual(rows['Partial Pat']['status'], 'Partially Paid • Balance: ₱600.00')
+        self.assertEqual(rows['Unpaid Uma']['status'], 'Due Today')
+        self.assertEqual(rows['Roomless Rae']['room_no'], '-')
+
+    def test_status_filter_and_query_count(self):
+        # Both paid today, so both are Paid, as on the dashboard
+        self.assertEqual(set(self.rows(status='paid')), {'Paid Pia', 'Partial Pat'})
+        self.assertEqual(set(self.rows(status='due_today')), {'Unpaid Uma', 'Roomless Rae'})
+        self.assertEqual(self.rows(status='overdue'), {})
+        self.assertEqual(self.rows(status='Unpaid'), {})
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('report'))
+        extras = [Customer.objects.create(name=f'Extra {i}', due_date=timezone.localdate()) for i in range(5)]
+        refresh_billing_states([customer.pk for customer in extras])
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('report'))
+        self.assertEqual(len(few), len(many))
+
+    def test_totals_cover_all_pages(self):
+        first = self.page(limit=1, sort='name')
+        self.assertEqual(first['count'], 4)
+        self.assertEqual(first['total_collected'], '1400.00')
+        self.assertEqual(self.client.get(reverse('report')).context['total_amount'], '1,400.00')
+        # Later windows skip the aggregates
+        second = self.page(limit=1, sort='name', cursor=first['next_cursor'])
+        self.assertIsNone(second['count'])
+
+        today = timezone.localdate()
+        dated = self.page(date_from=today - timedelta(days=1), date_to=today - timedelta(days=1))
+        self.assertEqual((dated['count'], dated['total_collected']), (1, '400.00'))
+
+    def test_sorted_windows(self):
+        for sort, direction, expected in (
+            ('name', 'asc', ['Paid Pia', 'Partial Pat', 'Roomless Rae', 'Unpaid Uma']),
+            ('paid_amount', 'desc', ['Paid Pia', 'Partial Pat', 'Roomless Rae', 'Unpaid Uma']),
+            ('status', 'desc', ['Paid Pia', 'Partial Pat', 'Roomless Rae', 'Unpaid Uma']),
+        ):
+            names, cursor = [], None
+            while True:
+                params = {'sort': sort, 'direction': direction, 'limit': 1}
+                if cursor:
+                    params['cursor'] = cursor
+                page = self.page(**params)
+                names += [row['name'] for row in page['rows']]
+                if not page['has_more']:
+                    break
+                cursor = page['next_cursor']
+            with self.subTest(sort=sort):
+                # Unpaid Uma and Roomless Rae tie; the primary key breaks the tie, in the same direction
+                self.assertEqual(names, expected)
+
+    def test_invalid_sort_or_cursor(self):
+        self.assertEqual(self.client.get(reverse('report_api'), {'sort': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('report_api'), {'cursor': 'nope'}).status_code, 400)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        today = timezone.localdate()
+        room = Room.objects.create(room_number='E1', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=4)
+        self.paid = Customer.objects.create(name='Paid Pia', room=room, due_date=today, status='Active')
+        self.partial = Customer.objects.create(name='Partial Pat', room=room, due_date=today, status='Active')
+        self.unpaid = Customer.objects.create(name='Unpaid Uma', due_date=today, status='Active')
+        for customer, amount in ((self.paid, '1000.00'), (self.partial, '400.00')):
+            Payment.objects.create(
+                customer=customer, due_date=today, amount=Decimal('1000.00'),
+                amount_received=Decimal(amount), date_paid=today, is_paid=True, remarks='Cash'
+            )
+
+    def rows(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(StringIO(content)))
+
+    def test_report_export_matches_report_statuses(self):
+        rows = self.rows('report_export')
+        self.assertEqual(rows[0][0], 'Customer ID')
+        by_name = {row[1]: row for row in rows[1:]}
+        self.assertEqual(by_name['Paid Pia'][-1], 'Paid')
+        self.assertEqual(by_name['Paid Pia'][-2], 'Cash')
+        self.assertEqual(by_name['Partial Pat'][-1], 'Partially Paid • Balance: ₱600.00')
+        self.assertEqual(by_name['Unpaid Uma'][5], '-')
+        self.assertEqual(by_name['Unpaid Uma'][-1], 'Due Today')
+
+    def test_report_export_applies_filters(self):
+        rows = self.rows('report_export', status='due_today')
+        self.assertEqual([row[1] for row in rows[1:]], ['Unpaid Uma'])
+        today = timezone.localdate().isoformat()
+        rows = self.rows('report_export', date_from=today, date_to=today, customer_name='pia')
+        self.assertEqual([(row[1], row[8]) for row in rows[1:]], [('Paid Pia', '1000.00')])
+
+    def test_customer_and_transfer_exports(self):
+        rows = self.rows('customer_export')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row[1] for row in rows[1:]}, {'Paid Pia', 'Partial Pat', 'Unpaid Uma'})
+
+        RoomTransferHistory.objects.create(
+            customer=self.paid, room_from=self.paid.room, room_to=None,
+            room_from_price=Decimal('1000.00'), room_to_price=Decimal('0.00')
+        )
+        rows = self.rows('transfer_report_export', customer_name='pia')
+        self.assertEqual(rows[1][1:5], ['Paid Pia', 'E1', '1000.00', '-'])
+
+
+class BatchPaymentTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.today = timezone.localdate()
+        self.room = Room.objects.create(room_number='P1', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=8)
+        self.customers = [
+            Customer.objects.create(name=f'Tenant {i}', room=self.room, due_date=self.today, status='Active')
+            for i in range(6)
+        ]
+
+    def post(self, entries):
+        return self.client.post(reverse('process_payments'), json.dumps({'payments': entries}), content_type='application/json')
+
+    def test_entries_follow_cycle_rules_in_order(self):
+        from dateutil.relativedelta import relativedelta
+
+        first, second = self.customers[:2]
+        placeholder = Payment.objects.create(customer=second, due_date=self.today, amount=Decimal('1000.00'))
+        results = self.post([
+            {'customer_id': first.pk, 'amount_received': '1200.00', 'remarks': 'envelope'},
+            {'customer_id': first.pk, 'amount_received': '300.00'},
+            {'customer_id': second.pk, 'amount_received': '400.00'},
+            {'customer_id': 0, 'amount_received': '100.00'},
+            {'customer_id': second.pk, 'amount_received': 'abc'},
+        ]).json()['results']
+
+        next_due = (self.today + relativedelta(months=1)).isoformat()
+        self.assertEqual((results[0]['change_amount'], results[0]['due_date'], results[0]['balance']), ('200.00', next_due, '1000.00'))
+        # The second envelope pays toward the next cycle, as a second process_payment would
+        self.assertEqual((results[1]['due_date'], results[1]['balance']), (next_due, '700.00'))
+        self.assertEqual(results[2]['payment_id'], placeholder.pk)
+        self.assertEqual(results[2]['balance'], '600.00')
+        self.assertEqual(results[3], {'success': False, 'error': 'Record not found'})
+        self.assertFalse(results[4]['success'])
+
+        first.refresh_from_db()
+        self.assertEqual(first.due_date.isoformat(), next_due)
+        placeholder.refresh_from_db()
+        self.assertTrue(placeholder.is_paid)
+        self.assertEqual(first.billing_state.cycle_paid, Decimal('300.00'))
+
+    def test_retry_is_idempotent_and_query_count_is_flat(self):
+        entries = [
+            {'customer_id': c.pk, 'amount_received': '500.00', 'idempotency_key': f'batch-{c.pk}'}
+            for c in self.customers
+        ]
+        with CaptureQueriesContext(connection) as two:
+            self.post(entries[:2])
+        with CaptureQueriesContext(connection) as six:
+            results = self.post(entries).json()['results']
+        self.assertEqual(len(two), len(six))
+
+        self.assertEqual([r['replayed'] for r in results], [True, True, False, False, False, False])
+        self.assertEqual(Payment.objects.filter(customer__in=self.customers).count(), 6)
+        self.assertTrue(all(r['balance'] == '500.00' for r in results))
+
+
+class GenerateCyclesTest(TestCase):
+    def test_opens_one_row_per_active_cycle_and_is_repeatable(self):
+        today = timezone.localdate()
+        room = Room.objects.create(room_number='G1', room_type='Bed Spacer', price=Decimal('900.00'), capacity=4)
+        open_ = [Customer.objects.create(name=f'Open {i}', room=room, due_date=today) for i in range(3)]
+        paid = Customer.objects.create(name='Paid', room=room, due_date=today)
+        Payment.objects.create(customer=paid, due_date=today, amount=room.price, amount_received=room.price, is_paid=True)
+        Customer.objects.create(name='Left', room=room, due_date=today, status='Inactive')
+        Customer.objects.create(name='Roomless', due_date=today)
+
+        out = StringIO()
+        call_command('generate_cycles', '--batch-size', '2', stdout=out)
+        self.assertIn('Opened 3 billing cycles', out.getvalue())
+        rows = Payment.objects.filter(is_paid=False)
+        self.assertEqual(set(rows.values_list('customer', flat=True)), {c.pk for c in open_})
+        self.assertTrue(all(p.amount == Decimal('900.00') and p.due_date == today for p in rows))
+
+        call_command('generate_cycles', stdout=out)
+        self.assertIn('Opened 0 billing cycles', out.getvalue())
+        self.assertEqual(Payment.objects.count(), 4)
+
+        # The payment page fills the open row in instead of adding another
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('get_customer_balance', args=[open_[0].pk]))
+        self.assertEqual(response.json()['payment_id'], rows.get(customer=open_[0]).pk)
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.today = timezone.localdate()
+        self.cheap = Room.objects.create(room_number='L1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.dear = Room.objects.create(room_number='L2', room_type='Single', price=Decimal('1500.00'), capacity=1)
+        self.ann = Customer.objects.create(name='Ann', room=self.cheap, due_date=self.today, status='Active')
+        self.ben = Customer.objects.create(name='Ben', room=self.dear, due_date=self.today, status='Active')
+
+    def pay(self, customer, amount):
+        return self.client.post(reverse('process_payment'), {'customer_id': customer.pk, 'amount_received': amount}).json()
+
+    def balances(self):
+        return dict(LedgerAccount.objects.values_list('customer', 'balance'))
+
+    def test_payments_keep_a_running_balance(self):
+        self.pay(self.ann, '400.00')
+        account = LedgerAccount.objects.get(customer=self.ann)
+        self.assertEqual(account.balance, Decimal('600.00'))
+        self.assertEqual(account.arrears(self.today), Decimal('600.00'))
+
+        data = self.pay(self.ann, '600.00')
+        account.refresh_from_db()
+        # The next cycle is charged as soon as this one is settled, but is not yet in arrears
+        self.assertEqual(account.balance, Decimal(data['balance']))
+        self.assertEqual(account.arrears(self.today), 0)
+        entries = list(LedgerEntry.objects.filter(customer=self.ann).order_by('seq'))
+        self.assertEqual([(e.seq, e.kind, e.amount, e.balance) for e in entries], [
+            (1, 'charge', Decimal('1000.00'), Decimal('1000.00')),
+            (2, 'payment', Decimal('-400.00'), Decimal('600.00')),
+            (3, 'payment', Decimal('-600.00'), Decimal('0.00')),
+            (4, 'charge', Decimal('1000.00'), Decimal('1000.00')),
+        ])
+        with self.assertRaises(ValueError):
+            entries[0].save()
+
+    def test_payments_report_the_ledger_balance(self):
+        from dateutil.relativedelta import relativedelta
+
+        # An unpaid earlier cycle is carried as arrears on top of the current one
+        Payment.objects.create(customer=self.ann, due_date=self.today - relativedelta(months=1), amount=self.cheap.price)
+        rebuild_ledgers([self.ann.pk])
+        self.assertEqual(self.pay(self.ann, '400.00')['balance'], '1600.00')
+        results = self.client.post(reverse('process_payments'), json.dumps({'payments': [
+            {'customer_id': self.ann.pk, 'amount_received': '100.00'},
+            {'customer_id': self.ann.pk, 'amount_received': '200.00'},
+        ]}), content_type='application/json').json()['results']
+        self.assertEqual([r['balance'] for r in results], ['1500.00', '1300.00'])
+        self.assertEqual(self.client.get(reverse('get_customer_balance', args=[self.ann.pk])).json()['balance'], '1300.00')
+
+    def test_live_ledger_matches_a_rebuild(self):
+        from Payment_Scheduler.transfers import transfer_customers
+
+        self.pay(self.ben, '500.00')
+        # Cycles paid in full without the due date moving, so the swap adjusts them
+        for customer, room in ((self.ann, self.cheap), (self.ben, self.dear)):
+            Payment.objects.create(
+                customer=customer, due_date=self.today, amount=room.price,
+                amount_received=room.price, date_paid=self.today, is_paid=True
+            )
+        call_command('rebuild_ledger', stdout=StringIO())
+        transfer_customers([(self.ann.pk, self.dear.pk), (self.ben.pk, self.cheap.pk)])
+        self.client.post(reverse('process_payments'), json.dumps({'payments': [
+            {'customer_id': self.ann.pk, 'amount_received': '1500.00'},
+        ]}), content_type='application/json')
+        live = self.balances()
+        kinds = set(LedgerEntry.objects.values_list('kind', flat=True))
+
+        call_command('rebuild_ledger', stdout=StringIO())
+        self.assertEqual(self.balances(), live)
+        self.assertEqual(kinds, {'charge', 'payment', 'adjustment', 'credit'})
+
+    def test_transfers_of_unsettled_cycles_match_a_rebuild(self):
+        from Payment_Scheduler.transfers import transfer_customers
+
+        small = Room.objects.create(room_number='L5', room_type='Bed Spacer', price=Decimal('800.00'), capacity=4)
+        mid = Room.objects.create(room_number='L6', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=4)
+        big = Room.objects.create(room_number='L7', room_type='Bed Spacer', price=Decimal('1500.00'), capacity=4)
+        unpaid = Customer.objects.create(name='Una', room=small, due_date=self.today, status='Active')
+        partial = Customer.objects.create(name='Pia', room=small, due_date=self.today, status='Active')
+        roomless = Customer.objects.create(name='Rex', due_date=self.today, status='Inactive')
+        Payment.objects.create(customer=partial, due_date=self.today, amount=small.price,
+                               amount_received=Decimal('300.00'), date_paid=self.today, is_paid=True)
+        Payment.objects.create(customer=roomless, due_date=self.today, amount=Decimal('1500.00'),
+                               amount_received=Decimal('1500.00'), date_paid=self.today, is_paid=True)
+        ids = [unpaid.pk, partial.pk, roomless.pk]
+        rebuild_ledgers(ids)
+
+        transfer_customers([(unpaid.pk, big.pk), (partial.pk, mid.pk), (roomless.pk, small.pk)])
+        live = self.balances()
+        self.assertEqual([live[pk] for pk in ids], [Decimal('1500.00'), Decimal('700.00'), Decimal('-700.00')])
+        rebuild_ledgers(ids)
+        self.assertEqual(self.balances(), live)
+
+    def test_edits_that_change_what_is_owed_match_a_rebuild(self):
+        room = Room.objects.create(room_number='L3', room_type='Bed Spacer', price=Decimal('1000.00'), capacity=4)
+        spare = Room.objects.create(room_number='L4', room_type='Bed Spacer', price=Decimal('800.00'), capacity=4)
+        overdue = (self.today - timedelta(days=10)).isoformat()
+        form = {'name': 'Cal', 'address': 'Town', 'status': 'Active', 'room': room.pk, 'due_date': overdue, 'date_entry': overdue}
+        self.client.post(reverse('customer_create'), form)
+        cal = Customer.objects.get(name='Cal')
+        account = LedgerAccount.objects.get(customer=cal)
+        self.assertEqual((account.balance, account.arrears(self.today)), (Decimal('1000.00'), Decimal('1000.00')))
+
+        # A rate change after a partial payment reprices the open cycle
+        self.pay(cal, '400.00')
+        self.client.post(reverse('room_edit', args=[room.pk]), {
+            'room_number': 'L3', 'room_type': 'Bed Spacer', 'price': '1500.00', 'capacity': 4, 'status': room.status,
+        })
+        self.assertEqual(LedgerAccount.objects.get(customer=cal).balance, Decimal('1100.00'))
+
+        # So do a room or due date changed by hand
+        dee = Customer.objects.create(name='Dee', room=room, due_date=self.today, status='Active')
+        self.client.post(reverse('customer_edit', args=[dee.pk]), {
+            'name': 'Dee', 'address': 'Town', 'status': 'Active', 'room': spare.pk, 'due_date': overdue, 'date_entry': overdue,
+        })
+        self.assertEqual(LedgerAccount.objects.get(customer=dee).balance, Decimal('800.00'))
+
+        # Ann and Ben were created without a ledger, so compare the tenants that went through the views
+        live = self.balances()
+        call_command('rebuild_ledger', stdout=StringIO())
+        self.assertEqual({pk: self.balances()[pk] for pk in live}, live)
+        arrears = {account.customer_id: account.arrears(self.today) for account in LedgerAccount.objects.all()}
+        self.assertEqual(arrears[cal.pk], Decimal('1100.00'))
+        self.assertEqual(arrears[dee.pk], Decimal('800.00'))
+
+    def test_statement_pages_by_seq(self):
+        for amount in ('100.00', '200.00', '300.00'):
+            self.pay(self.ann, amount)
+        url = reverse('customer_ledger', args=[self.ann.pk])
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(first['balance'], '400.00')
+        self.assertEqual([e['seq'] for e in first['entries']], [1, 2])
+        rest = self.client.get(url, {'after': first['next_after'], 'limit': 2}).json()
+        self.assertEqual([e['seq'] for e in rest['entries']], [3, 4])
+        self.assertIsNone(rest['next_after'])
+
+
+class LedgerMigrationTest(TransactionTestCase):
+    before = [('Payment_Scheduler', '0023_payment_idempotency_key')]
+    after = [('Payment_Scheduler', '0024_ledger')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes('Payment_Scheduler'))
+
+    def test_existing_customers_keep_their_balance(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        today = timezone.localdate()
+        room = apps.get_model('Payment_Scheduler', 'Room').objects.create(
+            room_number='M1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        customer = apps.get_model('Payment_Scheduler', 'Customer').objects.create(
+            name='Mia', address='Town', room=room, due_date=today, status='Active')
+        Payment = apps.get_model('Payment_Scheduler', 'Payment')
+        Payment.objects.create(customer=customer, due_date=today - timedelta(days=30), amount=Decimal('1000.00'),
+                               is_paid=True, date_paid=today - timedelta(days=30), amount_received=Decimal('1000.00'))
+        Payment.objects.create(customer=customer, due_date=today, amount=Decimal('1000.00'),
+                               is_paid=True, date_paid=today, amount_received=Decimal('400.00'))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        account = apps.get_model('Payment_Scheduler', 'LedgerAccount').objects.get(customer=customer.pk)
+        self.assertEqual(account.balance, Decimal('600.00'))
+
+
+class BillingCycleTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.today = timezone.localdate()
+        room = Room.objects.create(room_number='C1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.customer = Customer.objects.create(name='Cy', room=room, due_date=self.today, status='Active')
+
+    def cycle(self):
+        return BillingCycle.objects.get(customer=self.customer, due_date=self.today)
+
+    def test_triggers_follow_every_payment_write(self):
+        open_row = Payment.objects.create(customer=self.customer, due_date=self.today, amount=Decimal('1000.00'))
+        self.assertEqual((self.cycle().status, self.cycle().payment_count), ('Unpaid', 0))
+
+        Payment.objects.bulk_create([Payment(
+            customer=self.customer, due_date=self.today, amount=Decimal('1000.00'), amount_received=Decimal('400.00'),
+            change_amount=Decimal('0.00'), date_paid=self.today, is_paid=True,
+        )])
+        self.assertEqual((self.cycle().status, self.cycle().total_received), ('Partially Paid', Decimal('400.00')))
+
+        Payment.objects.filter(pk=open_row.pk).update(
+            is_paid=True, amount_received=Decimal('600.00'), change_amount=Decimal('50.00'), date_paid=self.today
+        )
+        cycle = self.cycle()
+        self.assertEqual((cycle.status, cycle.total_received, cycle.total_change), ('Paid', Decimal('1000.00'), Decimal('50.00')))
+
+        # Moving a row to another cycle updates both
+        next_due = self.today + timedelta(days=30)
+        Payment.objects.filter(pk=open_row.pk).update(due_date=next_due)
+        self.assertEqual(self.cycle().total_received, Decimal('400.00'))
+        self.assertEqual(BillingCycle.objects.get(customer=self.customer, due_date=next_due).status, 'Partially Paid')
+
+        Payment.objects.filter(customer=self.customer).delete()
+        self.assertFalse(BillingCycle.objects.exists())
+
+    def test_history_and_receipt_read_the_cycle(self):
+        for amount in ('400.00', '700.00'):
+            self.client.post(reverse('process_payment'), {'customer_id': self.customer.pk, 'amount_received': amount})
+        history = self.client.get(reverse('customer_payment_history', args=[self.customer.pk])).json()['history']
+        self.assertEqual([(h['total_paid'], h['status']) for h in history], [('1000.00', 'Paid')])
+
+        receipt = self.client.get(
+            reverse('customer_payment_receipt', args=[self.customer.pk, self.today.isoformat()])
+        ).json()
+        self.assertEqual((receipt['total_paid'], receipt['change'], receipt['status']), ('1000.00', '100.00', 'Paid'))
+        self.assertEqual(len(receipt['items']), 2)
+
+    def test_history_counts_transfer_credit(self):
+        from dateutil.relativedelta import relativedelta
+        from Payment_Scheduler.transfers import transfer_customers
+
+        cheap = Room.objects.create(room_number='C2', room_type='Single', price=Decimal('600.00'), capacity=1)
+        # Paid up in the dearer room, so moving down credits the surplus to the next cycle's unpaid row
+        Payment.objects.create(
+            customer=self.customer, due_date=self.today, amount=Decimal('1000.00'),
+            amount_received=Decimal('1000.00'), date_paid=self.today, is_paid=True,
+        )
+        transfer_customers([(self.customer.pk, cheap.pk)])
+        credit_row = Payment.objects.get(customer=self.customer, due_date=self.today + relativedelta(months=1))
+        self.assertEqual((credit_row.is_paid, credit_row.amount_received), (False, Decimal('400.00')))
+
+        history = self.client.get(reverse('customer_payment_history', args=[self.customer.pk])).json()['history']
+        self.assertEqual([(h['total_paid'], h['status']) for h in history], [
+            ('1000.00', 'Paid'), ('400.00', 'Partially Paid'),
+        ])
+
+
+class CashierReadPathTest(TestCase):
+    """The balance and receipt endpoints: one query each, besides the session and user lookups."""
+
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.today = timezone.localdate()
+        self.room = Room.objects.create(room_number='Q1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.customer = Customer.objects.create(name='Quinn', room=self.room, due_date=self.today, status='Active')
+
+    def test_get_customer_balance(self):
+        open_row = Payment.objects.create(customer=self.customer, due_date=self.today, amount=Decimal('1000.00'))
+        Payment.objects.create(
+            customer=self.customer, due_date=self.today, amount=Decimal('1000.00'),
+            amount_received=Decimal('250.00'), date_paid=self.today, is_paid=True,
+        )
+        # The balance is read from the ledger
+        rebuild_ledgers([self.customer.pk])
+        url = reverse('get_customer_balance', args=[self.customer.pk])
+        with self.assertNumQueries(3):
+            data = self.client.get(url).json()
+        self.assertEqual(data, {
+            'customer_id': self.customer.pk,
+            'customer_db_id': self.customer.pk,
+            'name': 'Quinn',
+            'room_no': 'Q1',
+            'payment_id': open_row.pk,
+            'due_date': self.today.isoformat(),
+            'balance': '750.00',
+        })
+
+        roomless = Customer.objects.create(name='Nomad')
+        with self.assertNumQueries(3):
+            data = self.client.get(reverse('get_customer_balance', args=[roomless.pk])).json()
+        self.assertEqual((data['room_no'], data['payment_id'], data['balance']), ('N/A', '', 0))
+
+    def test_customer_payment_receipt(self):
+        for amount, change in (('400.00', '0.00'), ('600.00', '100.00')):
+            Payment.objects.create(
+                customer=self.customer, due_date=self.today, amount=Decimal('1000.00'), remarks=f'paid {amount}',
+                amount_received=Decimal(amount), change_amount=Decimal(change), date_paid=self.today, is_paid=True,
+            )
+        url = reverse('customer_payment_receipt', args=[self.customer.pk, self.today.isoformat()])
+        with self.assertNumQueries(3) as queries:
+            data = self.client.get(url).json()
+        # The totals and status are the cycle's, joined into the payments query
+        self.assertIn('Payment_Scheduler_billingcycle', queries.captured_queries[-1]['sql'])
+        self.assertEqual(
+            (data['amount_due'], data['total_paid'], data['change'], data['status']),
+            ('1000.00', '1000.00', '100.00', 'Paid'),
+        )
+        self.assertEqual(data['remarks'], 'paid 400.00 | paid 600.00')
+        self.assertEqual(data['customer']['room'], 'Q1')
+
+        missing = reverse('customer_payment_receipt', args=[self.customer.pk, '2000-01-01'])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+
+class RevenueRollupTest(TestCase):
+    def setUp(self):
+        BoardingHouseUser.objects.create_superuser(username='admin', password='password', role='Admin')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        self.today = timezone.localdate()
+        self.month = self.today.replace(day=1)
+        self.last_month = self.month - timedelta(days=1)
+        self.single = Room.objects.create(room_number='V1', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.shared = Room.objects.create(room_number='V2', room_type='Bed Spacer', price=Decimal('500.00'), capacity=4)
+        self.vic = Customer.objects.create(name='Vic', room=self.single, due_date=self.today, status='Active')
+        self.wes = Customer.objects.create(name='Wes', room=self.shared, due_date=self.today, status='Active')
+
+    def pay(self, customer, amount, date_paid, **fields):
+        return Payment.objects.create(
+            customer=customer, due_date=customer.due_date, amount=customer.room.price,
+            amount_received=Decimal(amount), date_paid=date_paid, is_paid=True, **fields
+        )
+
+    def rollup(self):
+        return {
+            (row.month, row.room_id): (row.total_received, row.payment_count, row.payer_count)
+            for row in RevenueRollup.objects.all()
+        }
+
+    def test_triggers_follow_every_write_and_match_a_rebuild(self):
+        self.pay(self.vic, '400.00', self.today)
+        self.pay(self.vic, '600.00', self.today)
+        Payment.objects.bulk_create([Payment(
+            customer=self.wes, due_date=self.today, amount=Decimal('500.00'), amount_received=Decimal('500.00'),
+            date_paid=self.last_month, is_paid=True,
+        )])
+        open_row = Payment.objects.create(customer=self.wes, due_date=self.today, amount=Decimal('500.00'))
+        self.assertEqual(self.rollup(), {
+            (self.month, self.single.pk): (Decimal('1000.00'), 2, 1),
+            (self.last_month.replace(day=1), self.shared.pk): (Decimal('500.00'), 1, 1),
+        })
+
+        Payment.objects.filter(pk=open_row.pk).update(is_paid=True, amount_received=Decimal('250.00'), date_paid=self.today)
+        self.assertEqual(self.rollup()[self.month, self.shared.pk], (Decimal('250.00'), 1, 1))
+
+        # Payments stay with the room they were paid in
+        Customer.objects.filter(pk=self.vic.pk).update(room=self.shared)
+        self.assertEqual(self.rollup()[self.month, self.single.pk], (Decimal('1000.00'), 2, 1))
+        self.pay(self.vic, '500.00', self.today)
+        self.assertEqual(self.rollup()[self.month, self.shared.pk], (Decimal('750.00'), 2, 2))
+
+        Payment.objects.filter(pk=open_row.pk).delete()
+        self.assertEqual(self.rollup()[self.month, self.shared.pk], (Decimal('500.00'), 1, 1))
+
+        live = self.rollup()
+        call_command('rebuild_revenue_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup(), live)
+
+    def test_transfers_and_room_deletes_keep_past_months(self):
+        from Payment_Scheduler.transfers import transfer_customers
+
+        for customer in (self.vic, self.wes):
+            Payment.objects.create(
+                customer=customer, due_date=self.last_month, amount=customer.room.price,
+                amount_received=customer.room.price, date_paid=self.last_month, is_paid=True,
+            )
+        before = self.rollup()
+        transfer_customers([(self.vic.pk, self.shared.pk), (self.wes.pk, self.single.pk)])
+        self.assertEqual(self.rollup(), before)
+        self.vic.refresh_from_db()
+        self.pay(self.vic, '500.00', self.today)
+        self.assertEqual(self.rollup()[self.month, self.shared.pk], (Decimal('500.00'), 1, 1))
+
+        # A deleted room's revenue stays in the month's total, under no room
+        self.client.post(reverse('room_delete', args=[self.single.pk]), {
+            'transfer_delete': '1', 'new_room': self.shared.pk,
+        })
+        self.assertFalse(Room.objects.filter(pk=self.single.pk).exists())
+        last_month = self.last_month.replace(day=1)
+        self.assertEqual(self.rollup()[last_month, None], (Decimal('1000.00'), 1, 1))
+        self.assertEqual(self.rollup()[last_month, self.shared.pk], (Decimal('500.00'), 1, 1))
+        self.assertEqual(revenue_trend(2, today=self.today)[0]['total_received'], Decimal('1500.00'))
+
+        live = self.rollup()
+        call_command('rebuild_revenue_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup(), live)
+
+    def test_summary_and_trend_read_the_rollup(self):
+        self.pay(self.vic, '1000.00', self.today)
+        self.pay(self.wes, '500.00', self.last_month)
+        self.assertEqual(dashboard_summary(self.today)['monthly_revenue'], Decimal('1000.00'))
+
+        with self.assertNumQueries(1):
+            trend = revenue_trend(3, today=self.today)
+        self.assertEqual([row['total_received'] for row in trend], [Decimal('0'), Decimal('500.00'), Decimal('1000.00')])
+        self.assertEqual(trend[-1]['month'], self.month)
+
+        response = self.client.get(reverse('revenue_trend'), {'months': 2, 'room': self.shared.pk})
+        self.assertEqual(
+            [(row['total_received'], row['payer_count']) for row in response.json()['months']],
+            [('500.00', 1), ('0.00', 0)],
+        )
+        self.assertEqual(self.client.get(reverse('revenue_trend'), {'months': 0}).status_code, 400)
+
+
+class QueryPlanTest(TestCase):
+    """
+    Fails when a hot query stops using an index. A plain "SCAN <table>" reads
+    every row; so does an index scan that still needs a full sort afterwards.
+    """
+
+    def setUp(self):
+        room = Room.objects.create(room_number='901', room_type='Single', price=Decimal('1000.00'), capacity=1)
+        self.customer = Customer.objects.create(name='Eve', room=room, due_date=timezone.localdate(), status='Active')
+        refresh_billing_states([self.customer.pk])
+
+    def assertUsesIndexes(self, queryset, full_scan=None):
+        """`full_scan` names a table the query is meant to read in full, such as a report's driving table."""
+        plan = [line.split(' ', 3)[-1] for line in queryset.explain().splitlines()]
+        sorted_in_full = any(detail.startswith('USE TEMP B-TREE FOR ORDER BY') for detail in plan)
+        scans = [
+            detail for detail in plan
+            if detail.startswith('SCAN ') and (' USING ' not in detail or sorted_in_full)
+            and detail.split(' USING ')[0] != f'SCAN {full_scan}'
+        ]
+        self.assertEqual(scans, [], '\n'.join(plan))
+
+    # Sorts by the room's columns read every customer and sort them: the room
+    # is a LEFT JOIN (customers need not have one), and SQLite cannot read a
+    # left join in the joined table's index order
+    ROOM_SORTS = {'room_no', 'room_rate'}
+    # Report sorts by a per-customer aggregate or a column nobody filters on
+    # sort the customers in full; the first window's totals read them all anyway
+    UNINDEXED_REPORT_SORTS = {'contact_number', 'parents_name', 'paid_amount', 'status', 'date_paid', 'remarks'}
+
+    def test_dashboard_api(self):
+        today = timezone.localdate()
+        for sort in views.DASHBOARD_SORT_KEYS:
+            paths = views.DASHBOARD_SORT_KEYS[sort] + ['pk']
+            queryset = views._dashboard_queryset(today).order_by(*[F(path).desc(nulls_last=True) for path in paths])
+            with self.subTest(sort=sort):
+                if sort in self.ROOM_SORTS:
+                    self.assertUsesIndexes(queryset[:13], full_scan='Payment_Scheduler_customer')
+                else:
+                    self.assertUsesIndexes(queryset[:13])
+        self.assertUsesIndexes(views._changed_customers(0))
+
+    def test_get_customer_balance(self):
+        self.assertUsesIndexes(views._balance_customers().filter(pk=self.customer.pk))
+
+    def test_report_view(self):
+        today = timezone.localdate()
+        self.assertUsesIndexes(views._report_payments(today - timedelta(days=30), today))
+        for status in (None, 'paid', 'due_today', 'overdue'):
+            with self.subTest(status=status):
+                rows = views._report_customer_rows(status=status)
+                self.assertUsesIndexes(rows, full_scan='Payment_Scheduler_customer')
+                # The latest paid payment is found per customer without a sort
+                self.assertNotIn('USE TEMP B-TREE', rows.explain())
+
+    def test_report_api(self):
+        today = timezone.localdate()
+        # The default windows are read in index order
+        payments = views._report_payments(today - timedelta(days=30), today)
+        self.assertUsesIndexes(payments.order_by('date_paid', 'pk')[:51])
+        self.assertUsesIndexes(views._report_customers().order_by('pk')[:51], full_scan='Payment_Scheduler_customer')
+        for sort, (customer_paths, payment_paths) in views.REPORT_SORT_KEYS.items():
+            # A date range is a range search; its rows are sorted after it, whatever the column
+            with self.subTest(sort=sort):
+                self.assertUsesIndexes(payments.order_by(*payment_paths, 'pk')[:51])
+            with self.subTest(sort=sort, view='customers'):
+                customers = views._report_customers().order_by(*customer_paths, 'pk')[:51]
+                self.assertUsesIndexes(customers, full_scan='Payment_Scheduler_customer')
+                if sort not in self.ROOM_SORTS | self.UNINDEXED_REPORT_SORTS:
+                    self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', customers.explain())
+
+    def test_revenue_rollup(self):
+        month = timezone.localdate().replace(day=1)
+        self.assertUsesIndexes(RevenueRollup.objects.filter(month=month))
+        self.assertUsesIndexes(RevenueRollup.objects.filter(month__gte=month - timedelta(days=365), month__lte=month))
+        # The triggers' recompute of one room's month
+        self.assertUsesIndexes(Payment.objects.filter(
+            is_paid=True, room=self.customer.room_id, date_paid__gte=month, date_paid__lt=month + timedelta(days=31),
+        ))
+
+    def test_billing_cycles(self):
+        self.assertUsesIndexes(views._billing_cycles(self.customer.pk))
+        self.assertUsesIndexes(BillingCycle.objects.filter(customer=self.customer, due_date=self.customer.due_date))
+
+    def test_customer_ledger(self):
+        self.assertUsesIndexes(views._ledger_entries(self.customer.pk, 10)[:100])
+
+    def test_transfer_report_view(self):
+        today = timezone.localdate().isoformat()
+        self.assertUsesIndexes(views._transfer_history())
+        self.assertUsesIndexes(views._transfer_history(date_from=today, date_to=today))
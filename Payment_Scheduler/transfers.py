@@ -0,0 +1,169 @@
+from collections import Counter
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import F
+from django.utils import timezone
+
+from .billing import refresh_billing_states
+from .ledger import CREDIT, charge_entry, payment_entry, post_entries
+from .models import BillingCycle, Customer, Payment, Room, RoomTransferHistory
+from .occupancy import UNDER_MAINTENANCE, reconcile_room_statuses
+from .signals import notify_bulk_write
+
+
+class TransferError(ValueError):
+    pass
+
+
+def transfer_customers(moves, today=None):
+    """
+    Moves customers between rooms. `moves` is a list of (customer_id,
+    room_id) pairs. Payment adjustments for the current cycle are the same
+    as for a single transfer:
+    - a move to a pricier room records the difference as paid;
+    - a move to a cheaper room credits the surplus to the next cycle.
+
+    Cycle sums and next-cycle payments are read with one query each. History,
+    payments and the room change are written in bulk, and room statuses are
+    reconciled once.
+    Call it inside a transaction; raises TransferError before writing anything
+    if a customer or room is unknown, listed twice, or a room would overflow.
+    Returns the number of customers moved.
+    """
+    today = today or timezone.localdate()
+    moves = [(int(customer_id), int(room_id)) for customer_id, room_id in moves]
+
+    customer_ids = [customer_id for customer_id, _ in moves]
+    if len(set(customer_ids)) != len(customer_ids):
+        raise TransferError("A customer is listed more than once.")
+
+    customers = Customer.objects.select_for_update().select_related('room').in_bulk(customer_ids)
+    rooms = Room.objects.in_bulk({room_id for _, room_id in moves})
+    for customer_id, room_id in moves:
+        if customer_id not in customers:
+            raise TransferError(f"Customer {customer_id} not found.")
+        if room_id not in rooms:
+            raise TransferError(f"Room {room_id} not found.")
+
+    # Same-room moves are no-ops
+    moves = [(customers[c], rooms[r]) for c, r in moves if customers[c].room_id != r]
+    _check_capacity(moves, rooms)
+    if not moves:
+        return 0
+
+    moved_ids = [customer.pk for customer, _ in moves]
+    cycle_paid = dict(
+        BillingCycle.objects.filter(customer__in=moved_ids, due_date=F('customer__due_date'))
+        .values_list('customer', 'total_received')
+    )
+
+    # Upgrades become new payments now; downgrades collect as
+    # (customer, old_room, new_room, surplus) until next-cycle payments are loaded
+    credits = []
+    ledger = []
+    new_payments = []
+    for customer, new_room in moves:
+        old_room = customer.room
+        if not customer.due_date:
+            continue
+        # In the ledger the current cycle is repriced to the new room whatever
+        # has been paid toward it; a roomless customer is charged for it here
+        ledger.append(charge_entry(customer.pk, customer.due_date, new_room.price, f"Moved to {new_room.room_number}"))
+        if not old_room:
+            continue
+        amount_paid = cycle_paid.get(customer.pk) or 0
+        # Only adjust if fully paid for the old room (or paid at least the old price)
+        if amount_paid < old_room.price:
+            continue
+        diff = new_room.price - amount_paid
+        if diff > 0:
+            # Upgrade: waive the difference for the current cycle so they remain "Paid"
+            waiver = Payment(
+                customer=customer,
+                due_date=customer.due_date,
+                amount=diff,
+                amount_received=diff,
+                is_paid=True,
+                remarks=f"Transfer Adjustment: Moved to {new_room.room_number}",
+                date_paid=today,
+            )
+            new_payments.append(waiver)
+            # In the ledger the rise in the cycle's charge is credited back
+            ledger.append(payment_entry(waiver, CREDIT))
+        elif diff < 0:
+            # Downgrade: credit the surplus to the next cycle
+            # In the ledger the surplus is already there as money paid
+            credits.append((customer, old_room, new_room, -diff))
+
+    next_payments = _next_cycle_payments([customer for customer, _, _, _ in credits])
+    updated_payments = []
+    for customer, old_room, new_room, surplus in credits:
+        next_due = customer.due_date + relativedelta(months=1)
+        next_payment = next_payments.get((customer.pk, next_due))
+        if next_payment:
+            next_payment.amount_received = (next_payment.amount_received or 0) + surplus
+            # Check if this surplus makes it fully paid
+            if next_payment.amount_received >= new_room.price:
+                next_payment.is_paid = True
+            next_payment.remarks = (next_payment.remarks or "") + f" | Transfer Credit from {old_room.room_number}"
+            updated_payments.append(next_payment)
+        else:
+            new_payments.append(Payment(
+                customer=customer,
+                due_date=next_due,
+                amount=new_room.price,  # Set expected amount to new room price
+                amount_received=surplus,
+                is_paid=surplus >= new_room.price,
+                remarks=f"Transfer Credit: Moved from {old_room.room_number}",
+                date_paid=today,
+            ))
+
+    Payment.objects.bulk_create(new_payments)
+    post_entries(ledger)
+    Payment.objects.bulk_update(updated_payments, ['amount_received', 'is_paid', 'remarks'])
+    RoomTransferHistory.objects.bulk_create([
+        RoomTransferHistory(
+            customer=customer,
+            room_from=customer.room,
+            room_to=new_room,
+            room_from_price=customer.room.price if customer.room else 0,
+            room_to_price=new_room.price,
+        )
+        for customer, new_room in moves
+    ])
+
+    old_room_ids = {customer.room_id for customer, _ in moves}
+    for customer, new_room in moves:
+        customer.room = new_room
+    Customer.objects.bulk_update([customer for customer, _ in moves], ['room'])
+
+    reconcile_room_statuses(old_room_ids | {room.pk for _, room in moves})
+    refresh_billing_states(moved_ids, today)
+    notify_bulk_write()
+    return len(moves)
+
+
+def _check_capacity(moves, rooms):
+    """Rejects moves into rooms under maintenance or past capacity once every move is applied."""
+    arriving = Counter(room.pk for customer, room in moves if customer.status == 'Active')
+    leaving = Counter(customer.room_id for customer, _ in moves if customer.status == 'Active')
+    for room_id in {room.pk for _, room in moves}:
+        room = rooms[room_id]
+        if room.status == UNDER_MAINTENANCE:
+            raise TransferError(f"Room {room.room_number} is under maintenance.")
+        count = arriving[room_id]
+        if count and room.active_count - leaving[room_id] + count > room.capacity:
+            raise TransferError(f"Room {room.room_number} does not have {count} free slot(s).")
+
+
+def _next_cycle_payments(customers):
+    """The first payment recorded for each customer's next due date, keyed by (customer_id, due_date)."""
+    if not customers:
+        return {}
+    wanted = {(customer.pk, customer.due_date + relativedelta(months=1)) for customer in customers}
+    payments = Payment.objects.filter(
+        customer__in=[customer_id for customer_id, _ in wanted],
+        due_date__in={due_date for _, due_date in wanted},
+    ).order_by('-pk')
+    # Iterating newest first leaves the lowest pk per key, matching .first()
+    return {(p.customer_id, p.due_date): p for p in payments if (p.customer_id, p.due_date) in wanted}
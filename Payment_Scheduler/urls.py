@@ -5,11 +5,15 @@ urlpatterns = [
     path('', views.login_view, name='login'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('api/dashboard_data/', views.dashboard_api, name='dashboard_api'),
+    path('api/dashboard_events/', views.dashboard_events, name='dashboard_events'),
+    path('api/revenue_trend/', views.revenue_trend_api, name='revenue_trend'),
     path('api/customers_data/', views.customers_api, name='customers_api'),
+    path('api/report_data/', views.report_api, name='report_api'),
     path('users/', views.user_management_view, name='users'),
     path('users/create/', views.user_create, name='user_create'),
     path('users/<int:pk>/edit/', views.user_edit, name='user_edit'),
     path('customers/', views.customer_view, name='customers'),
+    path('customers/export/', views.customer_export, name='customer_export'),
     path('customers/create/', views.customer_create, name='customer_create'),
     path('customers/<int:pk>/edit/', views.customer_edit, name='customer_edit'),
     path('customers/<int:pk>/delete/', views.customer_delete, name='customer_delete'),
@@ -18,7 +22,9 @@ urlpatterns = [
     path('api/search_customers/', views.search_customers, name='search_customers'),
     path('api/get_balance/<int:customer_id>/', views.get_customer_balance, name='get_customer_balance'),
     path('api/process_payment/', views.process_payment, name='process_payment'),
+    path('api/process_payments/', views.process_payments_api, name='process_payments'),
     path('api/customer_payments/<int:customer_id>/', views.customer_payment_history, name='customer_payment_history'),
+    path('api/customer_ledger/<int:customer_id>/', views.customer_ledger, name='customer_ledger'),
     path('api/customer_payment_receipt/<int:customer_id>/<str:due_date>/', views.customer_payment_receipt, name='customer_payment_receipt'),
     
     # Room URLs
@@ -28,9 +34,12 @@ urlpatterns = [
      path('rooms/<int:pk>/delete/', views.room_delete, name='room_delete'),
      path('rooms/<int:pk>/occupants/', views.room_occupants, name='room_occupants'),
      path('rooms/transfer/<int:customer_id>/', views.transfer_customer, name='transfer_customer'),
+     path('api/transfer_customers/', views.transfer_customers_api, name='transfer_customers'),
      path('api/search_rooms/', views.search_rooms, name='search_rooms'),
     path('report/', views.report_view, name='report'),
+    path('report/export/', views.report_export, name='report_export'),
     path('report/transfers/', views.transfer_report_view, name='transfer_report'),
+    path('report/transfers/export/', views.transfer_report_export, name='transfer_report_export'),
 
     path('logout/', views.logout_view, name='logout'),
 ]
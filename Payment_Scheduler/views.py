@@ -1,15 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import AuthenticationForm
-from .models import Customer, Payment, BoardingHouseUser, Room, RoomTransferHistory
+from .models import (
+    BillingCycle, BoardingHouseUser, Customer, CustomerTombstone, DataVersion, LedgerAccount, LedgerEntry, Payment,
+    Room, RoomTransferHistory,
+)
 from .forms import CustomerForm, BoardingHouseUserForm, BoardingHouseUserEditForm, RoomForm
-from datetime import date, timedelta
+from .billing import (
+    PAID, STATUS_BY_KEY, STATUS_COLORS, STATUS_KEYS, STATUS_LABELS,
+    ensure_billing_states, refresh_billing_states, status_counts, status_text, with_billing_status,
+)
+from .events import broadcaster
+from .ledger import charge_entry, post_entries, sync_ledgers
+from .occupancy import reconcile_room_statuses, vacancy_index
+from .pagination import InvalidCursor, keyset_page, resolve_path
+from .payments import PaymentError, record_payment, record_payments
+from .revenue import revenue_trend
+from .search import find_customers
+from .transfers import TransferError, transfer_customers
+from .summary import dashboard_summary
+import asyncio
+import csv
+import hashlib
+import json
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal, InvalidOperation
 from django.utils import timezone
-from django.http import JsonResponse
+from django.utils.dateparse import parse_date
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.db.models import Q, Count, F, Sum, Case, When, Value, IntegerField, DecimalField, BooleanField, OuterRef, Subquery
-from django.db.models import Max
+from django.db.models import FilteredRelation, Max
 from django.db.models import Prefetch
 from dateutil.relativedelta import relativedelta
 from django.db.models.functions import Coalesce
@@ -26,6 +54,17 @@ def is_admin(user):
 
 admin_required = user_passes_test(is_admin, login_url='dashboard')
 
+
+def data_version_etag(request, *args, **kwargs):
+    """
+    ETag for the polled JSON endpoints. It changes whenever a Payment,
+    Customer or Room row is written, when the day rolls over (statuses are
+    date dependent) and with the query string, so a 304 never needs the
+    customer queryset.
+    """
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:8]
+    return f"{DataVersion.current()}-{timezone.localdate().isoformat()}-{query}"
+
 def login_view(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
@@ -47,84 +86,67 @@ def logout_view(request):
 
 # --- DASHBOARD & SCHEDULE ---
 
+DASHBOARD_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 500
+# Keyset sort keys for each dashboard column; keyset_page adds the pk as tie-breaker
+DASHBOARD_SORT_KEYS = {
+    'name': ['name'],
+    'room_no': ['room__room_number'],
+    'prev_payment': ['billing_state__last_paid'],
+    'due_date': ['due_date'],
+    'room_rate': ['room__price'],
+    'amount': ['billing_state__last_paid_amount'],
+    'status': ['billing_state__status_priority', 'due_date'],
+    'latest_entry': ['date_entry', 'billing_state__last_paid'],
+    'latest_payment': ['billing_state__last_paid', 'date_entry'],
+}
+REPORT_PAGE_SIZE = 50
+# Keyset sort keys for each report column, as (customer view, date-filtered payment view)
+REPORT_SORT_KEYS = {
+    'default': ([], ['date_paid']),
+    'name': (['name'], ['customer__name']),
+    'contact_number': (['contact_number'], ['customer__contact_number']),
+    'parents_name': (['parents_name'], ['customer__parents_name']),
+    'room_no': (['room__room_number'], ['customer__room__room_number']),
+    'date_entry': (['date_entry'], ['customer__date_entry']),
+    'due_date': (['due_date'], ['due_date']),
+    'paid_amount': (['paid_total'], ['amount_received']),
+    'status': (['billing_status', 'paid_total'], ['date_paid']),
+    'date_paid': (['last_date_paid'], ['date_paid']),
+    'remarks': (['last_remarks'], ['remarks']),
+}
+# Rows fetched per round trip by the streaming CSV exports
+EXPORT_CHUNK_SIZE = 2000
+# Months of revenue trend served by default, and at most (20 years)
+REVENUE_TREND_MONTHS = 36
+MAX_REVENUE_TREND_MONTHS = 240
+# Event streams are recycled periodically; EventSource reconnects on its own
+DASHBOARD_STREAM_SECONDS = 300
+DASHBOARD_HEARTBEAT_SECONDS = 20
+# A delta with more changed or removed rows than this tells the client to reload instead
+MAX_DASHBOARD_CHANGES = 200
+
 @login_required
 def dashboard_view(request):
     today = timezone.localdate()
-    # Calculate stats
-    total_customers = Customer.objects.count()
-    active_customers = Customer.objects.filter(status='Active').count()
-    occupied_rooms = Customer.objects.filter(status='Active').exclude(room=None).count() # Or use Room model logic
-    
-    # Calculate revenue
-    monthly_revenue = Payment.objects.filter(
-        date_paid__year=today.year,
-        date_paid__month=today.month,
-        is_paid=True
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    customers = Customer.objects.all().select_related('room').prefetch_related('payments')
-    
-    # Prepare data for template
-    customer_data = []
-    for customer in customers:
-        last_payment = customer.payments.filter(is_paid=True).order_by('-date_paid').first()
-        is_paid_today = last_payment and last_payment.date_paid == today
+    stats = dashboard_summary(today)
 
-        effective_due = customer.due_date
-        
-        # Calculate if the current cycle is fully paid
-        cycle_paid = 0
-        if effective_due:
-            # We need to manually sum payments for the due date because prefetch isn't used here optimally (or we can use filter)
-            cycle_paid = customer.payments.filter(due_date=effective_due, is_paid=True).aggregate(Sum('amount_received'))['amount_received__sum'] or 0
-            
-        price = customer.room.price if customer.room else 0
-        is_fully_paid = price > 0 and cycle_paid >= price
-
-        if is_paid_today:
-            color = 'green'
-            status_text = "Paid"
-        elif is_fully_paid:
-             # If fully paid but not today, show upcoming status for next month
-             next_due = effective_due + relativedelta(months=1)
-             days_until_due = (next_due - today).days
-             if days_until_due <= 3: 
-                color = 'yellow'
-                status_text = "Due Soon"
-             else:
-                color = 'white'
-                status_text = "Upcoming"
-        elif effective_due:
-            days_until_due = (effective_due - today).days
-            if days_until_due < 0:
-                color = 'black'
-                status_text = "Overdue"
-            elif days_until_due == 0:
-                color = 'red'
-                status_text = "Due Today"
-            elif days_until_due <= 3: 
-                color = 'yellow'
-                status_text = "Due Soon"
-            else:
-                color = 'white'
-                status_text = "Upcoming"
-        else:
-            color = 'white'
-            status_text = "No Schedule"
-
-        customer_data.append({
-            'customer': customer,
-            'color': color,
-            'status_text': status_text,
-            'last_payment_date': last_payment.date_paid if last_payment else None
-        })
+    # First page of the table, built by the same code as dashboard_api
+    initial_page = _dashboard_page('latest_payment', 'desc', None, DASHBOARD_PAGE_SIZE, today)
 
     context = {
-        'total_customers': total_customers,
-        'active_customers': active_customers,
-        'occupied_rooms': occupied_rooms,
-        'monthly_revenue': monthly_revenue,
-        'customers': customer_data,
+        'total_customers': stats['total_customers'],
+        'active_customers': stats['active_customers'],
+        'occupied_rooms': stats['occupied_rooms'],
+        'monthly_revenue': stats['monthly_revenue'],
+        'collection_rate': stats['collection_rate'],
+        'occupancy_rate': stats['occupancy_rate'],
+        'arrears': stats['arrears'],
+        'initial_page': initial_page,
+        'sort_keys': DASHBOARD_SORT_KEYS,
+        'status_filters': [(key, STATUS_LABELS[priority]) for priority, key in STATUS_KEYS.items()],
+        # Version the embedded rows are current as of; live updates resume from it
+        'data_version': initial_page['version'],
         'today': today,
     }
     return render(request, 'Payment_Scheduler/dashboard.html', context)
@@ -135,36 +157,14 @@ def dashboard_view(request):
 @login_required
 @admin_required
 def room_view(request):
-    rooms = (
-        Room.objects.annotate(
-            active_customers_count=Count(
-                'customers',
-                filter=Q(customers__status='Active')
-            )
-        )
-        .order_by('room_number')
-    )
-    
-    # Auto-sync room.status based on occupancy (excluding 'Under Maintenance')
-    for r in rooms:
-        if r.status != 'Under Maintenance':
-            new_status = 'Available' if r.active_customers_count == 0 else 'Occupied'
-            if r.status != new_status:
-                r.status = new_status
-                r.save(update_fields=['status'])
-    
+    # Read-only: statuses are reconciled by the writes that change occupancy
+    rooms = Room.objects.order_by('room_number')
     return render(request, 'Payment_Scheduler/room.html', {'rooms': rooms})
 
 @login_required
 @admin_required
 def room_list(request):
-    # This specifically counts customers per room whose status is 'Active'
-    rooms = Room.objects.annotate(
-        active_customers_count=Count(
-            'customers', 
-            filter=Q(customers__status='Active')
-        )
-    ).order_by('room_number')
+    rooms = Room.objects.order_by('room_number')
     
     return render(request, 'Payment_Scheduler/room.html', {'rooms': rooms})
 
@@ -185,9 +185,21 @@ def room_create(request):
 def room_edit(request, pk):
     room = get_object_or_404(Room, pk=pk)
     if request.method == 'POST':
+        # Validation writes the posted price onto `room`, so note the old one first
+        old_price = room.price
         form = RoomForm(request.POST, instance=room)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                # Leaving maintenance puts the room back on its occupancy status
+                reconcile_room_statuses([room.pk])
+                # A price change moves every occupant's balance
+                if room.price != old_price:
+                    post_entries([
+                        charge_entry(customer_id, due_date, room.price, f"Room {room.room_number} rate changed")
+                        for customer_id, due_date in room.customers.filter(due_date__isnull=False).values_list('pk', 'due_date')
+                    ])
+                refresh_billing_states(room.customers.values_list('pk', flat=True))
             return redirect('rooms')
     else:
         form = RoomForm(instance=room)
@@ -201,12 +213,17 @@ def room_delete(request, pk):
     room = get_object_or_404(Room, pk=pk)
     # Filter only Active customers
     occupants = room.customers.filter(status='Active')
-    occupant_count = occupants.count()
+    occupant_count = room.active_count
+    transfer_error = None
 
     if request.method == 'POST':
         if 'confirm_delete' in request.POST:
             if occupant_count == 0:
-                room.delete()
+                with transaction.atomic():
+                    affected_ids = list(room.customers.values_list('pk', flat=True))
+                    room.delete()
+                    sync_ledgers(affected_ids, f"Room {room.room_number} deleted")
+                    refresh_billing_states(affected_ids)
                 return redirect('rooms')
         
         elif 'transfer_delete' in request.POST:
@@ -214,35 +231,30 @@ def room_delete(request, pk):
             if new_room_id:
                 new_room = get_object_or_404(Room, pk=new_room_id)
                 
-                # Bulk update room for all occupants
-                occupants.update(room=new_room)
-                
-                # Update new room status
-                # Check if new room is now full or just occupied
-                new_room_occupants = Customer.objects.filter(room=new_room, status='Active').count()
-                if new_room_occupants >= new_room.capacity:
-                    new_room.status = 'Full'
-                else:
-                    new_room.status = 'Occupied'
-                new_room.save(update_fields=['status'])
-                
-                room.delete()
-                return redirect('rooms')
+                try:
+                    with transaction.atomic():
+                        # Occupants move with the same payment adjustments and
+                        # history as any other transfer
+                        transfer_customers([(pk, new_room.pk) for pk in occupants.values_list('pk', flat=True)])
+
+                        affected_ids = list(room.customers.values_list('pk', flat=True))
+                        room.delete()
+                        sync_ledgers(affected_ids, f"Room {room.room_number} deleted")
+                        refresh_billing_states(affected_ids)
+                    return redirect('rooms')
+                except TransferError as e:
+                    transfer_error = str(e)
 
     # GET request: Prepare context for confirmation page
     # Find available rooms with capacity > current_occupants
-    # We use Python filtering to avoid MySQL HAVING clause issues with F() expressions
-    all_rooms = Room.objects.exclude(pk=room.pk).exclude(status='Under Maintenance').annotate(
-        active_count=Count('customers', filter=Q(customers__status='Active'))
-    )
-    
-    available_rooms = [r for r in all_rooms if r.active_count < r.capacity]
+    available_rooms = vacancy_index.rooms(exclude=room.pk)
     
     context = {
         'room': room,
         'occupant_count': occupant_count,
         'available_rooms': available_rooms,
-        'has_vacant_rooms': len(available_rooms) > 0
+        'has_vacant_rooms': len(available_rooms) > 0,
+        'transfer_error': transfer_error,
     }
     return render(request, 'Payment_Scheduler/room_delete.html', context)
 
@@ -253,12 +265,7 @@ def room_occupants(request, pk):
     occupants = room.customers.filter(status='Active')
     
     # Get available rooms for transfer (excluding current one)
-    # Python filtering to avoid MySQL errors
-    all_rooms = Room.objects.exclude(pk=room.pk).exclude(status='Under Maintenance').annotate(
-        active_count=Count('customers', filter=Q(customers__status='Active'))
-    )
-    
-    available_rooms = [r for r in all_rooms if r.active_count < r.capacity]
+    available_rooms = vacancy_index.rooms(exclude=room.pk)
     
     return render(request, 'Payment_Scheduler/room_occupants.html', {
         'room': room,
@@ -271,134 +278,53 @@ def room_occupants(request, pk):
 def transfer_customer(request, customer_id):
     if request.method == 'POST':
         customer = get_object_or_404(Customer, pk=customer_id)
-        old_room = customer.room
         new_room_id = request.POST.get('new_room')
         
         if new_room_id:
             new_room = get_object_or_404(Room, pk=new_room_id)
             
-            # --- Payment Adjustment Logic ---
-            if old_room and customer.due_date:
-                # Calculate total paid for current cycle
-                current_payments = Payment.objects.filter(
-                    customer=customer, 
-                    due_date=customer.due_date,
-                    is_paid=True
-                )
-                amount_paid = current_payments.aggregate(Sum('amount_received'))['amount_received__sum'] or 0
-                
-                old_price = old_room.price
-                new_price = new_room.price
-                
-                # Only adjust if fully paid for the old room (or paid at least the old price)
-                if amount_paid >= old_price:
-                    diff = new_price - amount_paid
-                    
-                    if diff > 0:
-                        # Upgrade: New room is more expensive.
-                        # Waive the difference for the current cycle so they remain "Paid".
-                        Payment.objects.create(
-                            customer=customer,
-                            due_date=customer.due_date,
-                            amount=diff,
-                            amount_received=diff,
-                            is_paid=True,
-                            remarks=f"Transfer Adjustment: Moved to {new_room.room_number}",
-                            date_paid=timezone.localdate()
-                        )
-                    elif diff < 0:
-                        # Downgrade: New room is cheaper.
-                        # Credit the surplus to the next cycle.
-                        surplus = abs(diff)
-                        next_due = customer.due_date + relativedelta(months=1)
-                        
-                        # Check if a payment record already exists for next month (unlikely but possible)
-                        next_payment = Payment.objects.filter(customer=customer, due_date=next_due).first()
-                        
-                        if next_payment:
-                            next_payment.amount_received = (next_payment.amount_received or 0) + surplus
-                            # Check if this surplus makes it fully paid
-                            if next_payment.amount_received >= new_price:
-                                next_payment.is_paid = True
-                            next_payment.remarks = (next_payment.remarks or "") + f" | Transfer Credit from {old_room.room_number}"
-                            next_payment.save()
-                        else:
-                            Payment.objects.create(
-                                customer=customer,
-                                due_date=next_due,
-                                amount=new_price, # Set expected amount to new room price
-                                amount_received=surplus,
-                                is_paid=surplus >= new_price,
-                                remarks=f"Transfer Credit: Moved from {old_room.room_number}",
-                                date_paid=timezone.localdate() 
-                            )
-            
-            # --- Create History Record ---
-            RoomTransferHistory.objects.create(
-                customer=customer,
-                room_from=old_room,
-                room_to=new_room,
-                room_from_price=old_room.price if old_room else 0,
-                room_to_price=new_room.price
-            )
-
-            # Update customer room
-            customer.room = new_room
-            customer.save()
-            
-            # Update old room status
-            if old_room:
-                old_room_active = Customer.objects.filter(room=old_room, status='Active').count()
-                if old_room_active == 0:
-                    old_room.status = 'Available'
-                else:
-                    # Check if it was full and now is just occupied
-                    if old_room.status == 'Full':
-                        old_room.status = 'Occupied'
-                old_room.save(update_fields=['status'])
-                
-            # Update new room status
-            new_room_active = Customer.objects.filter(room=new_room, status='Active').count()
-            if new_room_active >= new_room.capacity:
-                new_room.status = 'Full'
-            else:
-                new_room.status = 'Occupied'
-            new_room.save(update_fields=['status'])
+            try:
+                with transaction.atomic():
+                    # Payment adjustments, history and room statuses as for a batch of one
+                    transfer_customers([(customer.pk, new_room.pk)])
+            except TransferError as e:
+                # Shown above the customer list, e.g. a full room or one under maintenance
+                messages.error(request, str(e))
             
             return redirect('customers') # Redirect to customer list as that's where the modal is
             
     return redirect('customers')
 
+@login_required
+@admin_required
+def transfer_customers_api(request):
+    """
+    Moves several customers in one transaction. Expects a JSON body like
+    {"moves": [{"customer_id": 1, "room_id": 2}, ...]}.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'}, status=405)
+    try:
+        moves = [(move['customer_id'], move['room_id']) for move in json.loads(request.body)['moves']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid request body'}, status=400)
+    try:
+        with transaction.atomic():
+            transferred = transfer_customers(moves)
+    except TransferError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid customer or room id'}, status=400)
+    return JsonResponse({'success': True, 'transferred': transferred})
+
 @login_required
 @admin_required
 def search_rooms(request):
     query = request.GET.get('q', '')
-    
-    # Filter for rooms that are NOT Under Maintenance
-    rooms_qs = Room.objects.exclude(status='Under Maintenance').annotate(
-        current_occupants=Count('customers', filter=Q(customers__status='Active'))
-    )
 
-    if query:
-        rooms_qs = rooms_qs.filter(room_number__icontains=query)
-        
-    # Python filtering to avoid MySQL errors
-    rooms = [r for r in rooms_qs if r.current_occupants < r.capacity]
-
-    results = []
-    for r in rooms:
-        # We also want to make sure the room status is 'Available' 
-        # if it was previously 'Occupied' but now has 0 people.
-        results.append({
-            'id': r.id, 
-            'room_number': r.room_number, 
-            'room_type': r.room_type, 
-            'price': str(r.price),
-            'status': r.status,
-            'current_occupants': r.current_occupants,
-            'capacity': r.capacity,
-            'available_slots': r.capacity - r.current_occupants
-        })
+    # Rooms with a free slot whose number starts with the query, answered from
+    # the in-memory vacancy index (Under Maintenance rooms are never listed)
+    results = [vacancy.as_dict() for vacancy in vacancy_index.rooms(query)]
     
     return JsonResponse(results, safe=False)
 
@@ -442,8 +368,19 @@ def user_edit(request, pk):
 @login_required
 @admin_required
 def customer_view(request):
-    customers = Customer.objects.filter(customer_id__isnull=False).annotate(last_paid=Max('payments__date_paid')).order_by('-date_entry', '-last_paid')[:12]
-    return render(request, 'Payment_Scheduler/customer.html', {'customers': customers})
+    customers, next_cursor = _customers_page('latest_entry', None, 12)
+    return render(request, 'Payment_Scheduler/customer.html', {'customers': customers, 'next_cursor': next_cursor})
+
+@login_required
+@admin_required
+def customer_export(request):
+    customers = Customer.objects.order_by(F('date_entry').desc(nulls_last=True), '-pk').values_list(
+        'customer_id', 'name', 'address', 'contact_number', 'parents_name', 'parents_contact_number',
+        'status', 'room__room_number', 'date_entry', 'due_date',
+    )
+    header = ['Customer ID', 'Name', 'Address', 'Contact Number', "Parent's Name", "Parent's Contact Number",
+              'Status', 'Room', 'Date Entry', 'Due Date']
+    return _csv_response('customers.csv', header, customers.iterator(chunk_size=EXPORT_CHUNK_SIZE))
 
 @login_required
 @admin_required
@@ -451,15 +388,16 @@ def customer_create(request):
     if request.method == 'POST':
         form = CustomerForm(request.POST)
         if form.is_valid():
-            instance = form.save()
-            
-            # Update room status after assignment
-            if instance.room:
-                occupants = Customer.objects.filter(room=instance.room, status='Active').count()
-                new_status = 'Available' if occupants == 0 else 'Occupied'
-                if instance.room.status != 'Under Maintenance' and instance.room.status != new_status:
-                    instance.room.status = new_status
-                    instance.room.save(update_fields=['status'])
+            with transaction.atomic():
+                instance = form.save()
+                
+                # Update room status after assignment
+                reconcile_room_statuses([instance.room_id])
+
+                # The first cycle is owed from the start
+                if instance.due_date and instance.room:
+                    post_entries([charge_entry(instance.pk, instance.due_date, instance.room.price)])
+                refresh_billing_states([instance.pk])
             return redirect('customers')
     else:
         form = CustomerForm()
@@ -470,49 +408,32 @@ def customer_create(request):
 def customer_edit(request, pk):
     customer = get_object_or_404(Customer, pk=pk)
     if request.method == 'POST':
+        # Validation writes the posted room onto `customer`, so note the old one first
+        old_room_id = customer.room_id
         form = CustomerForm(request.POST, instance=customer)
         if form.is_valid():
-            instance = form.save(commit=False)
-            old_room = customer.room
+            with transaction.atomic():
+                instance = form.save(commit=False)
+                vacated_room_id = None
             
-            if instance.status == 'Inactive':
-                # Store the room reference before we clear it
-                vacated_room = instance.room
-                
-                if not instance.date_left:
-                    instance.date_left = timezone.localdate()
+                if instance.status == 'Inactive':
+                    # Store the room reference before we clear it
+                    vacated_room_id = instance.room_id
                 
-                # 1. Remove the customer from the room
-                instance.room = None 
+                    if not instance.date_left:
+                        instance.date_left = timezone.localdate()
                 
-                # 2. Check if the room is now empty and update its status
-                if vacated_room:
-                    # Count remaining active customers in that specific room
-                    remaining_occupants = Customer.objects.filter(room=vacated_room, status='Active').exclude(pk=instance.pk).count()
-                    
-                    if remaining_occupants == 0:
-                        vacated_room.status = 'Available'
-                        vacated_room.save()
+                    # 1. Remove the customer from the room
+                    instance.room = None 
             
-            instance.save()
-            
-            # If still active, sync statuses for new and old rooms
-            if instance.status == 'Active':
-                # Update newly assigned room status
-                if instance.room:
-                    occupants = Customer.objects.filter(room=instance.room, status='Active').count()
-                    new_status = 'Available' if occupants == 0 else 'Occupied'
-                    if instance.room.status != 'Under Maintenance' and instance.room.status != new_status:
-                        instance.room.status = new_status
-                        instance.room.save(update_fields=['status'])
-                
-                # If room changed, update old room status as well
-                if old_room and old_room != instance.room:
-                    old_occupants = Customer.objects.filter(room=old_room, status='Active').count()
-                    old_status = 'Available' if old_occupants == 0 else 'Occupied'
-                    if old_room.status != 'Under Maintenance' and old_room.status != old_status:
-                        old_room.status = old_status
-                        old_room.save(update_fields=['status'])
+                instance.save()
+
+                # 2. Sync statuses for the vacated, old and newly assigned rooms
+                reconcile_room_statuses([vacated_room_id, old_room_id, instance.room_id])
+
+                # A new room, due date or leaving changes what is owed
+                sync_ledgers([instance.pk], "Adjusted after editing the customer")
+                refresh_billing_states([instance.pk])
             return redirect('customers')
     else:
         form = CustomerForm(instance=customer)
@@ -529,16 +450,13 @@ def customer_detail(request, pk):
 def customer_delete(request, pk):
     customer = get_object_or_404(Customer, pk=pk)
     if request.method == 'POST':
-        room = customer.room
-        customer.delete()
-        
-        # Update room status if it becomes empty
-        if room:
-            # Check remaining active customers
-            active_occupants = Customer.objects.filter(room=room, status='Active').count()
-            if active_occupants == 0:
-                room.status = 'Available'
-                room.save(update_fields=['status'])
+        room_id = customer.room_id
+        with transaction.atomic():
+            # The billing state row goes with the customer (on_delete=CASCADE)
+            customer.delete()
+            
+            # Update room status if it becomes empty
+            reconcile_room_statuses([room_id])
                 
         return redirect('customers')
     return redirect('customers')
@@ -557,10 +475,7 @@ def payment_view(request):
 def search_customers(request):
     query = request.GET.get('q', '')
     if query:
-        customers = Customer.objects.filter(
-            Q(name__icontains=query) | 
-            Q(room__room_number__icontains=query)
-        )[:10]
+        customers = find_customers(query, limit=10)
         results = []
         for c in customers:
             results.append({
@@ -575,183 +490,259 @@ def search_customers(request):
 @login_required
 @admin_required
 def get_customer_balance(request, customer_id):
-    customer = get_object_or_404(Customer, pk=customer_id)
-    payment = Payment.objects.filter(customer=customer, due_date=customer.due_date, is_paid=False).first()
+    customer = get_object_or_404(_balance_customers(), pk=customer_id)
     
     if customer.due_date:
         due_date_str = customer.due_date.strftime('%Y-%m-%d')
     else:
         due_date_str = timezone.localdate().strftime('%Y-%m-%d')
 
-    cycle_paid = Payment.objects.filter(
-        customer=customer,
-        due_date=customer.due_date,
-        is_paid=True
-    ).aggregate(Sum('amount_received'))['amount_received__sum'] or 0
-    total_due = customer.room.price if customer.room else 0
-    remaining_balance = max(total_due - cycle_paid, 0)
+    room = customer.room
+    # Read from the ledger; a negative balance is credit, so nothing is due
+    remaining_balance = max(customer.ledger_balance or 0, 0)
 
     return JsonResponse({
         'customer_id': customer.customer_id,
         'customer_db_id': customer.pk,
         'name': customer.name,
-        'room_no': customer.room.room_number if customer.room else (customer.room_number if customer.room_number else "N/A"),
-        'payment_id': payment.id if payment else "", 
+        'room_no': room.room_number if room else "N/A",
+        'payment_id': customer.open_payment_id or "",
         'due_date': due_date_str,
         'balance': remaining_balance,
     })
 
+def _balance_customers():
+    """
+    Customers with their room, the open (unpaid) payment of their current
+    cycle and their ledger balance, in one query.
+    """
+    open_payment = Payment.objects.filter(
+        customer=OuterRef('pk'), due_date=OuterRef('due_date'), is_paid=False
+    ).order_by('pk').values('pk')[:1]
+    return Customer.objects.select_related('room').annotate(
+        open_payment_id=Subquery(open_payment),
+        ledger_balance=F('ledger_account__balance'),
+    )
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag)
 def dashboard_api(request):
-    limit = int(request.GET.get('limit', 12))
-    offset = int(request.GET.get('offset', 0))
+    limit = min(int(request.GET.get('limit', DASHBOARD_PAGE_SIZE)), MAX_PAGE_SIZE)
+    cursor = request.GET.get('cursor')
     sort = request.GET.get('sort', 'latest_payment')
     direction = request.GET.get('direction', 'desc')
+    status = request.GET.get('status') or None
+    if status and status not in STATUS_BY_KEY:
+        return JsonResponse({'error': 'Invalid status filter'}, status=400)
     
     today = timezone.localdate()
 
-    # Subquery for cycle payments (Sum of payments for the current due date)
-    payments_sub = Payment.objects.filter(
-        customer=OuterRef('pk'),
-        due_date=OuterRef('due_date'),
-        is_paid=True
-    ).values('customer').annotate(total=Sum('amount_received')).values('total')
-
-    base_qs = Customer.objects.all().annotate(
-        last_paid=Max('payments__date_paid'),
-        cycle_paid_amount=Coalesce(Subquery(payments_sub), Value(0, output_field=DecimalField())),
-        room_price_val=Coalesce(F('room__price'), Value(0, output_field=DecimalField()))
-    ).annotate(
-        is_fully_paid=Case(
-            When(cycle_paid_amount__gte=F('room_price_val'), then=Value(True)),
-            default=Value(False),
-            output_field=BooleanField()
-        )
-    ).annotate(
-        status_priority=Case(
-            When(last_paid=today, then=Value(5)), # Paid Today
-            When(due_date__isnull=True, then=Value(6)), # No Schedule
-            When(Q(is_fully_paid=False) & Q(due_date__lt=today), then=Value(1)), # Overdue
-            When(Q(is_fully_paid=False) & Q(due_date=today), then=Value(2)), # Due Today
-            When(Q(is_fully_paid=False) & Q(due_date__lte=today + timedelta(days=3)), then=Value(3)), # Due Soon
-            default=Value(4), # Upcoming
-            output_field=IntegerField()
-        )
-    ).select_related('room').prefetch_related(
-        Prefetch('payments', queryset=Payment.objects.filter(is_paid=True).only('amount_received', 'due_date', 'date_paid', 'remarks'))
+    # Delta mode: only what changed since the version the client already has
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid since version'}, status=400)
+        return JsonResponse(_dashboard_changes(since, today))
+
+    try:
+        return JsonResponse(_dashboard_page(sort, direction, cursor, limit, today, status))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+
+def _dashboard_page(sort, direction, cursor, limit, today, status=None):
+    """
+    One page of dashboard rows, shared by dashboard_api and the rows
+    embedded in the dashboard page itself. Pages are keyset-paginated, and
+    the total and status facet counts are only computed for the first page.
+    """
+    # Status, balance and last payment come precomputed from CustomerBillingState
+    ensure_billing_states(today)
+    version = DataVersion.current()
+    base_qs = _dashboard_queryset(today)
+    facets = None if cursor else status_counts(base_qs)
+    if status:
+        base_qs = base_qs.filter(billing_status=STATUS_BY_KEY[status])
+
+    descending = direction != 'asc'
+    paths = DASHBOARD_SORT_KEYS.get(sort, DASHBOARD_SORT_KEYS['latest_payment'])
+    customers, next_cursor = keyset_page(base_qs, [(path, descending) for path in paths], cursor, limit)
+
+    data = [_dashboard_row(customer) for customer in customers]
+    return {
+        'payment_data': data,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'total': None if cursor else base_qs.count(),
+        'facets': facets,
+        'version': version,
+    }
+
+
+def _dashboard_queryset(today):
+    return with_billing_status(
+        Customer.objects.filter(billing_state__isnull=False).select_related('room', 'billing_state'),
+        today,
     )
-    
-    # Determine sort order prefix
-    order_prefix = '' if direction == 'asc' else '-'
-    
-    # Handle different sorting fields
-    if sort == 'name':
-        base_qs = base_qs.order_by(f'{order_prefix}name')
-    elif sort == 'room_no':
-        base_qs = base_qs.order_by(f'{order_prefix}room__room_number')
-    elif sort == 'prev_payment':
-        base_qs = base_qs.order_by(f'{order_prefix}last_paid')
-    elif sort == 'due_date':
-        base_qs = base_qs.order_by(f'{order_prefix}due_date')
-    elif sort == 'room_rate':
-        base_qs = base_qs.order_by(f'{order_prefix}room__price')
-    elif sort == 'amount':
-        # This requires more complex handling since it's based on payment amounts
-        base_qs = base_qs.order_by(f'{order_prefix}last_paid')
-    elif sort == 'status':
-        # Sort by priority first, then due date
-        base_qs = base_qs.order_by(f'{order_prefix}status_priority', f'{order_prefix}due_date')
-    elif sort == 'latest_entry':
-        base_qs = base_qs.order_by(f'{order_prefix}date_entry', f'{order_prefix}last_paid')
-    else:
-        # Default sorting by latest payment
-        base_qs = base_qs.order_by(f'{order_prefix}last_paid', f'{order_prefix}date_entry')
-    total = base_qs.count()
-    customers = base_qs[offset:offset + limit]
-    today = timezone.localdate()
-    data = []
-    
-    for customer in customers:
-        effective_due = customer.due_date
-
-        paid_payments = list(customer.payments.all())
-        last_payment_date = None
-        last_payment_amount = 0
-        if paid_payments:
-            paid_with_date = [p for p in paid_payments if p.date_paid]
-            if paid_with_date:
-                paid_with_date.sort(key=lambda p: p.date_paid)
-                last_payment = paid_with_date[-1]
-            else:
-                last_payment = paid_payments[-1]
-            last_payment_date = last_payment.date_paid
-            last_payment_amount = last_payment.amount_received or 0
-
-        is_paid_today = last_payment_date == today
-
-        cycle_paid = 0
-        if effective_due:
-            cycle_paid = sum((p.amount_received or 0) for p in paid_payments if p.due_date == effective_due)
-        price = customer.room.price if customer.room else 0
-        balance_amount = max(price - cycle_paid, 0)
-
-        if is_paid_today:
-            color, status = 'green', "Paid"
-        elif price > 0 and cycle_paid >= price:
-             # Fully paid but not today -> Show upcoming for next month
-             next_due = effective_due + relativedelta(months=1)
-             days = (next_due - today).days
-             if days <= 3: color, status = 'yellow', "Due Soon"
-             else: color, status = 'white', "Upcoming"
-        elif effective_due:
-            days = (effective_due - today).days
-            if days < 0: color, status = 'black', "Overdue"
-            elif days == 0: color, status = 'red', "Due Today"
-            elif days <= 3: color, status = 'yellow', "Due Soon"
-            else: color, status = 'white', "Upcoming"
-        else:
-            color, status = 'white', "No Schedule"
-
-        if price > 0 and cycle_paid > 0 and cycle_paid < price:
-            status = f"Partially Paid • Balance: ₱{balance_amount}"
-        elif is_paid_today:
-             # Override status text to "Paid" if paid today, regardless of partial logic (though partial logic usually implies not fully paid)
-             # But if it is fully paid today, status is "Paid".
-             # If partially paid today, status is "Partially Paid".
-             if cycle_paid >= price:
-                status = "Paid"
-        elif price > 0 and cycle_paid >= price:
-             # If fully paid (not today), keep the upcoming status set above
-             pass
-
-        data.append({
-            'name': customer.name,
-            'room_no': customer.room.room_number if customer.room else "-",
-            'prev_payment': last_payment_date.strftime('%b %d, %Y') if last_payment_date else "-",
-            'due_date': effective_due.strftime('%b %d, %Y') if effective_due else "N/A",
-            'room_rate': f"₱{price}" if customer.room else "-",
-            'amount': f"₱{last_payment_amount}" if last_payment_amount else "-",
-            'status': status,
-            'color': color
-        })
-    has_more = (offset + limit) < total
-    next_offset = offset + limit if has_more else None
-    return JsonResponse({'payment_data': data, 'has_more': has_more, 'next_offset': next_offset, 'total': total})
+
+
+def _dashboard_row(customer):
+    """
+    Serializes a customer loaded with select_related('room', 'billing_state').
+    """
+    state = customer.billing_state
+    effective_due = customer.due_date
+    price = customer.room.price if customer.room else 0
+
+    return {
+        'id': customer.pk,
+        'name': customer.name,
+        'room_no': customer.room.room_number if customer.room else "-",
+        'prev_payment': state.last_paid.strftime('%b %d, %Y') if state.last_paid else "-",
+        'due_date': effective_due.strftime('%b %d, %Y') if effective_due else "N/A",
+        'room_rate': f"₱{price}" if customer.room else "-",
+        'amount': f"₱{state.last_paid_amount}" if state.last_paid_amount else "-",
+        'status': state.status,
+        'status_key': STATUS_KEYS[state.status_priority],
+        'color': STATUS_COLORS[state.status_priority],
+        'sort_values': _dashboard_sort_values(customer),
+    }
+
+
+def _dashboard_sort_values(customer):
+    """
+    The row's value on every DASHBOARD_SORT_KEYS path, so the page can place
+    a pushed row in whatever order it is showing. Decimals become numbers so
+    they compare as numbers there.
+    """
+    values = {}
+    for paths in DASHBOARD_SORT_KEYS.values():
+        for path in paths:
+            value = resolve_path(customer, path)
+            values[path] = float(value) if isinstance(value, Decimal) else value
+    return values
+
+
+def _dashboard_changes(since, today):
+    """
+    Dashboard rows whose billing state changed after version `since`, ids of
+    customers deleted since then, and fresh summary counters. When `since`
+    is older than the retained tombstones, or more than
+    MAX_DASHBOARD_CHANGES rows changed, the rows are left out and `reload`
+    is set: the client re-fetches its loaded window instead.
+    """
+    ensure_billing_states(today)
+    # Read the version first: a write landing after this is re-sent next time rather than lost
+    version = DataVersion.current()
+    changes = {
+        'version': version,
+        'reload': True,
+        'rows': [],
+        'removed': [],
+        'summary': dashboard_summary(today),
+        'facets': status_counts(with_billing_status(Customer.objects.filter(billing_state__isnull=False), today)),
+    }
+    if since <= 0 or version - since >= CustomerTombstone.RETAINED_VERSIONS:
+        return changes
+    customers = list(_changed_customers(since)[:MAX_DASHBOARD_CHANGES + 1])
+    removed = list(
+        CustomerTombstone.objects.filter(version__gt=since).values_list('customer_id', flat=True)[:MAX_DASHBOARD_CHANGES + 1]
+    )
+    if len(customers) + len(removed) > MAX_DASHBOARD_CHANGES:
+        return changes
+    changes.update(
+        reload=False, rows=[_dashboard_row(customer) for customer in customers], removed=removed,
+    )
+    return changes
+
+
+def _changed_customers(since):
+    return Customer.objects.filter(billing_state__version__gt=since).select_related('room', 'billing_state')
+
+
+def _dashboard_changes_since(since):
+    return _dashboard_changes(since, timezone.localdate())
+
+
+async def _dashboard_event_stream(version):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DASHBOARD_STREAM_SECONDS
+    # Clients reconnect after the stream ends, resuming from the last id
+    yield f"retry: 3000\nid: {version}\n\n"
+    while loop.time() < deadline:
+        new_version = await broadcaster.wait_for_change(version, DASHBOARD_HEARTBEAT_SECONDS)
+        if new_version is None:
+            yield ": keep-alive\n\n"
+            continue
+        changes = await broadcaster.changes_since(version, _dashboard_changes_since)
+        version = changes['version']
+        yield f"id: {version}\ndata: {json.dumps(changes, cls=DjangoJSONEncoder)}\n\n"
+
+
+@login_required
+async def dashboard_events(request):
+    """
+    Server-Sent Events stream of dashboard changes, pushed after each write.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI a held-open stream would pin a worker thread. 204 tells
+        # EventSource not to reconnect, and the page falls back to polling.
+        return HttpResponse(status=204)
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        version = int(since)
+    except (TypeError, ValueError):
+        version = await sync_to_async(DataVersion.current)()
+
+    response = StreamingHttpResponse(_dashboard_event_stream(version), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag)
+def revenue_trend_api(request):
+    """Monthly revenue for trend charts, read from the revenue rollup; `months` (default 36) and optional `room`."""
+    try:
+        months = int(request.GET.get('months', REVENUE_TREND_MONTHS))
+        room_id = int(request.GET['room']) if request.GET.get('room') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid months or room'}, status=400)
+    if not 1 <= months <= MAX_REVENUE_TREND_MONTHS:
+        return JsonResponse({'error': 'Invalid months or room'}, status=400)
+    trend = revenue_trend(months, room_id, timezone.localdate())
+    return JsonResponse({
+        'months': [
+            {
+                'month': row['month'].strftime('%Y-%m'),
+                'label': row['month'].strftime('%b %Y'),
+                'total_received': f"{row['total_received']:.2f}",
+                'payment_count': row['payment_count'],
+                'payer_count': row['payer_count'],
+            }
+            for row in trend
+        ],
+    })
 
 @login_required
 @admin_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag)
 def customers_api(request):
-    limit = int(request.GET.get('limit', 12))
-    offset = int(request.GET.get('offset', 0))
+    limit = min(int(request.GET.get('limit', 12)), MAX_PAGE_SIZE)
+    cursor = request.GET.get('cursor')
     sort = request.GET.get('sort', 'latest_entry')
-    qs = Customer.objects.all().annotate(last_paid=Max('payments__date_paid')).select_related('room')
-    if sort == 'latest_payment':
-        qs = qs.order_by('-last_paid', '-date_entry')
-    else:
-        qs = qs.order_by('-date_entry', '-last_paid')
-    total = qs.count()
+    try:
+        customers, next_cursor = _customers_page(sort, cursor, limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
     items = []
-    for c in qs[offset:offset + limit]:
+    for c in customers:
         items.append({
             'id': c.pk,
             'customer_id': c.customer_id,
@@ -761,96 +752,66 @@ def customers_api(request):
             'parents_name': c.parents_name or "",
             'parents_contact_number': c.parents_contact_number or "",
             'status': c.status or "",
-            'room': c.room.room_number if c.room else (c.room_no or "-"),
+            'room': c.room.room_number if c.room else "-",
             'date_entry': c.date_entry.strftime('%b %d, %Y') if c.date_entry else "-",
             'due_date': c.due_date.strftime('%b %d, %Y') if c.due_date else "-",
         })
-    has_more = (offset + limit) < total
-    next_offset = offset + limit if has_more else None
-    return JsonResponse({'customers': items, 'has_more': has_more, 'next_offset': next_offset, 'total': total})
+    return JsonResponse({
+        'customers': items,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'total': None if cursor else Customer.objects.count(),
+    })
+
+
+def _customers_page(sort, cursor, limit):
+    """
+    One keyset page of the customer list, shared by customer_view and customers_api.
+    """
+    ensure_billing_states()
+    qs = Customer.objects.select_related('room', 'billing_state')
+    if sort == 'latest_payment':
+        keys = [('billing_state__last_paid', True), ('date_entry', True)]
+    else:
+        keys = [('date_entry', True), ('billing_state__last_paid', True)]
+    return keyset_page(qs, keys, cursor, limit)
 
 @login_required
 @admin_required
 def process_payment(request):
+    """
+    Records a cashier payment and returns the balance now owed, so the
+    terminal needs no follow-up get_balance call. Terminals send an
+    idempotency_key per payment attempt (or an Idempotency-Key header);
+    retrying with the same key returns the first result instead of paying twice.
+    """
     if request.method == 'POST':
-        payment_id = request.POST.get('payment_id')
-        customer_id = request.POST.get('customer_id') 
+        payment_id = (request.POST.get('payment_id') or '').strip() or None
+        customer_id = request.POST.get('customer_id')
         amount_received_raw = request.POST.get('amount_received') or '0'
-        change_amount_raw = request.POST.get('change_amount') or '0'
         remarks = request.POST.get('remarks')
-        
+        idempotency_key = (request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key') or '').strip() or None
+
         try:
             try:
                 amount_received = Decimal(amount_received_raw)
-                change_amount = Decimal(change_amount_raw)
             except InvalidOperation:
                 return JsonResponse({'success': False, 'error': 'Invalid amount values'})
 
-            customer = Customer.objects.get(pk=customer_id)
-
-            # Ensure the customer has an active billing cycle
-            if not customer.due_date:
-                customer.due_date = timezone.localdate()
-                customer.save(update_fields=['due_date'])
-            current_due = customer.due_date
-            room_price = customer.room.price if customer.room else Decimal('0')
-            
-            if payment_id and payment_id.strip() != "":
-                payment = Payment.objects.get(pk=payment_id)
-            else:
-                payment = Payment(
-                    customer=customer,
-                    amount=room_price,
-                    due_date=current_due
-                )
-
-            # Calculate how much has already been applied to this billing cycle
-            existing_qs = Payment.objects.filter(
-                customer=customer,
-                due_date=current_due,
-                is_paid=True
-            )
-            if payment.pk:
-                existing_qs = existing_qs.exclude(pk=payment.pk)
-            already_paid = existing_qs.aggregate(Sum('amount_received'))['amount_received__sum'] or Decimal('0')
-
-            # Remaining balance for the current cycle (cannot go below zero)
-            remaining_balance = max(room_price - already_paid, Decimal('0'))
-
-            # If the cycle is already fully paid, do not allow additional payments to advance future cycles
-            if room_price > 0 and remaining_balance <= 0:
-                return JsonResponse({'success': False, 'error': 'Current billing cycle is already fully paid. Prepayments are not allowed.'})
-
-            # Amount to apply to this cycle (cannot exceed remaining balance)
-            if room_price > 0:
-                applied_amount = min(amount_received, remaining_balance)
-            else:
-                applied_amount = amount_received
-
-            # Compute change based on how much was actually applied
-            computed_change = max(amount_received - applied_amount, Decimal('0'))
-
-            # Record the previous payment date (what was seen on dashboard)
-            # Only if we are marking it paid now (it was not paid before)
-            # Update: User requested to save the current date_paid into previous_date as well
-            payment.date_paid = timezone.localdate()
-            payment.previous_date = payment.date_paid
-            
-            payment.amount = room_price
-            payment.amount_received = applied_amount
-            payment.change_amount = computed_change
-            payment.remarks = remarks
-            payment.is_paid = True
-            payment.save()
-            
-            # Advance due date when the current cycle is fully paid (early, on time, or late)
-            total_for_cycle = already_paid + applied_amount
-            if customer.due_date and room_price > 0 and total_for_cycle >= room_price:
-                customer.due_date = customer.due_date + relativedelta(months=1)
-                customer.save(update_fields=['due_date'])
-            
-            return JsonResponse({'success': True})
-            
+            try:
+                with transaction.atomic():
+                    result = record_payment(customer_id, amount_received, remarks, payment_id, idempotency_key)
+            except IntegrityError:
+                if not idempotency_key:
+                    raise
+                # A concurrent request with the same key committed first; replay it
+                with transaction.atomic():
+                    result = record_payment(customer_id, amount_received, remarks, payment_id, idempotency_key)
+
+            return JsonResponse({'success': True, **result.as_dict()})
+
+        except PaymentError as e:
+            return JsonResponse({'success': False, 'error': str(e)})
         except (Payment.DoesNotExist, Customer.DoesNotExist):
             return JsonResponse({'success': False, 'error': 'Record not found'})
         except Exception as e:
@@ -860,10 +821,33 @@ def process_payment(request):
 
 @login_required
 @admin_required
-def report_view(request):
-    today = timezone.localdate()
-    customers = Customer.objects.select_related('room').prefetch_related('payments').all()
+def process_payments_api(request):
+    """
+    Records several payments in one transaction. Expects a JSON body like
+    {"payments": [{"customer_id": 1, "amount_received": "1500.00",
+    "remarks": "GCash", "idempotency_key": "..."}, ...]} and answers with
+    one result per entry, in order.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'}, status=405)
+    try:
+        entries = json.loads(request.body)['payments']
+        if not isinstance(entries, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid request body'}, status=400)
+    try:
+        with transaction.atomic():
+            results = record_payments(entries)
+    except IntegrityError:
+        # A concurrent request committed one of the idempotency keys first; replay it
+        with transaction.atomic():
+            results = record_payments(entries)
+    return JsonResponse({'success': True, 'results': results})
 
+@login_required
+@admin_required
+def report_view(request):
     # Filters
     room_id = request.GET.get('room')
     date_from = request.GET.get('date_from')
@@ -871,107 +855,20 @@ def report_view(request):
     customer_name = request.GET.get('customer_name')
     status_filter = request.GET.get('status')
 
-    if room_id:
-        customers = customers.filter(room__id=room_id)
-    if customer_name:
-        customers = customers.filter(name__icontains=customer_name)
-
-    rows = []
-    total_collected = 0
-
-    if date_from or date_to:
-        # Date Filter Active: Show payments in range
-        payments = Payment.objects.filter(is_paid=True).select_related('customer', 'customer__room')
-        
-        if date_from:
-            payments = payments.filter(date_paid__gte=date_from)
-        if date_to:
-            payments = payments.filter(date_paid__lte=date_to)
-            
-        # Apply customer/room filters to payments as well
-        if room_id:
-            payments = payments.filter(customer__room__id=room_id)
-        if customer_name:
-            payments = payments.filter(customer__name__icontains=customer_name)
-            
-        for p in payments:
-            c = p.customer
-            total_collected += (p.amount_received or 0)
-            
-            rows.append({
-                'customer_id': c.pk,
-                'name': c.name,
-                'contact_number': c.contact_number,
-                'parents_name': c.parents_name,
-                'parents_contact_number': c.parents_contact_number,
-                'room_no': c.room.room_number if c.room else (c.room_no or "-"),
-                'date_entry': c.date_entry,
-                'due_date': p.due_date, # Show the due date this payment was for
-                'paid_amount': p.amount_received or 0,
-                'date_amount_paid': p.date_paid,
-                'remarks': p.remarks or "",
-                'status': "Paid", # It's a paid record
-            })
-            
-    else:
-        # No Date Filter: Show Status of all customers (Default View)
-        for c in customers:
-            price = c.room.price if c.room else 0
-            # Consider all paid payments for this customer when computing collected amount and status
-            cycle_qs = Payment.objects.filter(customer=c, is_paid=True)
-            cycle_sum = cycle_qs.aggregate(Sum('amount_received'))['amount_received__sum'] or 0
-            last_paid = cycle_qs.order_by('-date_paid').first()
-
-            balance = max(price - cycle_sum, 0)
-            if price > 0 and cycle_sum >= price:
-                status = "Paid"
-            elif cycle_sum > 0:
-                status = f"Partially Paid • Balance: ₱{balance}"
-            else:
-                status = "Unpaid"
-
-            total_collected += cycle_sum
-
-            rows.append({
-                'customer_id': c.pk,
-                'name': c.name,
-                'contact_number': c.contact_number,
-                'parents_name': c.parents_name,
-                'parents_contact_number': c.parents_contact_number,
-                'room_no': c.room.room_number if c.room else (c.room_no or "-"),
-                'date_entry': c.date_entry,
-                'due_date': c.due_date,
-                'paid_amount': cycle_sum,
-                'date_amount_paid': last_paid.date_paid if last_paid else None,
-                'remarks': last_paid.remarks if last_paid and last_paid.remarks else "",
-                'status': status,
-            })
-
-    # Apply Status Filter
-    if status_filter:
-        filtered_rows = []
-        for r in rows:
-            if status_filter == 'Partially Paid':
-                if 'Partially Paid' in r['status']:
-                    filtered_rows.append(r)
-            elif r['status'] == status_filter:
-                filtered_rows.append(r)
-        rows = filtered_rows
-        # Recompute total collected for filtered view
-        total_collected = sum(r['paid_amount'] for r in rows)
-
-    total_amount = "{:,.2f}".format(total_collected)
+    # First window of the table and the filtered totals, built by the same code as report_api
+    initial_page = _report_page(request.GET, 'default', 'asc', None, REPORT_PAGE_SIZE)
 
     # Get all rooms for the filter dropdown
     rooms = Room.objects.all().order_by('room_number')
 
     context = {
-        'rows': rows,
-        'total_amount': total_amount,
+        'initial_page': initial_page,
+        'total_amount': "{:,.2f}".format(Decimal(initial_page['total_collected'])),
         'rooms': rooms,
         # Pass back filter values to keep them in the form
         'filter_room': int(room_id) if room_id else '',
         'filter_status': status_filter,
+        'status_filters': [(key, STATUS_LABELS[priority]) for priority, key in STATUS_KEYS.items()],
         'filter_date_from': date_from,
         'filter_date_to': date_to,
         'filter_name': customer_name,
@@ -979,34 +876,121 @@ def report_view(request):
     return render(request, 'Payment_Scheduler/report.html', context)
 
 
+@login_required
+@admin_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag)
+def report_api(request):
+    """Windows of the report table, with the report page's filters plus sort, direction and cursor."""
+    try:
+        limit = min(int(request.GET.get('limit', REPORT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    sort = request.GET.get('sort', 'default')
+    direction = request.GET.get('direction', 'asc')
+    if sort not in REPORT_SORT_KEYS or direction not in ('asc', 'desc'):
+        return JsonResponse({'error': 'Invalid sort'}, status=400)
+    try:
+        return JsonResponse(_report_page(request.GET, sort, direction, request.GET.get('cursor'), limit))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+
+def _report_page(filters, sort, direction, cursor, limit):
+    """
+    One keyset page of report rows, shared by report_view and report_api.
+    With a date range the rows are paid payments, otherwise one row per
+    customer. The row count and total collected are SQL aggregates over the
+    whole filtered set, computed for the first page only.
+    """
+    room_id = filters.get('room')
+    date_from = filters.get('date_from')
+    date_to = filters.get('date_to')
+    customer_name = filters.get('customer_name')
+    status = filters.get('status')
+
+    version = DataVersion.current()
+    by_payment = bool(date_from or date_to)
+    if by_payment:
+        qs = _report_payments(date_from, date_to, room_id, customer_name, status)
+        totals = None if cursor else qs.aggregate(count=Count('pk'), total=Sum('amount_received'))
+        serialize = _report_payment_row
+    else:
+        ensure_billing_states()
+        qs = _report_customers(room_id, customer_name, status)
+        totals = None if cursor else qs.aggregate(count=Count('pk'), total=Sum('paid_total'))
+        serialize = _report_customer_row
+
+    paths = REPORT_SORT_KEYS[sort][1 if by_payment else 0]
+    rows, next_cursor = keyset_page(qs, [(path, direction == 'desc') for path in paths], cursor, limit)
+    return {
+        'rows': [serialize(row) for row in rows],
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'count': None if cursor else totals['count'],
+        'total_collected': None if cursor else f"{totals['total'] or 0:.2f}",
+        'version': version,
+    }
+
+
+def _report_customer_row(customer):
+    """Serializes a customer from _report_customers()."""
+    price = customer.room.price if customer.room else 0
+    state = customer.billing_state
+    return {
+        'customer_id': customer.pk,
+        'name': customer.name,
+        'contact_number': customer.contact_number or "",
+        'parents_name': customer.parents_name or "",
+        'room_no': customer.room.room_number if customer.room else "-",
+        'date_entry': _report_date(customer.date_entry),
+        'due_date': _report_date(customer.due_date),
+        'paid_amount': f"{customer.paid_total:.2f}",
+        'status': status_text(customer.billing_status, state.cycle_paid if state else 0, price or 0),
+        'date_amount_paid': _report_date(customer.last_date_paid),
+        'remarks': customer.last_remarks or "",
+    }
+
+
+def _report_payment_row(payment):
+    """Serializes a payment from _report_payments(); every one is a paid record."""
+    customer = payment.customer
+    return {
+        'customer_id': customer.pk,
+        'name': customer.name,
+        'contact_number': customer.contact_number or "",
+        'parents_name': customer.parents_name or "",
+        'room_no': customer.room.room_number if customer.room else "-",
+        'date_entry': _report_date(customer.date_entry),
+        # The due date this payment was for
+        'due_date': _report_date(payment.due_date),
+        'paid_amount': f"{payment.amount_received or 0:.2f}",
+        'status': "Paid",
+        'date_amount_paid': _report_date(payment.date_paid),
+        'remarks': payment.remarks or "",
+    }
+
+
+def _report_date(value):
+    return value.strftime('%b %d, %Y') if value else None
+
+
 @login_required
 @admin_required
 def customer_payment_history(request, customer_id):
-    customer = get_object_or_404(Customer, pk=customer_id)
-    payments = Payment.objects.filter(customer=customer).values('due_date').annotate(
-        total_paid=Coalesce(Sum('amount_received'), Value(0, output_field=DecimalField())),
-        last_paid=Max('date_paid'),
-        amount_due=Coalesce(Max('amount'), Value(0, output_field=DecimalField())),
-    ).order_by('due_date')
+    customer = get_object_or_404(Customer.objects.select_related('room'), pk=customer_id)
 
     history = []
-    for p in payments:
-        due_date = p['due_date']
-        amount_due = p['amount_due'] or Decimal('0')
-        total_paid = p['total_paid'] or Decimal('0')
-        if amount_due > 0 and total_paid >= amount_due:
-            status = "Paid"
-        elif total_paid > 0:
-            status = "Partially Paid"
-        else:
-            status = "Unpaid"
+    for cycle in _billing_cycles(customer.pk):
+        due_date = cycle.due_date
         history.append({
-            'due_date': due_date.strftime('%Y-%m-%d') if due_date else None,
-            'month_label': due_date.strftime('%b %Y') if due_date else "N/A",
-            'amount_due': f"{amount_due:.2f}",
-            'total_paid': f"{total_paid:.2f}",
-            'last_paid': p['last_paid'].strftime('%Y-%m-%d') if p['last_paid'] else None,
-            'status': status,
+            'due_date': due_date.strftime('%Y-%m-%d'),
+            'month_label': due_date.strftime('%b %Y'),
+            'amount_due': f"{cycle.amount_due:.2f}",
+            # Transfer credit on an unpaid row counts toward the cycle, as the status does
+            'total_paid': f"{cycle.total_received + cycle.total_credited:.2f}",
+            'last_paid': cycle.last_paid.strftime('%Y-%m-%d') if cycle.last_paid else None,
+            'status': cycle.status,
         })
 
     return JsonResponse({
@@ -1019,36 +1003,72 @@ def customer_payment_history(request, customer_id):
     })
 
 
+@login_required
+@admin_required
+def customer_ledger(request, customer_id):
+    """
+    The customer's balance and a page of their ledger statement, oldest
+    first. Pass the returned next_after as ?after= for the following page.
+    """
+    customer = get_object_or_404(Customer.objects.select_related('ledger_account'), pk=customer_id)
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = min(int(request.GET.get('limit', 100)), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid paging parameters'}, status=400)
+
+    entries = list(_ledger_entries(customer.pk, after)[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    account = getattr(customer, 'ledger_account', None) or LedgerAccount(customer=customer)
+    return JsonResponse({
+        'customer': {'id': customer.pk, 'name': customer.name},
+        'balance': f"{account.balance:.2f}",
+        'arrears': f"{account.arrears(timezone.localdate()):.2f}",
+        'entries': [{
+            'seq': entry.seq,
+            'kind': entry.kind,
+            'amount': f"{entry.amount:.2f}",
+            'balance': f"{entry.balance:.2f}",
+            'due_date': entry.due_date.strftime('%Y-%m-%d') if entry.due_date else None,
+            'memo': entry.memo,
+            'posted': timezone.localtime(entry.created_at).strftime('%Y-%m-%d %H:%M'),
+        } for entry in entries],
+        'next_after': entries[-1].seq if has_more else None,
+    })
+
+
+def _ledger_entries(customer_id, after=0):
+    """A range scan on the (customer, seq) unique index."""
+    return LedgerEntry.objects.filter(customer_id=customer_id, seq__gt=after).order_by('seq')
+
+
 @login_required
 @admin_required
 def customer_payment_receipt(request, customer_id, due_date):
-    customer = get_object_or_404(Customer, pk=customer_id)
     try:
         target_date = date.fromisoformat(due_date)
     except ValueError:
         return JsonResponse({'error': 'Invalid date format'}, status=400)
 
-    payments = Payment.objects.filter(customer=customer, due_date=target_date, is_paid=True).order_by('date_paid', 'pk')
-    if not payments.exists():
+    # One query: the cycle's paid rows joined to the customer, room and the cycle's BillingCycle totals
+    payments = list(
+        Payment.objects.filter(customer_id=customer_id, due_date=target_date, is_paid=True)
+        .annotate(cycle=FilteredRelation(
+            'customer__billing_cycles', condition=Q(customer__billing_cycles__due_date=target_date),
+        ))
+        .annotate(
+            cycle_amount_due=F('cycle__amount_due'), cycle_total_received=F('cycle__total_received'),
+            cycle_total_change=F('cycle__total_change'), cycle_last_paid=F('cycle__last_paid'),
+            cycle_status=F('cycle__status'),
+        )
+        .select_related('customer__room').order_by('date_paid', 'pk')
+    )
+    if not payments:
+        get_object_or_404(Customer, pk=customer_id)
         return JsonResponse({'error': 'No payments found for this record.'}, status=404)
-
-    amount_due = payments.aggregate(
-        amount=Coalesce(Max('amount'), Value(0, output_field=DecimalField()))
-    )['amount'] or Decimal('0')
-    total_paid = payments.aggregate(
-        total=Coalesce(Sum('amount_received'), Value(0, output_field=DecimalField()))
-    )['total'] or Decimal('0')
-    change_total = payments.aggregate(
-        total=Coalesce(Sum('change_amount'), Value(0, output_field=DecimalField()))
-    )['total'] or Decimal('0')
-    last_paid = payments.aggregate(last=Max('date_paid'))['last']
-
-    if amount_due > 0 and total_paid >= amount_due:
-        status = "Paid"
-    elif total_paid > 0:
-        status = "Partially Paid"
-    else:
-        status = "Unpaid"
+    customer = payments[0].customer
+    totals = payments[0]
 
     combined_remarks_parts = []
     items = []
@@ -1068,11 +1088,11 @@ def customer_payment_receipt(request, customer_id, due_date):
 
     return JsonResponse({
         'receipt_number': receipt_number,
-        'transaction_time': last_paid.strftime('%Y-%m-%d') if last_paid else None,
-        'amount_due': f"{amount_due:.2f}",
-        'total_paid': f"{total_paid:.2f}",
-        'change': f"{change_total:.2f}",
-        'status': status,
+        'transaction_time': totals.cycle_last_paid.strftime('%Y-%m-%d') if totals.cycle_last_paid else None,
+        'amount_due': f"{totals.cycle_amount_due:.2f}",
+        'total_paid': f"{totals.cycle_total_received:.2f}",
+        'change': f"{totals.cycle_total_change:.2f}",
+        'status': totals.cycle_status,
         'customer': {
             'id': customer.pk,
             'name': customer.name,
@@ -1087,23 +1107,104 @@ def customer_payment_receipt(request, customer_id, due_date):
         'items': items,
     })
 
+def _billing_cycles(customer_id):
+    """The customer's cycles in due date order, read from the (customer, due_date) unique index."""
+    return BillingCycle.objects.filter(customer_id=customer_id).order_by('due_date')
+
+def _report_payments(date_from, date_to, room_id=None, customer_name=None, status=None):
+    """Paid payments in a date_paid range, for the report's date-filtered view."""
+    payments = Payment.objects.filter(is_paid=True).select_related('customer', 'customer__room')
+    # Every row here is a paid record
+    if status and status != STATUS_KEYS[PAID]:
+        return payments.none()
+
+    if date_from:
+        payments = payments.filter(date_paid__gte=date_from)
+    if date_to:
+        payments = payments.filter(date_paid__lte=date_to)
+
+    # Apply customer/room filters to payments as well
+    if room_id:
+        payments = payments.filter(customer__room__id=room_id)
+    if customer_name:
+        payments = payments.filter(customer__name__icontains=customer_name)
+    return payments
+
+
+@login_required
+@admin_required
+def report_export(request):
+    """The report as CSV, with the same filters as report_view."""
+    room_id = request.GET.get('room')
+    date_from = request.GET.get('date_from')
+    date_to = request.GET.get('date_to')
+    customer_name = request.GET.get('customer_name')
+    status_filter = request.GET.get('status')
+
+    header = ['Customer ID', 'Name', 'Contact Number', "Parent's Name", "Parent's Contact Number", 'Room No.',
+              'Date Entry', 'Due Date', 'Paid Amount', 'Date Paid', 'Remarks', 'Status']
+    if date_from or date_to:
+        rows = _report_payments(date_from, date_to, room_id, customer_name, status_filter).order_by('date_paid', 'pk').values_list(
+            'customer__pk', 'customer__name', 'customer__contact_number', 'customer__parents_name',
+            'customer__parents_contact_number', 'customer__room__room_number', 'customer__date_entry',
+            'due_date', 'amount_received', 'date_paid', 'remarks',
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        rows = ((*row[:5], row[5] or '-', *row[6:8], row[8] or 0, row[9], row[10] or '', 'Paid') for row in rows)
+    else:
+        ensure_billing_states()
+        rows = (
+            (*row[:5], row[5] or '-', *row[7:11], row[11] or '', status_text(row[12], row[13] or 0, row[6] or 0))
+            for row in _report_customer_rows(room_id, customer_name, status_filter).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+    return _csv_response('payment_report.csv', header, rows)
+
+
+def _report_customers(room_id=None, customer_name=None, status=None):
+    """
+    Customers for the report's default view, annotated with their all-time
+    paid total, the latest paid payment's date and remarks, and their
+    billing status from with_billing_status. `status` is a status key, as
+    on the dashboard; the filter is applied in SQL.
+    """
+    paid = Payment.objects.filter(customer=OuterRef('pk'), is_paid=True)
+    paid_total = paid.values('customer').annotate(total=Sum('amount_received')).values('total')
+    latest = paid.order_by('-date_paid')
+    customers = Customer.objects.select_related('room', 'billing_state')
+    if room_id:
+        customers = customers.filter(room__id=room_id)
+    if customer_name:
+        customers = customers.filter(name__icontains=customer_name)
+    customers = with_billing_status(customers.annotate(
+        paid_total=Coalesce(Subquery(paid_total), Value(0, output_field=DecimalField())),
+        last_date_paid=Subquery(latest.values('date_paid')[:1]),
+        last_remarks=Subquery(latest.values('remarks')[:1]),
+    ))
+    if status:
+        if status not in STATUS_BY_KEY:
+            return customers.none()
+        customers = customers.filter(billing_status=STATUS_BY_KEY[status])
+    return customers
+
+
+def _report_customer_rows(room_id=None, customer_name=None, status=None):
+    """_report_customers() as values tuples in primary key order, for the CSV export."""
+    return _report_customers(room_id, customer_name, status).order_by('pk').values_list(
+        'pk', 'name', 'contact_number', 'parents_name', 'parents_contact_number', 'room__room_number',
+        'room__price', 'date_entry', 'due_date', 'paid_total', 'last_date_paid', 'last_remarks',
+        'billing_status', 'billing_state__cycle_paid',
+    )
+
+
 @login_required
 @admin_required
 def transfer_report_view(request):
-    transfers = RoomTransferHistory.objects.select_related('customer', 'room_from', 'room_to').all().order_by('-transfer_date')
-    
     # Filters
     customer_name = request.GET.get('customer_name')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
-    
-    if customer_name:
-        transfers = transfers.filter(customer__name__icontains=customer_name)
-    if date_from:
-        transfers = transfers.filter(transfer_date__date__gte=date_from)
-    if date_to:
-        transfers = transfers.filter(transfer_date__date__lte=date_to)
-        
+
+    transfers = _transfer_history(customer_name, date_from, date_to)
+
     context = {
         'transfers': transfers,
         'filter_name': customer_name,
@@ -1111,3 +1212,74 @@ def transfer_report_view(request):
         'filter_date_to': date_to,
     }
     return render(request, 'Payment_Scheduler/transfer_report.html', context)
+
+
+@login_required
+@admin_required
+def transfer_report_export(request):
+    transfers = _transfer_history(
+        request.GET.get('customer_name'), request.GET.get('date_from'), request.GET.get('date_to')
+    ).values_list(
+        'transfer_date', 'customer__name', 'room_from__room_number', 'room_from_price',
+        'room_to__room_number', 'room_to_price',
+    )
+    header = ['Transfer Date', 'Customer', 'From Room', 'From Price', 'To Room', 'To Price']
+    rows = (
+        (timezone.localtime(date).strftime('%Y-%m-%d %H:%M'), name, room_from or '-', price_from, room_to or '-', price_to)
+        for date, name, room_from, price_from, room_to, price_to in transfers.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    return _csv_response('room_transfers.csv', header, rows)
+
+
+def _transfer_history(customer_name=None, date_from=None, date_to=None):
+    """
+    Transfers newest first. Date filters compare transfer_date against the
+    local day's bounds instead of transfer_date__date, which SQLite evaluates
+    per row and so cannot serve from the transfer_date index.
+    """
+    transfers = RoomTransferHistory.objects.select_related('customer', 'room_from', 'room_to').order_by('-transfer_date')
+
+    if customer_name:
+        transfers = transfers.filter(customer__name__icontains=customer_name)
+    start = _parse_day(date_from)
+    if start:
+        transfers = transfers.filter(transfer_date__gte=_day_start(start))
+    end = _parse_day(date_to)
+    if end:
+        transfers = transfers.filter(transfer_date__lt=_day_start(end + timedelta(days=1)))
+    return transfers
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value) if value else None
+    except ValueError:
+        return None
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class _Echo:
+    """A file-like object for csv.writer that hands each line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_response(filename, header, rows):
+    """
+    Streams `rows` as a CSV download, one line at a time, so memory use does
+    not grow with the export. The byte order mark lets Excel read the ₱ sign.
+    """
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield '\ufeff' + writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response